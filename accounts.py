@@ -0,0 +1,336 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Union
+
+import config
+from notifier import HeadlessNotifier, Notifier, RemoteNotifier, Win11Notifier
+
+
+class _Worker:
+
+    def __init__(self, name: str, index: int) -> None:
+        self.name = name
+        self.index = index
+        self.process: Any = None
+        self.conn: Any = None
+        self.started = 0.0
+        self.crashes = 0
+        self.restart_at: Union[float, None] = None
+        self.send_lock = threading.Lock()
+
+
+class Supervisor:
+    """Run several accounts, each in a worker process of its own, and show
+    their notifications.
+
+    Each worker runs `server` in its own folder under `folder`, so that every
+    file of the program, from the login cache to the attachments and the
+    recent chats, is kept apart, and the accounts use separate cores. The
+    notifications of a worker are forwarded to the supervisor, which shows
+    them with the notifier of the account, titled with its name. A worker
+    that crashes is started again after `backoff` seconds, doubled after each
+    further crash up to `max_backoff` and reset once a worker has run for
+    `stable_time` seconds. A worker whose account logged out is not started
+    again.
+    """
+
+    def __init__(self,
+                 accounts: Dict[str, dict],
+                 folder: str = 'Accounts',
+                 backoff: float = 5.0,
+                 max_backoff: float = 300.0,
+                 stable_time: float = 600.0,
+                 setup: Union[Callable[[], Any], None] = None) -> None:
+        """Create a supervisor. Call `start` to start the workers.
+
+        Args:
+            accounts (Dict[str, dict]): The settings of `config` each account
+                overrides, by account name.
+            folder (str, optional): The folder holding the folder of each
+                account. Defaults to 'Accounts'.
+            backoff (float, optional): Seconds before a crashed worker is
+                started again. Defaults to 5.0.
+            max_backoff (float, optional): Maximum seconds before a crashed
+                worker is started again. Defaults to 300.0.
+            stable_time (float, optional): Seconds a worker must run for its
+                crashes to be forgotten. Defaults to 600.0.
+            setup (Union[Callable[[], Any], None], optional): Called first
+                in each worker, before any module of the program is imported.
+                It must be picklable. Defaults to None.
+        """
+        self.accounts = accounts
+        self.folder = os.path.abspath(folder)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.setup = setup
+        self.notifier = make_notifier('Ramox')
+        self.notifiers: Dict[str, Notifier] = {
+            name: make_notifier(f'WeChat ({name})')
+            for name in accounts
+        }
+        self.workers = {
+            name: _Worker(name, i)
+            for i, name in enumerate(accounts)
+        }
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._done = threading.Event()
+
+    def join(self, timeout: Union[float, None] = None) -> bool:
+        """Wait until every account has logged out or the supervisor stopped.
+
+        Args:
+            timeout (Union[float, None], optional): Maximum seconds to wait.
+                Defaults to None, waiting for ever.
+
+        Returns:
+            bool: True if no worker is left.
+        """
+        return self._done.wait(timeout)
+
+    def overrides(self, name: str) -> dict:
+        """Get the settings of `config` a worker overrides. METRICS_PORT and
+        API_PORT are offset by the position of the account, so that the
+        workers do not listen on the same port, unless the account sets them.
+
+        Args:
+            name (str): The name of the account.
+
+        Returns:
+            dict: The settings by name.
+        """
+        values = {}
+        for key in ('METRICS_PORT', 'API_PORT'):
+            port = getattr(config, key)
+            if port:
+                values[key] = port + self.workers[name].index
+        values.update(self.accounts[name])
+        return values
+
+    def run_dialog(self, step: str = 'send_msg') -> None:
+        """Start a dialog in one of the accounts, asking which one first when
+        several are running.
+
+        Args:
+            step (str, optional): The name of the first step of the dialog.
+                Defaults to 'send_msg'.
+        """
+        with self._lock:
+            running = [
+                name for name, worker in self.workers.items()
+                if worker.conn is not None
+            ]
+        if not running:
+            self.notifier.notify('No account is running.')
+            return
+        name = running[0]
+        if len(running) > 1:
+            res = self.notifier.toast('Which account?',
+                                      selection=running,
+                                      buttons=['Next'])
+            if res.get('arguments') != 'http:Next':
+                return
+            name = res.get('user_input', {}).get('selection', name)
+        self._send(self.workers[name], ('dialog', step))
+
+    def start(self) -> None:
+        """Start a worker for each account and watch them on a background
+        thread.
+        """
+        for worker in self.workers.values():
+            self._start(worker)
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop every worker. A worker is asked to exit, and is terminated if
+        it has not exited in time.
+
+        Args:
+            timeout (float, optional): Seconds to wait for each worker.
+                Defaults to 10.0.
+        """
+        with self._lock:
+            self._stopping = True
+            workers = list(self.workers.values())
+        for worker in workers:
+            self._send(worker, ('stop', ))
+        for worker in workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+        self._done.set()
+
+    def _exited(self, worker: _Worker, now: float) -> None:
+        code = worker.process.exitcode
+        worker.conn = None
+        if code == 0:
+            del self.workers[worker.name]
+            self.notifier.notify(f'{worker.name} logged out.')
+            return
+        if now - worker.started >= self.stable_time:
+            worker.crashes = 0
+        delay = min(self.backoff * 2**worker.crashes, self.max_backoff)
+        worker.crashes += 1
+        worker.restart_at = now + delay
+        self.notifier.notify(f'{worker.name} stopped with exit code {code}, '
+                             f'restarting in {delay:.0f} s.')
+
+    def _route(self, worker: _Worker, conn: Any) -> None:
+        notifier = self.notifiers[worker.name]
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                return
+            if message[0] == 'toast':
+                threading.Thread(target=self._toast,
+                                 args=(worker, conn, notifier, *message[1:]),
+                                 daemon=True).start()
+            else:
+                getattr(notifier, message[0])(*message[1:])
+
+    def _send(self, worker: _Worker, message: tuple, conn: Any = None) -> None:
+        with worker.send_lock:
+            try:
+                (conn or worker.conn).send(message)
+            except (AttributeError, OSError, ValueError):
+                pass
+
+    def _start(self, worker: _Worker) -> None:
+        conn, child = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(os.path.join(self.folder, worker.name),
+                  self.overrides(worker.name), child, self.setup),
+            name=f'ramox-{worker.name}',
+            daemon=True)
+        worker.process.start()
+        child.close()
+        worker.conn = conn
+        worker.started = time.monotonic()
+        worker.restart_at = None
+        threading.Thread(target=self._route,
+                         args=(worker, conn),
+                         daemon=True).start()
+
+    def _toast(self, worker: _Worker, conn: Any, notifier: Notifier, id: int,
+               text: str, kwargs: dict) -> None:
+        self._send(worker, ('result', id, notifier.toast(text, **kwargs)),
+                   conn)
+
+    def _watch(self) -> None:
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+                if not self.workers:
+                    self._done.set()
+                    return
+                now = time.monotonic()
+                for worker in list(self.workers.values()):
+                    if worker.conn is not None:
+                        if worker.process.exitcode is not None:
+                            self._exited(worker, now)
+                    elif worker.restart_at is not None and (
+                            now >= worker.restart_at):
+                        self._start(worker)
+                sentinels = [
+                    worker.process.sentinel
+                    for worker in self.workers.values()
+                    if worker.conn is not None
+                ]
+            multiprocessing.connection.wait(sentinels, timeout=1.0)
+
+
+def make_notifier(title: str) -> Notifier:
+    """Create the notifier chosen by `config.NOTIFIER`.
+
+    Args:
+        title (str): The title of the notifications.
+
+    Returns:
+        Notifier: The notifier.
+    """
+    if config.NOTIFIER == 'headless':
+        return HeadlessNotifier()
+    return Win11Notifier(title)
+
+
+def run_worker(folder: str,
+               overrides: dict,
+               conn: Any,
+               setup: Union[Callable[[], Any], None] = None) -> None:
+    """Run the program for one account in this process until the account
+    logs out, or the supervisor stops the worker or exits.
+
+    Args:
+        folder (str): The folder of the account, made the working directory.
+        overrides (dict): The settings of `config` to override.
+        conn (multiprocessing.connection.Connection): The connection to the
+            supervisor.
+        setup (Union[Callable[[], Any], None], optional): Called first.
+            Defaults to None.
+    """
+    if setup is not None:
+        setup()
+    os.makedirs(folder, exist_ok=True)
+    os.chdir(folder)
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    import server
+    import utils
+
+    def command(message: tuple) -> None:
+        if message[0] == 'dialog':
+            threading.Thread(target=server.run_dialog,
+                             args=(message[1], ),
+                             daemon=True).start()
+        elif message[0] == 'stop':
+            done.set()
+
+    def join() -> None:
+        server.bot.join()
+        done.set()
+
+    done = threading.Event()
+    utils.use_backends(
+        RemoteNotifier(conn, on_command=command, on_close=done.set))
+    server.login()
+    server.start()
+    threading.Thread(target=join, daemon=True).start()
+    done.wait()
+
+
+def main() -> None:
+    """Run the accounts of `config.ACCOUNTS` until they all log out, with the
+    hotkey of the send dialog.
+    """
+    import keyboard
+    supervisor = Supervisor(config.ACCOUNTS,
+                            folder=config.ACCOUNTS_DIR,
+                            backoff=config.ACCOUNT_BACKOFF,
+                            max_backoff=config.ACCOUNT_MAX_BACKOFF,
+                            stable_time=config.ACCOUNT_STABLE_TIME)
+    supervisor.start()
+    keyboard.add_hotkey('ctrl+alt+w',
+                        supervisor.run_dialog,
+                        args=('send_msg', ))
+    try:
+        supervisor.join()
+    finally:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Union
+
+import metrics
+
+
+class ApiServer:
+    """A local JSON API over HTTP, for scripts and other services.
+
+    Requests are POSTed to '/' as JSON, either one call or a list of calls
+    answered by a list of results in the same order. A call is an object with
+    the 'method' to call, its keyword 'params' and an optional 'id' copied to
+    the result. A result has either a 'result' or an 'error'. Connections are
+    kept alive between requests and each connection is served on its own
+    thread.
+
+    Only requests with a JSON content type are accepted, so that web pages
+    cannot post to the API without a preflight the API never answers, and a
+    bearer token can be required on top of that.
+    """
+
+    def __init__(self,
+                 methods: Dict[str, Callable[..., Any]],
+                 port: int,
+                 host: str = '127.0.0.1',
+                 token: Union[str, None] = None) -> None:
+        """Create the server. Call `start` to serve requests.
+
+        Args:
+            methods (Dict[str, Callable[..., Any]]): The methods by name.
+            port (int): The port to listen on.
+            host (str, optional): The address to listen on. Defaults to
+                '127.0.0.1'.
+            token (Union[str, None], optional): The token clients must send
+                as 'Authorization: Bearer <token>'. Defaults to None.
+        """
+        self.methods = methods
+        self.token = token
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(
+                    int(self.headers.get('Content-Length', 0)))
+                if api.token is not None and self.headers.get(
+                        'Authorization') != f'Bearer {api.token}':
+                    self._reply(401, {'error': 'Unauthorized'})
+                elif not self.headers.get('Content-Type',
+                                          '').startswith('application/json'):
+                    self._reply(415, {'error': 'Expected application/json'})
+                else:
+                    try:
+                        request = json.loads(body)
+                    except ValueError as e:
+                        self._reply(400, {'error': f'Invalid JSON: {e}'})
+                        return
+                    if isinstance(request, list):
+                        self._reply(200, [api.call(item) for item in request])
+                    else:
+                        self._reply(200, api.call(request))
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _reply(self, status: int, data: Any) -> None:
+                body = json.dumps(data, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+    def call(self, request: Any) -> dict:
+        """Call a method.
+
+        Args:
+            request (Any): The call, an object with 'method', 'params' and
+                'id'.
+
+        Returns:
+            dict: The result.
+        """
+        if not isinstance(request, dict):
+            return {'error': 'A call must be an object'}
+        result = {'id': request.get('id')}
+        method = self.methods.get(request.get('method'))
+        if method is None:
+            result['error'] = f'Unknown method: {request.get("method")}'
+            return result
+        try:
+            with metrics.span('api_' + request['method']):
+                result['result'] = method(**request.get('params', {}))
+        except Exception as e:
+            metrics.error('api')
+            result['error'] = str(e) or type(e).__name__
+        return result
+
+    def start(self) -> None:
+        """Serve requests on a background thread.
+        """
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving requests.
+        """
+        self._server.shutdown()
+        self._server.server_close()
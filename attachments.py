@@ -0,0 +1,358 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Set, Tuple, Union
+
+from downloads import Downloader
+import metrics
+
+
+def hash_file(file: str, chunk_size: int = 1 << 20) -> str:
+    """Compute the SHA-256 digest of a file.
+
+    Args:
+        file (str): The path of the file.
+        chunk_size (int, optional): Bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AttachmentStore:
+    """Download message attachments once and keep them in a bounded folder.
+
+    Files are stored as `<shard>/<digest>_<file name>`, where the digest is
+    taken from the content and the shard is its first two characters, so two
+    messages sharing a file name never overwrite each other, identical
+    contents are stored only once and no folder grows too large. Downloads
+    already in progress are shared by every caller asking for the same
+    message. Small previews of images are kept in `.thumbs` under the same
+    digest.
+
+    When the folder grows beyond `max_bytes`, the least recently used files
+    are removed, and `compact` also removes the files unused for `max_age`.
+    Pinned files and files used in the last `min_age` seconds are never
+    removed. The last use of a file is kept as its modification time, so
+    that the order survives a restart.
+    """
+
+    def __init__(self,
+                 root: str = 'Files',
+                 max_bytes: int = 1 << 30,
+                 on_download: Union[Callable[[str, str], None], None] = None,
+                 thumbnail_size: Tuple[int, int] = (400, 400),
+                 max_age: Union[float, None] = None,
+                 min_age: float = 3600,
+                 downloader: Union[Downloader, None] = None) -> None:
+        """Create a store. Call `scan` to account for the files already in
+        `root`.
+
+        Args:
+            root (str, optional): The download folder. Defaults to 'Files'.
+            max_bytes (int, optional): Size limit of the folder. Defaults to
+                1 GiB.
+            on_download (Union[Callable[[str, str], None], None], optional):
+                Called with the message id and the path of every attachment
+                once it is stored. Defaults to None.
+            thumbnail_size (Tuple[int, int], optional): Maximum width and
+                height of previews. Defaults to (400, 400).
+            max_age (Union[float, None], optional): Seconds an unused file is
+                kept. Defaults to None, keeping files until the folder is
+                full.
+            min_age (float, optional): Seconds a file is kept after its last
+                use, even when the folder is full. Defaults to 3600.
+            downloader (Union[Downloader, None], optional): Downloads the
+                attachments, resuming and checking them. Defaults to None,
+                downloading them with `msg.get_file`.
+        """
+        self.root = os.path.abspath(root)
+        self.partial = os.path.join(self.root, '.partial')
+        self.thumbs = os.path.join(self.root, '.thumbs')
+        self.thumbnail_size = thumbnail_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_age = min_age
+        self.on_download = on_download
+        self.downloader = downloader
+        self.usage = 0
+        self._lock = threading.Lock()
+        self._files: 'OrderedDict[str, int]' = OrderedDict()
+        self._used: Dict[str, float] = {}
+        self._by_digest: Dict[str, str] = {}
+        self._by_msg: Dict[str, str] = {}
+        self._msgs: Dict[str, Set[str]] = {}
+        self._pending: Dict[str, threading.Event] = {}
+        self._pins_file = os.path.join(self.root, '.pinned.json')
+        os.makedirs(self.partial, exist_ok=True)
+        os.makedirs(self.thumbs, exist_ok=True)
+        try:
+            with open(self._pins_file, encoding='utf-8') as f:
+                self._pinned: Set[str] = set(json.load(f))
+        except (OSError, ValueError, TypeError):
+            self._pinned = set()
+
+    def compact(self) -> Dict[str, int]:
+        """Remove the expired files and the empty shards, enforce the size
+        limit, then remove the previews and partial downloads left behind.
+
+        Returns:
+            Dict[str, int]: The number of files and previews removed.
+        """
+        removed = {'files': 0, 'thumbnails': 0, 'partial': 0}
+        now = time.time()
+        with self._lock:
+            if self.max_age is not None:
+                for file in list(self._files):
+                    if now - self._used[file] <= self.max_age:
+                        break
+                    if self._keep(file, now):
+                        continue
+                    removed['files'] += self._remove(file)
+            before = len(self._files)
+            self._evict(keep='')
+            removed['files'] += before - len(self._files)
+            digests = set(self._by_digest)
+            pending = set(self._pending)
+            for entry in os.scandir(self.root):
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    try:
+                        os.rmdir(entry.path)
+                    except OSError:
+                        pass
+        for entry in os.scandir(self.thumbs):
+            if entry.name.split('.', 1)[0] not in digests:
+                removed['thumbnails'] += _unlink(entry.path)
+        for entry in os.scandir(self.partial):
+            if entry.name not in pending and \
+                    now - entry.stat().st_mtime > 24 * 3600:
+                removed['partial'] += _unlink(entry.path)
+        return removed
+
+    def get(self, msg: Any) -> str:
+        """Get the local path of a message's attachment, downloading it if it
+        is not stored yet.
+
+        Args:
+            msg (wxpy.Message): A message carrying a file.
+
+        Returns:
+            str: The absolute path of the attachment.
+        """
+        key = str(msg.id)
+        while True:
+            with self._lock:
+                file = self._by_msg.get(key)
+                if file is not None and file in self._files:
+                    self._touch(file)
+                    return file
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    break
+            event.wait()
+        try:
+            return self._download(msg, key)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    def pin(self, file: str, pinned: bool = True) -> None:
+        """Keep a file however old it is and however full the folder is, or
+        stop keeping it.
+
+        Args:
+            file (str): The path of the attachment.
+            pinned (bool, optional): Whether to keep the file. Defaults to
+                True.
+        """
+        file = os.path.abspath(file)
+        with self._lock:
+            if pinned:
+                self._pinned.add(file)
+            else:
+                self._pinned.discard(file)
+            temp = self._pins_file + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(sorted(self._pinned), f, ensure_ascii=False)
+            os.replace(temp, self._pins_file)
+
+    def report(self) -> Dict[str, Any]:
+        """Describe the use of the folder.
+
+        Returns:
+            Dict[str, Any]: The number and bytes of the files, of the pinned
+            files and of the previews, the size limit, the age of the least
+            recently used file and the bytes by file extension.
+        """
+        now = time.time()
+        with self._lock:
+            files = dict(self._files)
+            pinned = [file for file in self._pinned if file in files]
+            lru = next(iter(self._files), None)
+            oldest = now - self._used[lru] if lru is not None else 0.0
+        by_extension: Dict[str, int] = {}
+        for file, size in files.items():
+            extension = os.path.splitext(file)[1].lower() or '(none)'
+            by_extension[extension] = by_extension.get(extension, 0) + size
+        thumbs = [entry.stat().st_size for entry in os.scandir(self.thumbs)]
+        return {
+            'files': len(files),
+            'bytes': sum(files.values()),
+            'max_bytes': self.max_bytes,
+            'pinned_files': len(pinned),
+            'pinned_bytes': sum(files[file] for file in pinned),
+            'thumbnails': len(thumbs),
+            'thumbnail_bytes': sum(thumbs),
+            'oldest_use_seconds': oldest,
+            'bytes_by_extension': dict(
+                sorted(by_extension.items(), key=lambda item: -item[1])),
+        }
+
+    def scan(self) -> None:
+        """Account for the files already in the folder, oldest use first.
+        Files stored since the store was created are left as they are.
+        """
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                for item in os.scandir(entry.path):
+                    if item.is_file():
+                        stat = item.stat()
+                        entries.append(
+                            (stat.st_mtime, item.path, stat.st_size))
+            elif entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        with self._lock:
+            known = self._files.copy()
+            self._files.clear()
+            for used, file, size in sorted(entries):
+                if file not in known:
+                    self._add(file, size, used)
+            self._files.update(known)
+
+    def thumbnail(self, msg: Any) -> str:
+        """Get a small preview of a message's image, downloading the image
+        and making the preview the first time.
+
+        Args:
+            msg (wxpy.Message): A message carrying an image.
+
+        Returns:
+            str: The absolute path of the preview, or of the image itself if
+            no preview can be made.
+        """
+        file = self.get(msg)
+        thumb = os.path.join(self.thumbs,
+                             os.path.basename(file).split('_', 1)[0] + '.jpg')
+        if os.path.isfile(thumb):
+            return thumb
+        try:
+            with metrics.span('thumbnail'):
+                from PIL import Image
+                with Image.open(file) as img:
+                    if img.width <= self.thumbnail_size[0] and \
+                            img.height <= self.thumbnail_size[1]:
+                        return file
+                    img.draft('RGB', self.thumbnail_size)
+                    img.thumbnail(self.thumbnail_size)
+                    img.convert('RGB').save(thumb + '.tmp',
+                                            format='JPEG',
+                                            quality=80)
+                os.replace(thumb + '.tmp', thumb)
+        except Exception:
+            metrics.error('thumbnail')
+            return file
+        return thumb
+
+    def _add(self, file: str, size: int, used: float) -> None:
+        self._files[file] = size
+        self._used[file] = used
+        self.usage += size
+        self._by_digest[os.path.basename(file).split('_', 1)[0]] = file
+
+    def _download(self, msg: Any, key: str) -> str:
+        temp = os.path.join(self.partial, key)
+        with metrics.span('get_file'):
+            if self.downloader is None:
+                msg.get_file(temp)
+            else:
+                self.downloader.download(msg, temp)
+        metrics.inc('downloads_total')
+        metrics.inc('download_bytes_total', os.path.getsize(temp))
+        digest = hash_file(temp)[:16]
+        with self._lock:
+            file = self._by_digest.get(digest)
+            if file is not None and file in self._files:
+                os.remove(temp)
+                self._touch(file)
+            else:
+                shard = os.path.join(self.root, digest[:2])
+                os.makedirs(shard, exist_ok=True)
+                file = os.path.join(shard, f'{digest}_{msg.file_name}')
+                os.replace(temp, file)
+                self._add(file, os.path.getsize(file), time.time())
+            self._by_msg[key] = file
+            self._msgs.setdefault(file, set()).add(key)
+            self._evict(keep=file)
+        if self.on_download is not None:
+            self.on_download(key, file)
+        return file
+
+    def _evict(self, keep: str) -> None:
+        if self.usage <= self.max_bytes:
+            return
+        now = time.time()
+        for file in list(self._files):
+            if self.usage <= self.max_bytes or now - self._used[
+                    file] < self.min_age:
+                break
+            if file != keep and not self._keep(file, now):
+                self._remove(file)
+
+    def _keep(self, file: str, now: float) -> bool:
+        return file in self._pinned or now - self._used[file] < self.min_age
+
+    def _remove(self, file: str) -> int:
+        if not _unlink(file) and os.path.exists(file):
+            return 0
+        self.usage -= self._files.pop(file)
+        del self._used[file]
+        digest = os.path.basename(file).split('_', 1)[0]
+        self._by_digest.pop(digest, None)
+        _unlink(os.path.join(self.thumbs, digest + '.jpg'))
+        for key in self._msgs.pop(file, ()):
+            self._by_msg.pop(key, None)
+        return 1
+
+    def _touch(self, file: str) -> None:
+        self._files.move_to_end(file)
+        self._used[file] = time.time()
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+
+
+def _unlink(file: str) -> int:
+    try:
+        os.remove(file)
+        return 1
+    except OSError:
+        return 0
@@ -0,0 +1,175 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import json
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+import metrics
+from outbox import TokenBucket
+from rules import Matcher, message_fields
+
+
+class AutoReplier:
+    """Answer messages automatically from a list of rules.
+
+    A rule has the conditions of a `rules.Matcher`, an optional 'regex' the
+    text must match, a 'reply' template and optional 'replies', templates by
+    chat puid or name used instead of 'reply' in those chats. A 'cooldown' in
+    seconds keeps the rule from answering the same chat again too soon.
+    Templates are formatted with `str.format`: {chat}, {sender} and {text},
+    and for a regex {0} for the whole match, {1} and so on for its groups and
+    its named groups by name.
+
+    The conditions of all rules are checked at once by the matcher, and only
+    the rules matched so far are tried against their regex, in order. A rule
+    with a regex should list keywords its matches contain, so that its regex
+    is tried only on messages containing them. The first matching rule
+    answers. Each chat gets at most `burst` replies at once and `rate`
+    replies per second after that.
+    """
+
+    def __init__(self,
+                 rules: List[dict],
+                 send: Callable[[str, str], Any],
+                 cooldown: float = 300.0,
+                 rate: float = 1 / 60,
+                 burst: int = 3) -> None:
+        """Compile the rules.
+
+        Args:
+            rules (List[dict]): The rules, in order of precedence.
+            send (Callable[[str, str], Any]): Sends a text to a chat given by
+                its puid, without waiting.
+            cooldown (float, optional): Cooldown of the rules without one.
+                Defaults to 300.0.
+            rate (float, optional): Replies per second in each chat. Defaults
+                to one per minute.
+            burst (int, optional): Replies at once in each chat. Defaults to
+                3.
+        """
+        self.rules = rules
+        self.send = send
+        self.cooldown = cooldown
+        self.rate = rate
+        self.burst = burst
+        self._regexes: List[Union[re.Pattern, None]] = []
+        for i, rule in enumerate(rules):
+            if 'reply' not in rule and 'replies' not in rule:
+                raise ValueError(f'No reply in auto-reply rule {i}: {rule}')
+            regex = rule.get('regex')
+            self._regexes.append(
+                re.compile(regex, re.IGNORECASE) if regex else None)
+        self._matcher = Matcher(rules)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._last: Dict[Tuple[int, str], float] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, file: str, send: Callable[[str, str], Any],
+             **kwargs) -> 'AutoReplier':
+        """Load the rules from a JSON file holding a list of rules.
+
+        Args:
+            file (str): The path of the file. A missing file means no rules.
+            send (Callable[[str, str], Any]): Sends a text to a chat given by
+                its puid, without waiting.
+
+        Returns:
+            AutoReplier: The compiled rules.
+        """
+        try:
+            with open(file, encoding='utf-8') as f:
+                return cls(json.load(f), send, **kwargs)
+        except FileNotFoundError:
+            return cls([], send, **kwargs)
+
+    def handle(self, msg: Any) -> Union[str, None]:
+        """Answer a message if a rule matches it.
+
+        Args:
+            msg (wxpy.Message): The message received.
+
+        Returns:
+            Union[str, None]: The reply sent, or None.
+        """
+        if not self.rules:
+            return None
+        text = self.reply(*message_fields(msg))
+        if text is not None:
+            self.send(msg.chat.puid, text)
+        return text
+
+    def reply(self,
+              puid: str,
+              name: str,
+              senders: Tuple[Union[str, None], ...],
+              type: str,
+              text: Union[str, None],
+              now: Union[float, None] = None) -> Union[str, None]:
+        """Get the reply to a message given by its attributes, and count it
+        against the cooldown and the rate of the chat.
+
+        Args:
+            puid (str): The puid of the chat.
+            name (str): The name of the chat.
+            senders (Tuple[Union[str, None], ...]): The puid and names of the
+                sender.
+            type (str): The message type.
+            text (Union[str, None]): The text of the message.
+            now (Union[float, None], optional): The current monotonic time.
+                Defaults to None, reading the clock.
+
+        Returns:
+            Union[str, None]: The reply, or None if no rule answers.
+        """
+        mask = self._matcher.match(puid, name, senders, type, text)
+        while mask:
+            low = mask & -mask
+            mask ^= low
+            i = low.bit_length() - 1
+            regex = self._regexes[i]
+            if regex is None:
+                match = None
+                break
+            match = regex.search(text or '')
+            if match is not None:
+                break
+        else:
+            return None
+        rule = self.rules[i]
+        replies = rule.get('replies', {})
+        template = replies.get(puid) or replies.get(name) or rule.get('reply')
+        if not template:
+            return None
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            last = self._last.get((i, puid))
+            if last is not None and now - last < rule.get(
+                    'cooldown', self.cooldown):
+                return None
+            bucket = self._buckets.get(puid)
+            if bucket is None:
+                bucket = self._buckets[puid] = TokenBucket(
+                    self.rate, self.burst)
+            if not bucket.try_acquire():
+                metrics.inc('autoreplies_limited_total')
+                return None
+            self._last[(i, puid)] = now
+        args = (match.group(0), ) + match.groups() if match else ()
+        kwargs = match.groupdict() if match else {}
+        try:
+            reply = template.format(*args,
+                                    chat=name,
+                                    sender=senders[-1] or '',
+                                    text=text or '',
+                                    **kwargs)
+        except (IndexError, KeyError, TypeError, ValueError):
+            metrics.error('autoreply')
+            return None
+        metrics.inc('autoreplies_total')
+        return reply
@@ -0,0 +1,104 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""Time the local API of the server on the fake bot.
+
+Sends go over one keep-alive connection, one call per request and then in
+batches, and the send queue is drained at the end of each run.
+
+Run with `python -m bench.bench_api --help` for the options.
+"""
+
+import argparse
+import atexit
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import fakes
+
+
+def post(conn: http.client.HTTPConnection, data) -> object:
+    conn.request('POST', '/', json.dumps(data),
+                 {'Content-Type': 'application/json'})
+    return json.loads(conn.getresponse().read())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sends', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=50)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ramox-api-')
+    os.chdir(workdir)
+    fakes.install()
+    import config
+    config.NOTIFIER = 'headless'
+    config.SEND_RATE = 1e6
+    config.SEND_BURST = 1 << 30
+    config.API_PORT = 0
+    import server
+    server.login()
+    server.start()
+    try:
+        while len(server.contacts) < len(server.bot.chats()):
+            time.sleep(0.01)
+        names = [chat.name for chat in server.bot.chats()]
+        conn = http.client.HTTPConnection('127.0.0.1', server.api.port)
+
+        start = time.perf_counter()
+        for i in range(args.lookups):
+            post(conn, {
+                'method': 'chats',
+                'params': {
+                    'keyword': names[i % len(names)]
+                }
+            })
+        lookup = (time.perf_counter() - start) / args.lookups
+        print(f'chats lookup: {lookup * 1e6:8.1f} us/call')
+
+        for batch in (1, args.batch):
+            sent = len(server.bot.sent)
+            start = time.perf_counter()
+            for i in range(0, args.sends, batch):
+                calls = [{
+                    'method': 'send',
+                    'params': {
+                        'chat': names[(i + j) % len(names)],
+                        'payload': 'hello'
+                    },
+                    'id': i + j
+                } for j in range(batch)]
+                results = post(conn, calls if batch > 1 else calls[0])
+                if batch == 1:
+                    results = [results]
+                assert all('result' in result for result in results), results
+            queued = time.perf_counter() - start
+            server.outbox.join()
+            drained = time.perf_counter() - start
+            print(f'batch {batch:3}: queued {args.sends / queued:8,.0f} '
+                  f'sends/s, sent {len(server.bot.sent) - sent} '
+                  f'in {drained:.2f} s')
+        conn.close()
+    finally:
+        server.coalescer.stop()
+        server.dispatcher.stop()
+        server.outbox.stop()
+        server.history.stop()
+        atexit.unregister(server.recent.save)
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""Time `AutoReplier.reply` for growing numbers of rules.
+
+Run with `python -m bench.bench_autoreply [messages]`.
+"""
+
+import random
+import re
+import string
+import sys
+import time
+
+from autoreply import AutoReplier
+
+
+def word() -> str:
+    return ''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 8)))
+
+
+def make_rules(count: int) -> list:
+    rules = []
+    for i in range(count):
+        kind = i % 4
+        keyword = word()
+        if kind == 0:
+            rule = {'keywords': [keyword, word()], 'reply': 'Got it, {sender}.'}
+        elif kind == 1:
+            rule = {
+                'keywords': [keyword],
+                'regex': keyword + r' (\d+)',
+                'reply': 'Order {1} is on its way.'
+            }
+        elif kind == 2:
+            rule = {
+                'chats': [f'chat{random.randrange(1000)}'],
+                'keywords': [keyword],
+                'reply': 'Hello {chat}.',
+                'replies': {
+                    f'chat{random.randrange(1000)}': 'Hi there.'
+                }
+            }
+        else:
+            rule = {
+                'senders': [f'sender{random.randrange(1000)}'],
+                'keywords': [keyword],
+                'reply': '{text}'
+            }
+        rules.append(rule)
+    return rules
+
+
+def naive(rules: list, sample: tuple) -> bool:
+    puid, name, senders, type, text = sample
+    lower = text.lower()
+    for rule in rules:
+        if 'chats' in rule and puid not in rule['chats']:
+            continue
+        if 'senders' in rule and senders[-1] not in rule['senders']:
+            continue
+        if not any(keyword in lower for keyword in rule['keywords']):
+            continue
+        if 'regex' in rule and not re.search(rule['regex'], text):
+            continue
+        return True
+    return False
+
+
+def main(messages: int = 20000) -> None:
+    random.seed(0)
+    samples = []
+    for _ in range(messages):
+        words = [word() for _ in range(random.randint(5, 30))]
+        words.insert(random.randrange(len(words)), str(random.randrange(1000)))
+        samples.append((f'chat{random.randrange(1000)}', 'Chat',
+                        (f'sender{random.randrange(1000)}', ), 'Text',
+                        ' '.join(words)))
+    for count in (0, 10, 100, 1000, 5000, 10000):
+        start = time.perf_counter()
+        replier = AutoReplier(make_rules(count),
+                              send=lambda puid, text: None,
+                              cooldown=0,
+                              rate=1e9,
+                              burst=1 << 30)
+        compiled = time.perf_counter() - start
+        replied = 0
+        start = time.perf_counter()
+        for sample in samples:
+            replied += replier.reply(*sample) is not None
+        elapsed = (time.perf_counter() - start) / messages
+        rules = replier.rules
+        start = time.perf_counter()
+        for sample in samples[:1000]:
+            naive(rules, sample)
+        loop = (time.perf_counter() - start) / 1000
+        print(f'{count:5} rules: compile {compiled * 1e3:7.1f} ms, '
+              f'reply {elapsed * 1e6:5.1f} us/msg, '
+              f'rule by rule {loop * 1e6:8.1f} us/msg, '
+              f'{replied / messages:6.1%} answered')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,90 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""Compare `ContactIndex.search` with a linear `bot.search` on synthetic
+contacts.
+
+Run with `python -m bench.bench_contacts [contacts] [lookups]`.
+"""
+
+import random
+import string
+import sys
+import time
+from typing import Any, List
+
+from contacts import ContactIndex
+
+
+class FakeChat:
+    """A stand-in for `wxpy.Chat` carrying only the searched attributes.
+    """
+
+    def __init__(self, i: int) -> None:
+        pinyin = ''.join(random.choices(string.ascii_lowercase, k=8))
+        self.puid = f'{i:08x}'
+        self.nick_name = f'nick_{pinyin}_{i}'
+        self.remark_name = f'remark_{i}' if i % 3 else ''
+        self.display_name = ''
+        self.name = self.remark_name or self.nick_name
+        self.wxid = None
+        self.raw = {'PYQuanPin': pinyin + str(i), 'PYInitial': pinyin[:3]}
+
+
+def linear_search(chats: List[Any], keywords: str) -> List[Any]:
+    """Search chats the way `wxpy.Chats.search` does.
+
+    Args:
+        chats (List[Any]): All chats.
+        keywords (str): Space separated keywords.
+
+    Returns:
+        List[Any]: Chats whose names contain every keyword.
+    """
+    keywords = keywords.lower().split()
+    found = []
+    for chat in chats:
+        for kw in keywords:
+            for attr in ('remark_name', 'display_name', 'nick_name', 'wxid'):
+                if kw in str(getattr(chat, attr, '') or '').lower():
+                    break
+            else:
+                break
+        else:
+            found.append(chat)
+    return found
+
+
+def main(size: int = 10000, lookups: int = 200) -> None:
+    random.seed(0)
+    chats = [FakeChat(i) for i in range(size)]
+    queries = [
+        random.choice([chat.name, chat.nick_name, chat.raw['PYQuanPin']])
+        for chat in random.sample(chats, lookups)
+    ]
+
+    start = time.perf_counter()
+    index = ContactIndex()
+    index.build(chats)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query)
+    indexed = (time.perf_counter() - start) / lookups
+
+    start = time.perf_counter()
+    for query in queries:
+        linear_search(chats, query)
+    linear = (time.perf_counter() - start) / lookups
+
+    print(f'contacts: {size}, lookups: {lookups}')
+    print(f'index build: {build * 1e3:.1f} ms')
+    print(f'ContactIndex.search: {indexed * 1e6:.1f} us/lookup')
+    print(f'linear bot.search:   {linear * 1e6:.1f} us/lookup')
+    print(f'speedup: {linear / indexed:.0f}x')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
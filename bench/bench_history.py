@@ -0,0 +1,61 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""Ingest a synthetic message stream into `History` and time its queries.
+
+Run with `python -m bench.bench_history [messages] [chats]`.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from history import History
+
+WORDS = ('hello', 'meeting', 'tomorrow', 'lunch', 'report', 'deadline',
+         'photo', 'project', 'review', 'weekend', '你好', '开会', '明天', '文件')
+
+
+def main(messages: int = 1000000, chats: int = 500) -> None:
+    random.seed(0)
+    file = os.path.join(tempfile.mkdtemp(), 'history.db')
+    history = History(file)
+    history.start()
+
+    start = time.perf_counter()
+    now = time.time()
+    for i in range(messages):
+        text = ' '.join(random.choices(WORDS, k=6)) + f' #{i}'
+        history.add((str(i), now + i, f'chat{i % chats}', f'Chat {i % chats}',
+                     'sender', 'Text', text, None))
+    queued = time.perf_counter() - start
+    history.flush()
+    written = time.perf_counter() - start
+
+    print(f'messages: {messages}, chats: {chats}')
+    print(f'queueing: {messages / queued:,.0f} msg/s '
+          f'({queued / messages * 1e6:.2f} us/msg on the caller)')
+    print(f'ingest: {messages / written:,.0f} msg/s')
+    print(f'database size: {os.path.getsize(file) / 1e6:.0f} MB')
+
+    for name, query in (
+        ('last 20 in chat', lambda: history.last('chat42', 20)),
+        ('search "deadline"', lambda: history.search('deadline', limit=20)),
+        ('search "#123456"', lambda: history.search(f'#{messages // 2}')),
+        ('search "开会" in chat', lambda: history.search('开会', 'chat7', 20)),
+        ('search "开会"', lambda: history.search('开会', limit=20)),
+        ('search "稀有" (no hits)', lambda: history.search('稀有', limit=20)),
+        ('search "会"', lambda: history.search('会', limit=20)),
+    ):
+        start = time.perf_counter()
+        for _ in range(20):
+            query()
+        print(f'{name}: {(time.perf_counter() - start) / 20 * 1e3:.2f} ms')
+    history.stop()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
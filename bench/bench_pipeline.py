@@ -0,0 +1,279 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""End-to-end benchmark of the receive, notify and reply pipeline.
+
+The program runs on a fake `wxpy.Bot` from `bench.fakes` in a temporary
+folder, with a headless notifier answering the toasts. Three phases are
+measured:
+
+- receive: synthetic messages are delivered to `get_msg` at a target rate and
+  timed until their toast is shown;
+- send: the `Ctrl+Alt+W` flows (`send_msg` and the `send_*` dialogs they
+  lead to) are scripted to send texts, images and files, then the send queue
+  is drained;
+- update_cache: the recent chats cache is updated in a tight loop.
+
+Run with `python -m bench.bench_pipeline --help` for the options. `--json`
+writes the results to a file so that two builds can be compared.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import fakes
+from notifier import response
+
+
+def folder_size(path: str) -> int:
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(folder, name))
+            except OSError:
+                pass
+    return total
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        mix[getattr(fakes, name.strip().upper())] = float(weight)
+    return mix
+
+
+def peak_rss() -> int:
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench_receive(server, notifier, args) -> dict:
+    latencies: List[float] = []
+    seen = set()
+    last = 0.0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def timed(run_dialog):
+
+        def wrapper(step, **state):
+            local.msgs = state.get('msgs') or [state['msg']] if state else ()
+            return run_dialog(step, **state)
+
+        return wrapper
+
+    def responder(text: str, kwargs: dict) -> dict:
+        nonlocal last
+        now = time.perf_counter()
+        with lock:
+            for msg in getattr(local, 'msgs', ()):
+                if msg.id not in seen:
+                    seen.add(msg.id)
+                    latencies.append(now - msg.received)
+                    last = max(last, now)
+        local.msgs = ()
+        if kwargs.get('input') == 'Enter the message here...' and \
+                random.random() < args.reply_ratio:
+            return response('', {'Enter the message here...': 'ok'})
+        return {}
+
+    server.run_dialog = timed(server.run_dialog)
+    notifier.responder = responder
+
+    bot = server.bot
+    before = folder_size('.')
+    start = time.perf_counter()
+    for msg in fakes.generate(bot, args.rate, args.messages,
+                              parse_mix(args.mix)):
+        bot.deliver(msg)
+    delivered = time.perf_counter() - start
+    deadline = time.monotonic() + args.timeout
+    while len(seen) + server.dispatcher.dropped < args.messages and \
+            time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = (last or time.perf_counter()) - start
+    server.history.flush()
+    written = folder_size('.') - before
+    return {
+        'messages': args.messages,
+        'notified': len(seen),
+        'dropped': server.dispatcher.dropped,
+        'toasts': len(notifier.shown),
+        'deliver_rate': args.messages / delivered,
+        'throughput': len(seen) / elapsed,
+        'latency_p50_ms': percentile(latencies, 0.5) * 1e3,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1e3,
+        'latency_max_ms': max(latencies, default=float('nan')) * 1e3,
+        'downloaded_bytes': bot.downloaded,
+        'disk_bytes_per_msg': written / args.messages,
+    }
+
+
+def bench_send(server, notifier, args) -> dict:
+    bot = server.bot
+    chats = bot.chats()
+    media = {}
+    for kind, size in (('image', 300 << 10), ('file', 2 << 20)):
+        media[kind] = os.path.abspath(f'send.{kind}')
+        with open(media[kind], 'wb') as f:
+            f.write(os.urandom(size))
+    script = []
+
+    def responder(text: str, kwargs: dict) -> dict:
+        return script.pop(0) if script else {}
+
+    notifier.responder = responder
+    uploaded, sent = bot.uploaded, len(bot.sent)
+    durations = []
+    for i in range(args.sends):
+        name = random.choice(chats).name
+        kind = ('text', 'image', 'file')[i % 3]
+        if kind == 'text':
+            script[:] = [
+                response('', {
+                    'Nickname, remark, etc.': name,
+                    'Enter the message here...': 'hello',
+                    'selection': ''
+                })
+            ]
+        else:
+            button = 'Send image' if kind == 'image' else 'Send file'
+            label = f'Enter the path of the {kind}...'
+            script[:] = [
+                response(button),
+                response('', {
+                    'Nickname, remark, etc.': name,
+                    label: media[kind],
+                    'selection': ''
+                }),
+                response('Yes'),
+            ]
+        start = time.perf_counter()
+        server.run_dialog('send_msg')
+        durations.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    server.outbox.join()
+    drained = time.perf_counter() - start
+    return {
+        'sends': args.sends,
+        'sent': len(bot.sent) - sent,
+        'dialog_p50_ms': percentile(durations, 0.5) * 1e3,
+        'dialog_p99_ms': percentile(durations, 0.99) * 1e3,
+        'queue_drain_s': drained,
+        'uploaded_bytes': bot.uploaded - uploaded,
+    }
+
+
+def bench_update_cache(server, args) -> dict:
+    chats = server.bot.chats()
+    start = time.perf_counter()
+    for i in range(args.updates):
+        server.update_cache(chats[i % len(chats)])
+    elapsed = time.perf_counter() - start
+    return {'update_cache_us': elapsed / args.updates * 1e6}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=500,
+                        help='messages per second, 0 for no pacing')
+    parser.add_argument('--mix',
+                        default='text=70,picture=15,attachment=10,video=5')
+    parser.add_argument('--friends', type=int, default=2000)
+    parser.add_argument('--groups', type=int, default=300)
+    parser.add_argument('--think', type=float, default=0.01,
+                        help='seconds every toast stays open')
+    parser.add_argument('--reply-ratio', type=float, default=0.05)
+    parser.add_argument('--download-delay', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--coalesce-window', type=float, default=None)
+    parser.add_argument('--sends', type=int, default=300)
+    parser.add_argument('--send-rate', type=float, default=1000,
+                        help='rate limit of the send queue per second')
+    parser.add_argument('--updates', type=int, default=100000)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    random.seed(0)
+    workdir = tempfile.mkdtemp(prefix='ramox-bench-')
+    os.chdir(workdir)
+    fakes.install()
+    fakes.FRIENDS, fakes.GROUPS = args.friends, args.groups
+    import config
+    if args.workers is not None:
+        config.DISPATCH_WORKERS = args.workers
+    if args.coalesce_window is not None:
+        config.COALESCE_WINDOW = args.coalesce_window
+    config.NOTIFIER = 'headless'
+    config.SEND_RATE = args.send_rate
+    import server
+    import utils
+    from clipboard import MemoryClipboard
+    from notifier import HeadlessNotifier
+
+    notifier = HeadlessNotifier(delay=args.think)
+    utils.use_backends(notifier, MemoryClipboard())
+    server.login()
+    server.bot.download_delay = args.download_delay
+    server.start()
+
+    results = {}
+    try:
+        results['receive'] = bench_receive(server, notifier, args)
+        results['send'] = bench_send(server, notifier, args)
+        results['update_cache'] = bench_update_cache(server, args)
+        results['peak_rss_bytes'] = peak_rss()
+    finally:
+        server.coalescer.stop()
+        server.dispatcher.stop()
+        server.outbox.stop()
+        server.history.stop()
+        atexit.unregister(server.recent.save)
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for phase, values in results.items():
+        if isinstance(values, dict):
+            print(f'[{phase}]')
+            for key, value in values.items():
+                print(f'  {key}: {value:,.2f}' if isinstance(value, float)
+                      else f'  {key}: {value:,}')
+        else:
+            print(f'{phase}: {values:,}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
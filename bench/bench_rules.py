@@ -0,0 +1,62 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""Time `RuleSet.check` for growing numbers of rules.
+
+Run with `python -m bench.bench_rules [messages]`.
+"""
+
+import random
+import string
+import sys
+import time
+
+from rules import RuleSet
+
+TYPES = ('Text', 'Picture', 'Attachment', 'Video', 'Sharing')
+
+
+def word() -> str:
+    return ''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 8)))
+
+
+def make_rules(count: int) -> list:
+    rules = []
+    for i in range(count):
+        rule = {'action': random.choice(('allow', 'deny'))}
+        kind = i % 4
+        if kind == 0:
+            rule['chats'] = [f'chat{random.randrange(1000)}']
+        elif kind == 1:
+            rule['keywords'] = [word() for _ in range(3)]
+        elif kind == 2:
+            rule['chats'] = [f'chat{random.randrange(1000)}']
+            rule['keywords'] = [word()]
+        else:
+            rule['senders'] = [f'sender{random.randrange(1000)}']
+            rule['types'] = [random.choice(TYPES)]
+        rules.append(rule)
+    return rules
+
+
+def main(messages: int = 20000) -> None:
+    random.seed(0)
+    samples = [(f'chat{random.randrange(1000)}', f'Chat',
+                (f'sender{random.randrange(1000)}', ), random.choice(TYPES),
+                ' '.join(word() for _ in range(random.randint(5, 30))))
+               for _ in range(messages)]
+    for count in (0, 10, 100, 500, 1000, 5000):
+        start = time.perf_counter()
+        rules = RuleSet(make_rules(count))
+        compiled = time.perf_counter() - start
+        start = time.perf_counter()
+        for sample in samples:
+            rules.check(*sample)
+        elapsed = (time.perf_counter() - start) / messages
+        print(f'{count:5} rules: compile {compiled * 1e3:7.1f} ms, '
+              f'check {elapsed * 1e6:5.1f} us/msg')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,108 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""Time the startup of the server on the fake bot, with and without a contact
+snapshot.
+
+Each run starts a fresh interpreter in an empty folder and reports when
+`import server`, `login` and `start` return, when the contact index first
+answers a lookup and when it holds the live contact list. `--chats-delay`
+stands for the time the real contact list takes to load, which wxpy does
+while logging in.
+
+Run with `python -m bench.bench_startup --help` for the options.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def child(args) -> None:
+    begin = time.perf_counter()
+    from bench import fakes
+    fakes.install()
+    fakes.FRIENDS, fakes.GROUPS = args.friends, args.groups
+    fakes.CHATS_DELAY = args.chats_delay
+    import config
+    config.NOTIFIER = 'headless'
+    modules = len(sys.modules)
+    import server
+    imported = time.perf_counter()
+    server.login()
+    logged_in = time.perf_counter()
+    server.start()
+    started = time.perf_counter()
+    name = server.bot.friends[-1].name
+    while not server.contacts.search(name):
+        time.sleep(0.001)
+    found = time.perf_counter()
+    while isinstance(server.contacts.get(server.bot.friends[-1].puid),
+                     server.SavedChat):
+        time.sleep(0.001)
+    live = time.perf_counter()
+    while not os.path.exists(config.CONTACTS_SNAPSHOT_FILE):
+        time.sleep(0.001)
+    print(
+        json.dumps({
+            'import_ms': (imported - begin) * 1e3,
+            'modules_imported': len(sys.modules) - modules,
+            'login_ms': (logged_in - imported) * 1e3,
+            'start_ms': (started - logged_in) * 1e3,
+            'first_lookup_ms': (found - begin) * 1e3,
+            'live_index_ms': (live - begin) * 1e3,
+        }))
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def run(args, workdir: str) -> dict:
+    command = [
+        sys.executable, '-m', 'bench.bench_startup', '--child',
+        '--friends', str(args.friends), '--groups', str(args.groups),
+        '--chats-delay', str(args.chats_delay)
+    ]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.run(command,
+                         cwd=workdir,
+                         env=env,
+                         check=True,
+                         capture_output=True,
+                         text=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--friends', type=int, default=2000)
+    parser.add_argument('--groups', type=int, default=300)
+    parser.add_argument('--chats-delay', type=float, default=1.0,
+                        help='seconds the contact list takes to load')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='ramox-startup-')
+    try:
+        cold = run(args, workdir)
+        warm = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f'{"":18}{"no snapshot":>14}{"snapshot":>14}')
+    for key in cold:
+        print(f'{key:18}{cold[key]:14,.1f}{warm[key]:14,.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+"""A stand-in for the parts of `wxpy` the program uses, and a generator of
+synthetic messages.
+
+`install` puts this module in `sys.modules` as `wxpy`, together with an inert
+`keyboard`, so that `server` can be imported without logging in.
+"""
+
+import datetime
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import types
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+
+TEXT = 'Text'
+PICTURE = 'Picture'
+RECORDING = 'Recording'
+ATTACHMENT = 'Attachment'
+VIDEO = 'Video'
+SHARING = 'Sharing'
+
+# Bytes of the attachment carried by each message type.
+FILE_SIZES = {
+    PICTURE: 200 << 10,
+    RECORDING: 30 << 10,
+    ATTACHMENT: 1 << 20,
+    VIDEO: 20 << 20,
+}
+
+EXTENSIONS = {PICTURE: 'png', RECORDING: 'mp3', ATTACHMENT: 'pdf', VIDEO: 'mp4'}
+
+# Number of friends and groups of a new `Bot`.
+FRIENDS = 200
+GROUPS = 50
+# Seconds the contact list takes to load, while logging in and on update.
+CHATS_DELAY = 0.0
+
+
+def ensure_one(found: list) -> Any:
+    if not isinstance(found, list):
+        raise TypeError('expected a list')
+    if len(found) != 1:
+        raise ValueError(f'found {len(found)} chats')
+    return found[0]
+
+
+class Chat:
+
+    def __init__(self, bot: 'Bot', i: int, group: bool = False) -> None:
+        self.bot = bot
+        self.puid = f'{i:08x}'
+        self.user_name = ('@@' if group else '@') + self.puid
+        self.nick_name = f'{"group" if group else "friend"}{i}'
+        self.remark_name = '' if group else f'remark{i}'
+        self.display_name = ''
+        self.name = self.remark_name or self.nick_name
+        self.raw = {'UserName': self.user_name, 'PYQuanPin': self.nick_name}
+        self.wxid = None
+
+    def _send(self, kind: str, path: Union[str, None],
+              media_id: Union[str, None]) -> None:
+        if self.bot.send_delay:
+            time.sleep(self.bot.send_delay)
+        if media_id is None and path is not None:
+            self.bot.upload_file(path)
+        with self.bot.lock:
+            self.bot.sent.append((time.perf_counter(), self.puid, kind))
+
+    def send(self, text: str) -> None:
+        self._send('text', None, None)
+
+    def send_file(self, path: str, media_id: Union[str, None] = None) -> None:
+        self._send('file', path, media_id)
+
+    def send_image(self, path: str, media_id: Union[str, None] = None) -> None:
+        self._send('image', path, media_id)
+
+    def send_video(self, path: str, media_id: Union[str, None] = None) -> None:
+        self._send('video', path, media_id)
+
+
+class Message:
+
+    def __init__(self, bot: 'Bot', id: int, chat: Chat, type: str) -> None:
+        self.bot = bot
+        self.id = id
+        self.chat = chat
+        self.type = type
+        self.sender = chat
+        self.member = None
+        if chat.user_name.startswith('@@'):
+            self.member = bot.members[id % len(bot.members)]
+        self.raw = {'ActualNickName': getattr(self.member, 'name', '')}
+        self.create_time = datetime.datetime.now()
+        self.received = time.perf_counter()
+        if type == TEXT:
+            self.text = f'message {id} ' + 'lorem ipsum ' * random.randint(1, 10)
+            self.file_name = None
+            self.file_size = None
+        else:
+            self.file_name = f'{type.lower()}{id}.{EXTENSIONS[type]}'
+            self.file_size = FILE_SIZES[type]
+            self.text = self.file_name
+
+    def get_file(self, save_path: str) -> None:
+        if self.bot.download_delay:
+            time.sleep(self.bot.download_delay)
+        with open(save_path, 'wb') as f:
+            f.write(str(self.id).encode().ljust(self.file_size, b'\0'))
+        with self.bot.lock:
+            self.bot.downloaded += self.file_size
+
+    def reply(self, text: str) -> None:
+        self.chat.send(text)
+
+
+class Bot:
+    """A logged-in account with synthetic friends and groups.
+    """
+
+    def __init__(self, cache_path: Any = None, **kwargs) -> None:
+        self.lock = threading.Lock()
+        self.handlers: List[Tuple[Callable[[Message], Any], bool]] = []
+        self.friends = [Chat(self, i) for i in range(FRIENDS)]
+        self.groups = [
+            Chat(self, FRIENDS + i, group=True) for i in range(GROUPS)
+        ]
+        self.self = Chat(self, FRIENDS + GROUPS)
+        self.members = [Chat(self, FRIENDS + GROUPS + 1 + i) for i in range(50)]
+        self.sent: List[tuple] = []
+        self.uploaded = 0
+        self.downloaded = 0
+        self.send_delay = 0.0
+        self.download_delay = 0.0
+        self.upload_delay = 0.0
+        self.chats_delay = CHATS_DELAY
+        self._ids = itertools.count()
+        self._stop = threading.Event()
+        if self.chats_delay:
+            time.sleep(self.chats_delay)
+
+    def chats(self, update: bool = False) -> List[Chat]:
+        if update and self.chats_delay:
+            time.sleep(self.chats_delay)
+        return self.friends + self.groups
+
+    def deliver(self, msg: Message) -> None:
+        for handler, run_async in self.handlers:
+            if run_async:
+                threading.Thread(target=handler, args=(msg, ),
+                                 daemon=True).start()
+            else:
+                handler(msg)
+
+    def enable_puid(self, path: str = 'wxpy_puid.pkl') -> None:
+        pass
+
+    def join(self) -> None:
+        self._stop.wait()
+
+    def logout(self) -> None:
+        self._stop.set()
+
+    def message(self, type: str, chat: Union[Chat, None] = None) -> Message:
+        chat = chat or random.choice(self.friends + self.groups)
+        return Message(self, next(self._ids), chat, type)
+
+    def register(self, chats: Any = None, msg_types: Any = None,
+                 except_self: bool = True, run_async: bool = True,
+                 enabled: bool = True) -> Callable:
+
+        def decorator(func: Callable) -> Callable:
+            self.handlers.append((func, run_async))
+            return func
+
+        return decorator
+
+    def search(self, keywords: Union[str, None] = None, **attributes) -> List[Chat]:
+        keywords = (keywords or '').lower().split()
+        found = []
+        for chat in self.chats():
+            for kw in keywords:
+                for attr in ('remark_name', 'display_name', 'nick_name'):
+                    if kw in str(getattr(chat, attr, '') or '').lower():
+                        break
+                else:
+                    break
+            else:
+                found.append(chat)
+        return found
+
+    def upload_file(self, path: str) -> str:
+        if self.upload_delay:
+            time.sleep(self.upload_delay)
+        size = os.path.getsize(path)
+        with self.lock:
+            self.uploaded += size
+        return f'media-{next(self._ids)}'
+
+
+def generate(bot: Bot, rate: float, count: int, mix: Dict[str, float],
+             chats: Union[List[Chat], None] = None) -> Iterator[Message]:
+    """Yield messages of a random type mix, paced at a target rate.
+
+    Args:
+        bot (Bot): The bot the messages belong to.
+        rate (float): Messages per second. 0 yields as fast as possible.
+        count (int): Number of messages.
+        mix (Dict[str, float]): Relative weight of each message type.
+        chats (Union[List[Chat], None], optional): Chats the messages come
+            from. Defaults to every chat of the bot.
+
+    Yields:
+        Message: The next message, at its scheduled time.
+    """
+    chats = chats or bot.chats()
+    types_, weights = zip(*mix.items())
+    start = time.perf_counter()
+    for i in range(count):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield bot.message(random.choices(types_, weights)[0],
+                          random.choice(chats))
+
+
+def install() -> None:
+    """Make `import wxpy` and `import keyboard` load the fakes.
+    """
+    sys.modules['wxpy'] = sys.modules[__name__]
+    keyboard = types.ModuleType('keyboard')
+    keyboard.add_hotkey = lambda *args, **kwargs: None
+    sys.modules['keyboard'] = keyboard
@@ -0,0 +1,118 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Union
+
+from outbox import SendJob
+
+
+class Broadcast:
+    """Follow the sends of one payload to many chats.
+
+    `done` is given as the callback of every job. Once each job is sent or has
+    failed, `on_finished` is called once with the broadcast.
+    """
+
+    def __init__(self,
+                 jobs: List[SendJob],
+                 on_finished: Callable[['Broadcast'], None],
+                 missing: Union[List[str], None] = None) -> None:
+        """Start following the jobs.
+
+        Args:
+            jobs (List[SendJob]): The jobs, one per chat.
+            on_finished (Callable[[Broadcast], None]): Called when every job is
+                finished.
+            missing (Union[List[str], None], optional): Names that matched no
+                chat, for the summary. Defaults to None.
+        """
+        self.jobs = jobs
+        self.missing = missing or []
+        self.on_finished = on_finished
+        self.errors: Dict[str, Union[Exception, None]] = {}
+        self._lock = threading.Lock()
+        if not jobs:
+            on_finished(self)
+
+    def done(self, job: SendJob, error: Union[Exception, None]) -> None:
+        """Record the outcome of a job.
+
+        Args:
+            job (SendJob): The job.
+            error (Union[Exception, None]): The last error, or None if the job
+                was sent.
+        """
+        with self._lock:
+            self.errors[job.id] = error
+            finished = len(self.errors) == len(self.jobs)
+        if finished:
+            self.on_finished(self)
+
+    def summary(self, name: Callable[[str], str]) -> str:
+        """Describe the outcome of every send.
+
+        Args:
+            name (Callable[[str], str]): Gives the name of a chat by its puid.
+
+        Returns:
+            str: A count of successes, then one line per chat that failed and
+            the names that were not found.
+        """
+        failed = [job for job in self.jobs if self.errors.get(job.id)]
+        lines = [f'Sent to {len(self.jobs) - len(failed)} of {len(self.jobs)} chats.']
+        for job in failed:
+            lines.append(f'{name(job.chat)}: {self.errors[job.id]}')
+        if self.missing:
+            lines.append('Not found: ' + ', '.join(self.missing))
+        return '\n'.join(lines)
+
+
+class SavedLists:
+    """Named lists of chat puids to broadcast to, kept in a JSON file.
+    """
+
+    def __init__(self, file: str) -> None:
+        self.file = file
+        self._lock = threading.Lock()
+        try:
+            with open(file, encoding='utf-8') as f:
+                self._lists: Dict[str, List[str]] = json.load(f)
+        except (OSError, ValueError):
+            self._lists = {}
+
+    def get(self, name: str) -> List[str]:
+        """Get the puids of a list.
+
+        Args:
+            name (str): The name of the list.
+
+        Returns:
+            List[str]: The puids. Empty if there is no such list.
+        """
+        return list(self._lists.get(name, ()))
+
+    def names(self) -> List[str]:
+        """Get the names of the lists.
+
+        Returns:
+            List[str]: The names, sorted.
+        """
+        return sorted(self._lists)
+
+    def save(self, name: str, puids: List[str]) -> None:
+        """Create or replace a list and write the file.
+
+        Args:
+            name (str): The name of the list.
+            puids (List[str]): The puids of its chats.
+        """
+        with self._lock:
+            self._lists[name] = list(puids)
+            temp = self.file + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(self._lists, f, ensure_ascii=False, indent=2)
+            os.replace(temp, self.file)
@@ -0,0 +1,198 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Tuple, Union
+
+import metrics
+
+# File extension of each format images can be saved as.
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+class Clipboard:
+    """The interface of a clipboard backend.
+    """
+
+    def get_file(self) -> Union[str, None]:
+        """Get the path of the file copied into the clipboard.
+
+        Returns:
+            Union[str, None]: The file path. None if no file is copied.
+        """
+        raise NotImplementedError
+
+    def get_image(self) -> Any:
+        """Get the image copied into the clipboard.
+
+        Returns:
+            PIL.Image.Image: The image. None if no image is copied.
+        """
+        raise NotImplementedError
+
+    def get_text(self) -> str:
+        """Get the text copied into the clipboard.
+
+        Returns:
+            str: The text.
+        """
+        raise NotImplementedError
+
+
+class WinClipboard(Clipboard):
+    """The Windows clipboard, read with pywin32, Pillow and pyperclip.
+
+    These packages are imported on first use.
+    """
+
+    def get_file(self) -> Union[str, None]:
+        import win32clipboard
+        win32clipboard.OpenClipboard()
+        formats = []
+        format = win32clipboard.EnumClipboardFormats(0)
+        while format:
+            formats.append(format)
+            format = win32clipboard.EnumClipboardFormats(format)
+        if win32clipboard.CF_HDROP in formats:
+            file = win32clipboard.GetClipboardData(
+                win32clipboard.CF_HDROP)[0]
+            win32clipboard.CloseClipboard()
+            return file
+        else:
+            win32clipboard.CloseClipboard()
+            return None
+
+    def get_image(self) -> Any:
+        from PIL.Image import Image
+        from PIL.ImageGrab import grabclipboard
+        img = grabclipboard()
+        return img if isinstance(img, Image) else None
+
+    def get_text(self) -> str:
+        import pyperclip
+        return pyperclip.paste()
+
+
+class MemoryClipboard(Clipboard):
+    """A clipboard held in memory, for running without a desktop.
+    """
+
+    def __init__(self,
+                 file: Union[str, None] = None,
+                 image: Any = None,
+                 text: str = '') -> None:
+        self.file = file
+        self.image = image
+        self.text = text
+
+    def get_file(self) -> Union[str, None]:
+        return self.file
+
+    def get_image(self) -> Any:
+        return self.image
+
+    def get_text(self) -> str:
+        return self.text
+
+
+class ClipboardImages:
+    """Save images taken from the clipboard to files ready to be sent.
+
+    Each image is downscaled to fit `max_size`, re-encoded as `format` and
+    saved as `<digest>.<extension>`, where the digest is taken from the
+    pixels. Grabbing the same image again returns the existing file without
+    encoding it again, and since the file is unchanged its media id is reused
+    by the upload cache. Files older than `ttl` are removed when a new image
+    is saved, rather than on exit, so that sends replayed after a crash still
+    find their files.
+    """
+
+    def __init__(self,
+                 root: str,
+                 format: str = 'JPEG',
+                 quality: int = 85,
+                 max_size: Union[Tuple[int, int], None] = None,
+                 ttl: float = 24 * 3600) -> None:
+        """Create the folder of the images.
+
+        Args:
+            root (str): The folder of the images.
+            format (str, optional): One of `EXTENSIONS`. Defaults to 'JPEG'.
+            quality (int, optional): Quality of JPEG and WebP images, from 1
+                to 100. Defaults to 85.
+            max_size (Union[Tuple[int, int], None], optional): Maximum width
+                and height. Defaults to None, keeping the size.
+            ttl (float, optional): Seconds a file is kept. Defaults to a day.
+        """
+        if format not in EXTENSIONS:
+            raise ValueError(f'Unknown image format: {format}')
+        self.root = os.path.abspath(root)
+        self.format = format
+        self.quality = quality
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def clean(self) -> int:
+        """Remove the files older than `ttl`.
+
+        Returns:
+            int: The number of files removed.
+        """
+        removed = 0
+        deadline = time.time() - self.ttl
+        for entry in os.scandir(self.root):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def save(self, img: Any) -> str:
+        """Save an image unless the same image is saved already.
+
+        Args:
+            img (PIL.Image.Image): The image.
+
+        Returns:
+            str: The path of the file.
+        """
+        with metrics.span('clipboard_image'):
+            digest = hashlib.sha256(
+                f'{img.mode}{img.size}'.encode() + img.tobytes()).hexdigest()
+            file = os.path.join(self.root,
+                                f'{digest[:16]}.{EXTENSIONS[self.format]}')
+            with self._lock:
+                if os.path.isfile(file):
+                    os.utime(file)
+                    metrics.inc('clipboard_images_total', result='reused')
+                    return file
+                self.clean()
+                self._encode(img).save(file + '.tmp',
+                                       format=self.format,
+                                       quality=self.quality,
+                                       optimize=True)
+                os.replace(file + '.tmp', file)
+            metrics.inc('clipboard_images_total', result='saved')
+            return file
+
+    def _encode(self, img: Any) -> Any:
+        if self.max_size is not None:
+            img = img.copy()
+            img.thumbnail(self.max_size)
+        if self.format == 'JPEG' and img.mode != 'RGB':
+            from PIL import Image
+            if 'A' in img.getbands():
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.convert('RGBA').split()[-1])
+                img = background
+            else:
+                img = img.convert('RGB')
+        return img
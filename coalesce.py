@@ -0,0 +1,156 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import heapq
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class _Window:
+
+    def __init__(self, length: float) -> None:
+        self.length = length
+        self.buffer: List[Any] = []
+        self.deadline = 0.0
+        self.flushing = False
+
+
+class Coalescer:
+    """Merge bursts of messages from the same chat.
+
+    The first message of a quiet chat is emitted at once and opens a window.
+    Mergeable messages arriving while the window is open are buffered and
+    emitted together as one list when it closes. A message that cannot be
+    merged is not held back: it is emitted at once, after the messages
+    buffered before it, and the window stays open. If a window closes with
+    buffered messages, the next window is twice as long, up to `max_window`,
+    so a chat that keeps talking is notified less and less often. A window
+    closing empty ends the burst. Buffered messages are only ever emitted by
+    the thread of the coalescer, and the first message of a burst is emitted
+    before `submit` returns, so the messages of a chat keep their order as
+    long as `submit` is called from a single thread.
+    """
+
+    def __init__(self,
+                 emit: Callable[[List[Any]], None],
+                 key: Callable[[Any], Any],
+                 window: float = 2.0,
+                 max_window: float = 60.0,
+                 mergeable: Callable[[Any], bool] = lambda msg: True) -> None:
+        """Create a coalescer. Call `start` before submitting messages.
+
+        Args:
+            emit (Callable[[List[Any]], None]): Called with each list of
+                messages to notify, in order.
+            key (Callable[[Any], Any]): Returns the chat key of a message.
+            window (float, optional): Seconds of the first window of a burst.
+                0 emits every message alone. Defaults to 2.0.
+            max_window (float, optional): Maximum seconds of a window.
+                Defaults to 60.0.
+            mergeable (Callable[[Any], bool], optional): Whether a message may
+                be merged with others. Defaults to always.
+        """
+        self.emit = emit
+        self.key = key
+        self.window = window
+        self.max_window = max_window
+        self.mergeable = mergeable
+        self._cond = threading.Condition()
+        self._chats: Dict[Any, _Window] = {}
+        self._deadlines: List[Tuple[float, int, Any]] = []
+        self._counter = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        """Start the thread closing the windows.
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Emit every buffered message and stop the thread.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def submit(self, msg: Any) -> None:
+        """Emit a message now or buffer it until its chat's window closes.
+
+        Args:
+            msg (Any): The message received.
+        """
+        if self.window <= 0:
+            self.emit([msg])
+            return
+        key = self.key(msg)
+        with self._cond:
+            window = self._chats.get(key)
+            if window is not None:
+                window.buffer.append(msg)
+                if not window.flushing and not self.mergeable(msg):
+                    window.flushing = True
+                    self._counter += 1
+                    heapq.heappush(self._deadlines,
+                                   (time.monotonic(), self._counter, key))
+                    self._cond.notify()
+                return
+            self._chats[key] = _Window(self.window)
+            self._schedule(key, self.window)
+        self.emit([msg])
+
+    def _flush(self, buffer: List[Any]) -> None:
+        run: List[Any] = []
+        for msg in buffer:
+            if self.mergeable(msg):
+                run.append(msg)
+                continue
+            if run:
+                self.emit(run)
+                run = []
+            self.emit([msg])
+        if run:
+            self.emit(run)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped and (
+                        not self._deadlines
+                        or self._deadlines[0][0] > time.monotonic()):
+                    timeout = (self._deadlines[0][0] - time.monotonic()
+                               if self._deadlines else None)
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    buffers = [w.buffer for w in self._chats.values()]
+                    self._chats.clear()
+                    self._deadlines.clear()
+                else:
+                    deadline, _, key = heapq.heappop(self._deadlines)
+                    window = self._chats.get(key)
+                    if window is None:
+                        continue
+                    buffers = [window.buffer]
+                    if deadline != window.deadline:
+                        window.buffer = []
+                        window.flushing = False
+                    elif window.buffer:
+                        window.buffer = []
+                        window.length = min(window.length * 2, self.max_window)
+                        self._schedule(key, window.length)
+                    else:
+                        del self._chats[key]
+            for buffer in buffers:
+                self._flush(buffer)
+            if self._stopped:
+                return
+
+    def _schedule(self, key: Any, length: float) -> None:
+        self._counter += 1
+        window = self._chats[key]
+        window.deadline = time.monotonic() + length
+        heapq.heappush(self._deadlines, (window.deadline, self._counter, key))
+        self._cond.notify()
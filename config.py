@@ -0,0 +1,179 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+# Number of worker threads showing toasts for inbound messages. Messages from
+# the same chat are always handled by the same worker, in arrival order.
+DISPATCH_WORKERS = 4
+
+# Maximum number of messages waiting in each worker's queue.
+DISPATCH_QUEUE_SIZE = 64
+
+# What to do when a worker's queue is full:
+#   'block'       - wait up to DISPATCH_TIMEOUT seconds, then drop the message
+#   'drop_new'    - drop the incoming message
+#   'drop_oldest' - drop the oldest waiting message to make room
+DISPATCH_BACKPRESSURE = 'drop_oldest'
+
+# Seconds to wait for room in a full queue under the 'block' policy.
+DISPATCH_TIMEOUT = 1.0
+
+# Folder holding downloaded attachments and its size limit in bytes. The least
+# recently used files are removed once the limit is exceeded.
+FILES_DIR = 'Files'
+FILES_MAX_BYTES = 2 << 30
+
+# Seconds an unused attachment is kept (None keeps it until the folder is
+# full), seconds a used attachment is kept even when the folder is full, and
+# seconds between two clean-ups of the folder.
+FILES_MAX_AGE = 30 * 24 * 3600
+FILES_MIN_AGE = 3600
+FILES_COMPACT_INTERVAL = 3600
+
+# Seconds between two full refreshes of the contact index. Chats seen in
+# messages are updated as they arrive.
+CONTACTS_REFRESH_INTERVAL = 600
+
+# Number of recent chats offered in the send dialogs, and the file they are
+# persisted to between runs.
+RECENT_CHATS_SIZE = 10
+RECENT_CHATS_FILE = 'recent.json'
+
+# Seconds an uploaded file's media_id is reused before uploading it again.
+MEDIA_ID_TTL = 6 * 3600
+
+# SQLite database recording every inbound message, and how its writes are
+# batched.
+HISTORY_FILE = 'history.db'
+HISTORY_BATCH_SIZE = 500
+HISTORY_FLUSH_INTERVAL = 0.5
+
+# Bursts of text messages from one chat are merged into a digest toast. The
+# first message of a burst is shown at once; later ones are collected for
+# COALESCE_WINDOW seconds, and the window doubles, up to COALESCE_MAX_WINDOW,
+# while the chat keeps talking. Set COALESCE_WINDOW to 0 to show every message.
+COALESCE_WINDOW = 2.0
+COALESCE_MAX_WINDOW = 60.0
+
+# Number of latest messages listed in a digest toast.
+DIGEST_MAX_LINES = 8
+
+# Attachments within these sizes, in bytes, are downloaded before their toast
+# is shown; larger ones are downloaded when "Open file" is clicked. None
+# prefetches every size and 0 never prefetches.
+DOWNLOAD_MAX_SIZES = {
+    'Picture': None,
+    'Recording': None,
+    'Attachment': 8 << 20,
+    'Video': 0,
+}
+
+# Per-chat overrides of the sizes above, by chat puid or name: 'always' or
+# 'never'.
+DOWNLOAD_CHAT_RULES = {}
+
+# Attachments are downloaded on at most DOWNLOAD_WORKERS threads at once,
+# DOWNLOAD_CHUNK_SIZE bytes at a time. A failed download is resumed
+# DOWNLOAD_RETRIES times, waiting DOWNLOAD_BACKOFF seconds before the first
+# retry and twice as long before each further one, and fails after
+# DOWNLOAD_TIMEOUT seconds without data.
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_CHUNK_SIZE = 256 << 10
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 1.0
+DOWNLOAD_TIMEOUT = 30
+
+# JSON file of rules deciding which messages are handled, evaluated before
+# anything is downloaded. It holds a list of rules such as
+#   {"action": "allow", "chats": ["Family"], "keywords": ["urgent"]}
+#   {"action": "deny", "chats": ["Family"]}
+#   {"action": "deny", "types": ["Sharing", "Card"]}
+# Each rule may also have "senders". The first matching rule decides and
+# messages matching no rule are handled.
+RULES_FILE = 'rules.json'
+
+# Notification and clipboard backend: 'win11' shows toasts in the Windows 11
+# Action Center, 'headless' shows nothing and dismisses every toast, so the
+# program can run without a desktop.
+NOTIFIER = 'win11'
+
+# Timing and counters of every stage. When enabled, they are served in the
+# Prometheus text format on 127.0.0.1:METRICS_PORT and appended every
+# METRICS_JSON_INTERVAL seconds to METRICS_JSON_FILE; set either to None to
+# turn that export off.
+METRICS_ENABLED = False
+METRICS_PORT = 9464
+METRICS_JSON_FILE = None
+METRICS_JSON_INTERVAL = 60
+
+# Outbound sends run on SEND_WORKERS threads, at most SEND_RATE per second with
+# bursts of SEND_BURST. A failed send is retried SEND_RETRIES times, waiting
+# SEND_BACKOFF seconds before the first retry and twice as long before each
+# further one, up to SEND_MAX_BACKOFF.
+SEND_WORKERS = 2
+SEND_RATE = 1.0
+SEND_BURST = 5
+SEND_RETRIES = 3
+SEND_BACKOFF = 2.0
+SEND_MAX_BACKOFF = 60.0
+
+# Write-ahead log of queued sends, replayed at startup so that sends survive a
+# crash, and the number of finished sends between two compactions of the log.
+SEND_JOURNAL_FILE = 'outbox.log'
+SEND_JOURNAL_COMPACT = 100
+
+# JSON file keeping the saved lists of chats to broadcast to.
+BROADCAST_LISTS_FILE = 'broadcast.json'
+
+# Folder of the images taken from the clipboard, the format they are saved as
+# ('JPEG', 'PNG' or 'WEBP'), the quality of JPEG and WebP images, their maximum
+# width and height (None keeps the size), and the seconds they are kept.
+CLIPBOARD_DIR = 'Clipboard'
+CLIPBOARD_FORMAT = 'JPEG'
+CLIPBOARD_QUALITY = 85
+CLIPBOARD_MAX_SIZE = (1920, 1920)
+CLIPBOARD_TTL = 24 * 3600
+
+# Maximum width and height of the previews of images shown in notifications.
+THUMBNAIL_SIZE = (400, 400)
+
+# JSON file of the auto-reply rules, the default seconds before a rule answers
+# the same chat again, and the replies allowed in each chat per second and at
+# once.
+AUTOREPLY_FILE = 'autoreply.json'
+AUTOREPLY_COOLDOWN = 300
+AUTOREPLY_RATE = 1 / 60
+AUTOREPLY_BURST = 3
+
+# Number of message ids remembered to drop messages delivered twice, and the
+# file keeping them across restarts.
+DEDUP_WINDOW = 10000
+DEDUP_FILE = 'seen.log'
+
+# Snapshot of the contact index, restored at startup so that chats can be
+# found before the contact list is loaded.
+CONTACTS_SNAPSHOT_FILE = 'contacts.json'
+
+# Port of the local JSON API for scripts (None disables it), the address it
+# listens on, the token clients must send as a bearer token (None for none),
+# and the number of queued sends whose status is kept.
+API_PORT = None
+API_HOST = '127.0.0.1'
+API_TOKEN = None
+API_JOBS_KEPT = 10000
+
+# Accounts run together by `python -m accounts`, each in a worker process of
+# its own, by name with the settings of this file they override, such as
+#   {'work': {'API_PORT': 8801}, 'home': {'AUTOREPLY_COOLDOWN': 60}}
+# Each account keeps its files, rules included, in a folder of ACCOUNTS_DIR
+# named after it. METRICS_PORT and API_PORT are offset by the position of the
+# account unless it sets them.
+ACCOUNTS = {}
+ACCOUNTS_DIR = 'Accounts'
+
+# Seconds before a crashed worker is started again, doubled after each further
+# crash up to ACCOUNT_MAX_BACKOFF, and seconds a worker must run for its
+# crashes to be forgotten.
+ACCOUNT_BACKOFF = 5.0
+ACCOUNT_MAX_BACKOFF = 300.0
+ACCOUNT_STABLE_TIME = 600.0
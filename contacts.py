@@ -0,0 +1,225 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import bisect
+import difflib
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Set
+
+# Attributes of a wxpy chat that are indexed.
+NAME_ATTRIBUTES = ('name', 'remark_name', 'nick_name', 'display_name')
+
+# Fields of the raw WeChat contact holding the pinyin of the names.
+PINYIN_FIELDS = ('PYQuanPin', 'PYInitial', 'RemarkPYQuanPin', 'RemarkPYInitial')
+
+
+def chat_keys(chat: Any) -> Set[str]:
+    """Get the lowercase lookup keys of a chat.
+
+    Args:
+        chat (wxpy.Chat): The chat object.
+
+    Returns:
+        Set[str]: The names and pinyin the chat can be found by.
+    """
+    keys = {getattr(chat, attr, None) for attr in NAME_ATTRIBUTES}
+    raw = getattr(chat, 'raw', None) or {}
+    keys.update(raw.get(field) for field in PINYIN_FIELDS)
+    return {str(key).lower() for key in keys if key}
+
+
+class SavedChat:
+    """A chat restored from a snapshot of the contact index.
+
+    It has the names of the chat but cannot send anything; look the chat up
+    by its puid in the live contact list for that.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.puid = data['puid']
+        self.name = data.get('name')
+        self.remark_name = data.get('remark_name')
+        self.nick_name = data.get('nick_name')
+        self.display_name = data.get('display_name')
+        self.raw = data.get('raw') or {}
+
+
+class ContactIndex:
+    """An in-memory index of chats by puid, names and pinyin.
+
+    Lookups try, in order, the puid, an exact name, a name prefix and, for
+    suggestions only, a fuzzy match, and stop at the first step that finds
+    anything. A fuzzy match may well be another chat than the one meant, so
+    it is never used to pick the chat something is sent to. The index
+    is filled once with `build` and kept current with `update`. It can be
+    saved to a file with `save` and filled from it with `restore`, so that
+    lookups work before the contact list is loaded.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._chats: Dict[str, Any] = {}
+        self._keys: Dict[str, Set[str]] = {}
+        self._puids: Dict[str, Set[str]] = {}
+        self._sorted: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def build(self, chats: Iterable[Any]) -> None:
+        """Replace the content of the index.
+
+        Args:
+            chats (Iterable[wxpy.Chat]): All chats of the account.
+        """
+        chat_map, keys, puids = {}, {}, {}
+        for chat in chats:
+            if chat.puid is None:
+                continue
+            chat_map[chat.puid] = chat
+            keys[chat.puid] = chat_keys(chat)
+            for key in keys[chat.puid]:
+                puids.setdefault(key, set()).add(chat.puid)
+        with self._lock:
+            self._chats, self._keys, self._puids = chat_map, keys, puids
+            self._sorted = sorted(puids)
+
+    def get(self, puid: str) -> Any:
+        """Get a chat by its puid.
+
+        Args:
+            puid (str): The puid of the chat.
+
+        Returns:
+            wxpy.Chat: The chat object. None if it is not indexed.
+        """
+        return self._chats.get(puid)
+
+    def remove(self, puid: str) -> None:
+        """Remove a chat from the index.
+
+        Args:
+            puid (str): The puid of the chat.
+        """
+        with self._lock:
+            self._chats.pop(puid, None)
+            for key in self._keys.pop(puid, ()):
+                self._unlink(key, puid)
+
+    def restore(self, file: str) -> int:
+        """Fill the index with the chats of a snapshot written by `save`.
+
+        Args:
+            file (str): The path of the snapshot.
+
+        Returns:
+            int: The number of chats restored. 0 if there is no snapshot.
+        """
+        try:
+            with open(file, encoding='utf-8') as f:
+                chats = [SavedChat(data) for data in json.load(f)]
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+        self.build(chats)
+        return len(chats)
+
+    def save(self, file: str) -> None:
+        """Write the names of all indexed chats to a snapshot.
+
+        Args:
+            file (str): The path of the snapshot.
+        """
+        with self._lock:
+            chats = list(self._chats.values())
+        data = []
+        for chat in chats:
+            item = {attr: getattr(chat, attr, None) for attr in NAME_ATTRIBUTES}
+            raw = getattr(chat, 'raw', None) or {}
+            item['puid'] = chat.puid
+            item['raw'] = {
+                field: raw[field]
+                for field in PINYIN_FIELDS if raw.get(field)
+            }
+            data.append(item)
+        temp = file + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp, file)
+
+    def search(self,
+               keyword: str,
+               limit: int = 10,
+               fuzzy: bool = False) -> List[Any]:
+        """Find the chats matching a keyword.
+
+        Args:
+            keyword (str): A puid, name, remark name, nickname or pinyin.
+            limit (int, optional): Maximum number of prefix or fuzzy matches.
+                Defaults to 10.
+            fuzzy (bool, optional): Whether to fall back to close matches
+                when nothing starts with the keyword. Defaults to False.
+
+        Returns:
+            List[wxpy.Chat]: The matching chats, best matches first.
+        """
+        if not keyword:
+            return []
+        with self._lock:
+            chat = self._chats.get(keyword)
+            if chat is not None:
+                return [chat]
+            keyword = keyword.lower()
+            puids = self._puids.get(keyword)
+            if not puids:
+                puids = self._prefix(keyword, limit)
+            if not puids and fuzzy:
+                puids = set()
+                for key in difflib.get_close_matches(keyword,
+                                                     self._sorted,
+                                                     n=limit):
+                    puids.update(self._puids[key])
+            return [self._chats[puid] for puid in puids]
+
+    def update(self, chat: Any) -> None:
+        """Add a chat to the index or refresh its keys.
+
+        Args:
+            chat (wxpy.Chat): The new or changed chat.
+        """
+        if chat.puid is None:
+            return
+        keys = chat_keys(chat)
+        with self._lock:
+            self._chats[chat.puid] = chat
+            old = self._keys.get(chat.puid, set())
+            if keys == old:
+                return
+            for key in old - keys:
+                self._unlink(key, chat.puid)
+            for key in keys - old:
+                if key not in self._puids:
+                    self._puids[key] = set()
+                    bisect.insort(self._sorted, key)
+                self._puids[key].add(chat.puid)
+            self._keys[chat.puid] = keys
+
+    def _prefix(self, keyword: str, limit: int) -> Set[str]:
+        puids = set()
+        i = bisect.bisect_left(self._sorted, keyword)
+        while (i < len(self._sorted) and len(puids) < limit
+               and self._sorted[i].startswith(keyword)):
+            puids.update(self._puids[self._sorted[i]])
+            i += 1
+        return puids
+
+    def _unlink(self, key: str, puid: str) -> None:
+        puids = self._puids.get(key)
+        if puids is None:
+            return
+        puids.discard(puid)
+        if not puids:
+            del self._puids[key]
+            del self._sorted[bisect.bisect_left(self._sorted, key)]
@@ -0,0 +1,91 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import os
+import threading
+from typing import Any, List, Set, Union
+
+
+class Deduplicator:
+    """Recognise messages delivered again, by their id.
+
+    The ids of the last `size` messages are kept in a ring buffer, mirrored
+    by a set for the membership test, so both the time per message and the
+    memory are fixed. New ids are appended to `file` as they arrive, and the
+    window is read back from it at startup, so a message delivered again
+    after a restart is recognised too. The file is rewritten with just the
+    window once it holds twice as many ids.
+    """
+
+    def __init__(self,
+                 size: int = 10000,
+                 file: Union[str, None] = None) -> None:
+        """Create a deduplicator and load the window of the last run.
+
+        Args:
+            size (int, optional): Number of ids remembered. Defaults to 10000.
+            file (Union[str, None], optional): The file keeping the window.
+                Defaults to None, keeping it in memory only.
+        """
+        self.size = size
+        self.file = file
+        self._ring: List[Union[str, None]] = [None] * size
+        self._ids: Set[str] = set()
+        self._next = 0
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._log = None
+        if file is not None:
+            try:
+                with open(file, encoding='utf-8') as f:
+                    ids = f.read().split()
+            except OSError:
+                ids = []
+            for id in ids[-size:]:
+                self._add(id)
+            self._compact()
+
+    def seen(self, id: Any) -> bool:
+        """Check whether a message was seen already, and remember it if not.
+
+        Args:
+            id (Any): The id of the message.
+
+        Returns:
+            bool: True if the message is a duplicate.
+        """
+        id = str(id)
+        with self._lock:
+            if id in self._ids:
+                return True
+            self._add(id)
+            if self._log is not None:
+                self._log.write(id + '\n')
+                self._log.flush()
+                self._lines += 1
+                if self._lines >= 2 * self.size:
+                    self._compact()
+        return False
+
+    def _add(self, id: str) -> None:
+        old = self._ring[self._next]
+        if old is not None:
+            self._ids.discard(old)
+        self._ring[self._next] = id
+        self._ids.add(id)
+        self._next = (self._next + 1) % self.size
+
+    def _compact(self) -> None:
+        if self._log is not None:
+            self._log.close()
+        ids = [
+            id for id in self._ring[self._next:] + self._ring[:self._next]
+            if id is not None
+        ]
+        temp = self.file + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(''.join(id + '\n' for id in ids))
+        os.replace(temp, self.file)
+        self._lines = len(ids)
+        self._log = open(self.file, 'a', encoding='utf-8')
@@ -0,0 +1,53 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+from typing import Any, Callable, Dict, List, Union
+
+
+class Dialog:
+    """One conversation with the user through a sequence of notifications.
+
+    Each step of the conversation is a function taking the dialog and
+    returning the name of the next step, or None once the conversation is
+    over. `run` loops over the steps of a table instead of letting them call
+    each other, so going back and forth between notifications keeps a single
+    stack frame and a single copy of the state. What a step resolves, such as
+    the chat, the attachment or its preview, is kept on the dialog and reused
+    by later steps.
+    """
+
+    __slots__ = ('steps', 'msg', 'msgs', 'chat', 'file', 'preview')
+
+    def __init__(self,
+                 steps: Dict[str, Callable[['Dialog'], Union[str, None]]],
+                 msg: Any = None,
+                 msgs: Union[List[Any], None] = None,
+                 chat: Any = None) -> None:
+        """Create a dialog.
+
+        Args:
+            steps (Dict[str, Callable[[Dialog], Union[str, None]]]): The steps
+                by name.
+            msg (wxpy.Message, optional): The message being replied. Defaults
+                to None.
+            msgs (Union[List[wxpy.Message], None], optional): The burst of
+                messages being replied, ending with `msg`. Defaults to None.
+            chat (wxpy.Chat, optional): The chat the dialog sends to. Defaults
+                to the chat of `msg`.
+        """
+        self.steps = steps
+        self.msg = msg
+        self.msgs = msgs if msgs is not None else [] if msg is None else [msg]
+        self.chat = chat if chat is not None or msg is None else msg.chat
+        self.file: Union[str, None] = None
+        self.preview: Union[str, None] = None
+
+    def run(self, step: Union[str, None]) -> None:
+        """Run the steps until one of them ends the conversation.
+
+        Args:
+            step (Union[str, None]): The name of the first step.
+        """
+        while step is not None:
+            step = self.steps[step](self)
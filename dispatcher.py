@@ -0,0 +1,132 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import queue
+import threading
+from typing import Any, Callable, List
+
+import metrics
+
+BACKPRESSURE_POLICIES = ('block', 'drop_new', 'drop_oldest')
+
+
+class Dispatcher:
+    """Hand inbound messages over to a pool of worker threads.
+
+    Each worker owns a bounded queue. Messages are routed to a worker by the
+    key of their chat, so messages from the same chat are handled one at a
+    time and in arrival order, while different chats are handled in parallel.
+    """
+
+    def __init__(self,
+                 handler: Callable[[Any], None],
+                 key: Callable[[Any], Any],
+                 workers: int = 4,
+                 queue_size: int = 64,
+                 backpressure: str = 'drop_oldest',
+                 timeout: float = 1.0,
+                 size: Callable[[Any], int] = lambda msg: 1) -> None:
+        """Create a dispatcher. Call `start` before submitting messages.
+
+        Args:
+            handler (Callable[[Any], None]): Called with each message on a
+                worker thread.
+            key (Callable[[Any], Any]): Returns the ordering key of a message,
+                usually the puid of its chat.
+            workers (int, optional): Number of worker threads. Defaults to 4.
+            queue_size (int, optional): Capacity of each worker's queue.
+                Defaults to 64.
+            backpressure (str, optional): Policy used when a queue is full,
+                one of `BACKPRESSURE_POLICIES`. Defaults to 'drop_oldest'.
+            timeout (float, optional): Seconds to wait for room under the
+                'block' policy. Defaults to 1.0.
+            size (Callable[[Any], int], optional): Returns the number of
+                messages an item stands for, as counted by `dropped`. Defaults
+                to one per item.
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f'Unknown backpressure policy: {backpressure}')
+        self.handler = handler
+        self.key = key
+        self.backpressure = backpressure
+        self.timeout = timeout
+        self.size = size
+        self.dropped = 0
+        self._queues = [
+            queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))
+        ]
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def depth(self) -> int:
+        """Get the number of messages waiting in all queues.
+
+        Returns:
+            int: The total queue depth.
+        """
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self) -> None:
+        """Start the worker threads.
+        """
+        for q in self._queues:
+            thread = threading.Thread(target=self._work, args=(q, ), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Let the workers finish the queued messages and wait for them.
+        """
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def submit(self, msg: Any) -> bool:
+        """Queue a message without waiting for it to be handled.
+
+        Args:
+            msg (Any): The message to dispatch.
+
+        Returns:
+            bool: Whether the message was queued.
+        """
+        q = self._queues[hash(self.key(msg)) % len(self._queues)]
+        if self.backpressure == 'block':
+            try:
+                q.put(msg, timeout=self.timeout)
+                return True
+            except queue.Full:
+                self._drop(msg)
+                return False
+        while True:
+            try:
+                q.put_nowait(msg)
+                return True
+            except queue.Full:
+                if self.backpressure == 'drop_new':
+                    self._drop(msg)
+                    return False
+            try:
+                self._drop(q.get_nowait())
+                q.task_done()
+            except queue.Empty:
+                pass
+
+    def _drop(self, msg: Any) -> None:
+        with self._lock:
+            self.dropped += self.size(msg)
+
+    def _work(self, q: queue.Queue) -> None:
+        while True:
+            msg = q.get()
+            try:
+                if msg is None:
+                    return
+                self.handler(msg)
+            except Exception:
+                metrics.error('dispatcher')
+            finally:
+                q.task_done()
@@ -0,0 +1,228 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import hashlib
+import http.client
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Callable, Dict, Tuple, Union
+
+import metrics
+from policy import get_file_size
+
+
+def get_md5(msg: Any) -> Union[str, None]:
+    """Get the MD5 digest of a message's attachment as announced by WeChat,
+    which it does for files sent as app messages.
+
+    Args:
+        msg (wxpy.Message): A message carrying a file.
+
+    Returns:
+        Union[str, None]: The hex digest. None if it is unknown.
+    """
+    raw = getattr(msg, 'raw', None)
+    if not isinstance(raw, dict):
+        return None
+    match = re.search(r'<md5>([0-9a-fA-F]{32})</md5>', raw.get('Content', ''))
+    return match.group(1).lower() if match else None
+
+
+def media_request(msg: Any) -> Union[Tuple[str, Dict[str, str]], None]:
+    """Build the request the web API of WeChat serves a message's attachment
+    to, the same as `msg.get_file` sends through itchat.
+
+    Args:
+        msg (wxpy.Message): A message carrying a file.
+
+    Returns:
+        Union[Tuple[str, Dict[str, str]], None]: The URL and the headers.
+        None if the attachment cannot be downloaded by URL.
+    """
+    core = getattr(getattr(msg, 'bot', None), 'core', None)
+    raw = getattr(msg, 'raw', None)
+    if core is None or not isinstance(raw, dict):
+        return None
+    try:
+        from itchat.config import USER_AGENT
+        info = core.loginInfo
+        cookies = dict(core.s.cookies.items())
+        paths = {3: 'webwxgetmsgimg', 34: 'webwxgetvoice', 43: 'webwxgetvideo'}
+        if raw['MsgType'] in paths:
+            url = f'{info["url"]}/{paths[raw["MsgType"]]}'
+            params = {'msgid': raw['NewMsgId'], 'skey': info['skey']}
+        elif raw['MsgType'] == 49 and raw.get('AppMsgType') == 6:
+            url = info['fileUrl'] + '/webwxgetmedia'
+            params = {
+                'sender': raw['FromUserName'],
+                'mediaid': raw['MediaId'],
+                'filename': raw['FileName'],
+                'fromuser': info['wxuin'],
+                'pass_ticket': 'undefined',
+                'webwx_data_ticket': cookies['webwx_data_ticket']
+            }
+        else:
+            return None
+    except (AttributeError, ImportError, KeyError):
+        return None
+    headers = {
+        'User-Agent': USER_AGENT,
+        'Cookie': '; '.join(f'{k}={v}' for k, v in cookies.items())
+    }
+    return url + '?' + urllib.parse.urlencode(params), headers
+
+
+class Downloader:
+    """Download attachments in chunks into a partial file, checked before
+    the caller moves it into place.
+
+    A download that fails is tried again after `backoff` seconds, doubled
+    each time, and continues from the end of the partial file with an HTTP
+    range request, starting over when the source ignores the range. Once the
+    stream ends, the size is checked against the size announced by WeChat,
+    or else by the source, and the MD5 digest against the one announced by
+    WeChat, if any. A file failing the checks is removed and downloaded again.
+    At most `workers` downloads run at once; the others wait for their turn.
+    """
+
+    def __init__(self,
+                 workers: int = 4,
+                 chunk_size: int = 256 << 10,
+                 retries: int = 3,
+                 backoff: float = 1.0,
+                 timeout: float = 30.0) -> None:
+        """Create a downloader.
+
+        Args:
+            workers (int, optional): Maximum number of downloads at once.
+                Defaults to 4.
+            chunk_size (int, optional): Bytes read at a time. Defaults to
+                256 KiB.
+            retries (int, optional): Number of times a failed download is
+                tried again. Defaults to 3.
+            backoff (float, optional): Seconds before the first retry.
+                Defaults to 1.0.
+            timeout (float, optional): Seconds without data before a download
+                fails. Defaults to 30.0.
+        """
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def download(self, msg: Any, file: str) -> None:
+        """Download a message's attachment to a file. An attachment that
+        cannot be downloaded by URL is downloaded by `msg.get_file`, with
+        retries and the size check only.
+
+        Args:
+            msg (wxpy.Message): A message carrying a file.
+            file (str): The path of the file, which may hold the start of the
+                attachment from an earlier try.
+        """
+        size = get_file_size(msg)
+        request = media_request(msg)
+        if request is None:
+            self._retry(lambda: self._get_file(msg, file, size))
+        else:
+            self.fetch(request[0], file, size, get_md5(msg), request[1])
+
+    def fetch(self,
+              url: str,
+              file: str,
+              size: Union[int, None] = None,
+              md5: Union[str, None] = None,
+              headers: Union[Dict[str, str], None] = None) -> None:
+        """Download a URL to a file.
+
+        Args:
+            url (str): The URL.
+            file (str): The path of the file, which may hold the start of the
+                content from an earlier try.
+            size (Union[int, None], optional): The expected size in bytes.
+                Defaults to None, trusting the size given by the source.
+            md5 (Union[str, None], optional): The expected MD5 hex digest.
+                Defaults to None.
+            headers (Union[Dict[str, str], None], optional): Headers of the
+                request. Defaults to None.
+
+        Raises:
+            OSError: The last error once every try failed.
+        """
+        self._retry(lambda: self._fetch(url, file, size, md5, headers or {}))
+
+    def _fetch(self, url: str, file: str, size: Union[int, None],
+               md5: Union[str, None], headers: Dict[str, str]) -> None:
+        digest = hashlib.md5()
+        done = 0
+        if os.path.exists(file):
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    done += len(chunk)
+        request = urllib.request.Request(url, headers=headers)
+        if done:
+            request.add_header('Range', f'bytes={done}-')
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                os.remove(file)
+            raise
+        with response:
+            total = response.headers.get('Content-Length')
+            total = int(total) if total is not None else None
+            if response.status == 206:
+                match = re.match(r'bytes (\d+)-\d+/(\d+|\*)',
+                                 response.headers.get('Content-Range', ''))
+                if match is None or int(match.group(1)) != done:
+                    os.remove(file)
+                    raise OSError(f'Unexpected range from {url}')
+                metrics.inc('downloads_resumed_total')
+                total = int(match.group(2)) if match.group(2) != '*' else None
+                mode = 'ab'
+            else:
+                digest = hashlib.md5()
+                done = 0
+                mode = 'wb'
+            with open(file, mode) as f:
+                for chunk in iter(lambda: response.read(self.chunk_size), b''):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    done += len(chunk)
+        expected = size if size is not None else total
+        if expected is not None and done < expected:
+            raise OSError(f'Download stopped at {done} of {expected} bytes')
+        if expected is not None and done > expected:
+            os.remove(file)
+            raise OSError(f'Downloaded {done} bytes instead of {expected}')
+        if md5 is not None and digest.hexdigest() != md5.lower():
+            os.remove(file)
+            raise OSError(f'MD5 mismatch: {digest.hexdigest()} != {md5}')
+
+    def _get_file(self, msg: Any, file: str, size: Union[int, None]) -> None:
+        msg.get_file(file)
+        done = os.path.getsize(file)
+        if size is not None and done != size:
+            os.remove(file)
+            raise OSError(f'Downloaded {done} bytes instead of {size}')
+
+    def _retry(self, attempt: Callable[[], None]) -> None:
+        for i in range(self.retries + 1):
+            try:
+                with self._slots:
+                    attempt()
+                return
+            except (OSError, http.client.HTTPException) as e:
+                if i == self.retries:
+                    metrics.error('download')
+                    raise OSError(str(e) or type(e).__name__) from e
+                metrics.inc('download_retries_total')
+            time.sleep(self.backoff * 2**i)
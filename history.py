@@ -0,0 +1,291 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import itertools
+import queue
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, List, Tuple, Union
+
+import metrics
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    msg_id TEXT,
+    time REAL,
+    chat TEXT,
+    chat_name TEXT,
+    sender TEXT,
+    type TEXT,
+    text TEXT,
+    file TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_chat ON messages (chat, id);
+CREATE INDEX IF NOT EXISTS messages_msg_id ON messages (msg_id);
+CREATE TRIGGER IF NOT EXISTS messages_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+'''
+
+COLUMNS = ('id', 'msg_id', 'time', 'chat', 'chat_name', 'sender', 'type',
+           'text', 'file')
+
+# The trigram tokenizer matches substrings, which also works for Chinese text
+# that has no spaces between words. It needs queries of at least 3 characters,
+# so shorter ones, such as most Chinese words, search a second index of the
+# pairs of consecutive characters of every text.
+TRIGRAM = 3
+
+SHORT_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_short USING fts5(grams, content='',
+    tokenize='ascii', prefix='2 4 6', detail=none, columnsize=0);
+CREATE TRIGGER IF NOT EXISTS messages_short_insert AFTER INSERT ON messages
+BEGIN
+    INSERT INTO messages_short (rowid, grams)
+    VALUES (new.id, bigrams(new.text));
+END;
+'''
+
+
+def bigrams(text: Union[str, None]) -> str:
+    """Get the tokens of the short-query index of a text: every pair of
+    consecutive characters, and the last character alone, lowercased and
+    hex-encoded so that the tokenizer keeps each one whole.
+
+    Args:
+        text (Union[str, None]): The text of a message.
+
+    Returns:
+        str: The tokens separated by spaces.
+    """
+    text = (text or '').lower()
+    return ' '.join({text[i:i + 2].encode().hex() for i in range(len(text))})
+
+
+class History:
+    """An append-only message history in SQLite with a full-text index.
+
+    `record` and `attach` only queue the row, so they are cheap enough to be
+    called from the message handler. A writer thread inserts the queued rows
+    in batches, one transaction per batch. The database runs in WAL mode so
+    queries from other threads are not blocked by the writer. The messages of
+    a database from before the index of short queries are added to it by the
+    writer thread, a batch at a time while no row is queued, newest first;
+    until that is done, short queries scan the texts instead.
+    """
+
+    def __init__(self,
+                 file: str,
+                 batch_size: int = 500,
+                 flush_interval: float = 0.5) -> None:
+        """Create a history kept in a database. Call `start` to open it.
+
+        Args:
+            file (str): The path of the database.
+            batch_size (int, optional): Maximum rows written per transaction.
+                Defaults to 500.
+            flush_interval (float, optional): Maximum seconds a row waits
+                before being written. Defaults to 0.5.
+        """
+        self.file = file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._local = threading.local()
+        self._thread: Union[threading.Thread, None] = None
+        self.trigram = False
+        self._backfill: Union[int, None] = None
+
+    def add(self, row: Tuple) -> None:
+        """Queue a row for writing.
+
+        Args:
+            row (Tuple): The values of every column but 'id'.
+        """
+        self._queue.put(('INSERT INTO messages (msg_id, time, chat, chat_name, '
+                         'sender, type, text, file) VALUES (?, ?, ?, ?, ?, ?, '
+                         '?, ?)', row))
+
+    def attach(self, msg_id: str, file: str) -> None:
+        """Record the local path of a message's attachment.
+
+        Args:
+            msg_id (str): The id of the message.
+            file (str): The path of the attachment.
+        """
+        self._queue.put(('UPDATE messages SET file = ? WHERE msg_id = ?',
+                         (file, str(msg_id))))
+
+    def flush(self) -> None:
+        """Wait until every queued row is written.
+        """
+        self._queue.join()
+
+    def last(self, chat: str, n: int = 20) -> List[dict]:
+        """Get the last messages of a chat.
+
+        Args:
+            chat (str): The puid of the chat.
+            n (int, optional): Number of messages. Defaults to 20.
+
+        Returns:
+            List[dict]: The messages, oldest first.
+        """
+        rows = self._connect().execute(
+            'SELECT * FROM messages WHERE chat = ? ORDER BY id DESC LIMIT ?',
+            (chat, n)).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in reversed(rows)]
+
+    def record(self, msg: Any) -> None:
+        """Queue an inbound message for writing.
+
+        Args:
+            msg (wxpy.Message): The message received.
+        """
+        sender = msg.member if msg.member is not None else msg.sender
+        self.add((str(msg.id), msg.create_time.timestamp(), msg.chat.puid,
+                  msg.chat.name, sender.name, msg.type, msg.text,
+                  None))
+
+    def search(self,
+               text: str,
+               chat: Union[str, None] = None,
+               limit: int = 50) -> List[dict]:
+        """Search messages by their text.
+
+        Args:
+            text (str): The text to look for.
+            chat (Union[str, None], optional): Only search the chat with this
+                puid. Defaults to None.
+            limit (int, optional): Maximum number of results. Defaults to 50.
+
+        Returns:
+            List[dict]: The matching messages, newest first.
+        """
+        if not text:
+            sql = 'SELECT * FROM messages WHERE 1'
+            params = []
+            order = ' ORDER BY id DESC LIMIT ?'
+        elif self._backfill is not None and len(text) < TRIGRAM:
+            sql = "SELECT * FROM messages WHERE text LIKE ? ESCAPE '\\'"
+            params = ['%' + re.sub(r'([%_\\])', r'\\\1', text) + '%']
+            order = ' ORDER BY id DESC LIMIT ?'
+        elif self.trigram and len(text) < TRIGRAM:
+            sql = ('SELECT messages.* FROM messages_short JOIN messages ON '
+                   'messages.id = messages_short.rowid WHERE messages_short '
+                   'MATCH ?')
+            gram = text.lower().encode().hex()
+            params = [gram if len(text) > 1 else gram + '*']
+            order = ' ORDER BY messages_short.rowid DESC LIMIT ?'
+        else:
+            sql = ('SELECT messages.* FROM messages_fts JOIN messages ON '
+                   'messages.id = messages_fts.rowid WHERE messages_fts '
+                   'MATCH ?')
+            params = ['"' + text.replace('"', '""') + '"']
+            order = ' ORDER BY messages_fts.rowid DESC LIMIT ?'
+        if chat is not None:
+            sql += ' AND chat = ?'
+            params.append(chat)
+        rows = self._connect().execute(sql + order,
+                                       params + [limit]).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def start(self) -> None:
+        """Open, create or migrate the database and start the writer thread.
+        """
+        self._open()
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write the queued rows and stop the writer thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.file)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.create_function('bigrams', 1, bigrams, deterministic=True)
+        return db
+
+    def _fill(self, db: sqlite3.Connection) -> None:
+        end = self._backfill
+        start = max(0, end - self.batch_size)
+        try:
+            with db:
+                db.execute('INSERT INTO messages_short (rowid, grams) SELECT '
+                           'id, bigrams(text) FROM messages WHERE id > ? AND '
+                           'id <= ?', (start, end))
+                if start:
+                    db.execute('UPDATE messages_short_backfill SET id = ?',
+                               (start, ))
+                else:
+                    db.execute('DELETE FROM messages_short_backfill')
+        except sqlite3.Error:
+            metrics.error('history')
+            time.sleep(self.flush_interval)
+            return
+        self._backfill = start or None
+
+    def _open(self) -> None:
+        db = self._connect()
+        try:
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING "
+                       "fts5(text, content='messages', content_rowid='id', "
+                       "tokenize='trigram')")
+            self.trigram = True
+        except sqlite3.OperationalError:
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING "
+                       "fts5(text, content='messages', content_rowid='id')")
+            self.trigram = False
+        db.executescript(SCHEMA)
+        if self.trigram:
+            db.execute('CREATE TABLE IF NOT EXISTS messages_short_backfill '
+                       '(id INTEGER)')
+            if db.execute("SELECT 1 FROM sqlite_master WHERE name = "
+                          "'messages_short'").fetchone() is None:
+                with db:
+                    db.execute('DELETE FROM messages_short_backfill')
+                    db.execute('INSERT INTO messages_short_backfill SELECT id '
+                               'FROM messages ORDER BY id DESC LIMIT 1')
+            db.executescript(SHORT_SCHEMA)
+            row = db.execute(
+                'SELECT id FROM messages_short_backfill').fetchone()
+            self._backfill = row[0] if row else None
+
+    def _write(self) -> None:
+        db = self._connect()
+        while True:
+            if self._backfill is not None and self._queue.empty():
+                self._fill(db)
+                continue
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(
+                        self._queue.get(
+                            timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                with db:
+                    ops = (op for op in batch if op is not None)
+                    for sql, group in itertools.groupby(ops, lambda op: op[0]):
+                        db.executemany(sql, [op[1] for op in group])
+            except sqlite3.Error:
+                metrics.error('history')
+            for _ in batch:
+                self._queue.task_done()
+            if batch[-1] is None:
+                return
@@ -0,0 +1,125 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List
+
+from outbox import SendJob
+
+
+class SendJournal:
+    """A write-ahead log of send jobs, so that queued sends survive a crash.
+
+    Each job is appended and synced to disk before it is queued, and
+    acknowledged once it is sent or has failed for good. The jobs not yet
+    acknowledged are kept in memory too, so that the log can be compacted to
+    just those jobs after every `compact_every` acknowledgements without
+    reading it back.
+    """
+
+    def __init__(self, file: str, compact_every: int = 100) -> None:
+        """Open the journal and load the jobs left by the last run.
+
+        Args:
+            file (str): The path of the log.
+            compact_every (int, optional): Acknowledgements between two
+                compactions. Defaults to 100.
+        """
+        self.file = file
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._pending: 'OrderedDict[str, dict]' = OrderedDict()
+        self._acked = 0
+        self._load()
+        self.compact()
+
+    def ack(self, id: str) -> None:
+        """Mark a job as done.
+
+        Args:
+            id (str): The id of the job.
+        """
+        with self._lock:
+            if self._pending.pop(id, None) is None:
+                return
+            self._write({'op': 'ack', 'id': id}, sync=False)
+            self._acked += 1
+            due = self._acked >= self.compact_every
+        if due:
+            self.compact()
+
+    def append(self, job: SendJob) -> bool:
+        """Write a job to the log before it is queued.
+
+        Args:
+            job (SendJob): The job.
+
+        Returns:
+            bool: False if a job with the same id is already pending.
+        """
+        record = {
+            'op': 'add',
+            'id': job.id,
+            'chat': job.chat,
+            'kind': job.kind,
+            'payload': job.payload
+        }
+        with self._lock:
+            if job.id in self._pending:
+                return False
+            self._write(record, sync=True)
+            self._pending[job.id] = record
+        return True
+
+    def compact(self) -> None:
+        """Rewrite the log with only the pending jobs.
+        """
+        with self._lock:
+            temp = self.file + '.tmp'
+            with open(temp, 'w', encoding='utf-8') as f:
+                for record in self._pending.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.file)
+            self._acked = 0
+
+    def pending(self) -> List[SendJob]:
+        """Get the jobs not acknowledged yet, in the order they were added.
+
+        Returns:
+            List[SendJob]: The jobs.
+        """
+        with self._lock:
+            records = list(self._pending.values())
+        return [
+            SendJob(record['chat'], record['kind'], record['payload'],
+                    record['id']) for record in records
+        ]
+
+    def _load(self) -> None:
+        try:
+            with open(self.file, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('op') == 'add':
+                self._pending.setdefault(record['id'], record)
+            elif record.get('op') == 'ack':
+                self._pending.pop(record.get('id'), None)
+
+    def _write(self, record: dict, sync: bool) -> None:
+        with open(self.file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
@@ -0,0 +1,289 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+PREFIX = 'ramox_'
+
+# Upper bounds in seconds of the histogram buckets of timing spans.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+_enabled = False
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+_spans: Dict[str, List] = {}
+
+
+class _Span:
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> '_Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        observe(self.name, time.perf_counter() - self.start)
+
+
+class _NullSpan:
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable() -> None:
+    """Start collecting metrics. Until then every call of this module returns
+    at once.
+    """
+    global _enabled
+    _enabled = True
+
+
+def error(where: str) -> None:
+    """Count an exception that was caught and ignored.
+
+    Args:
+        where (str): The function that caught it.
+    """
+    if _enabled:
+        inc('errors_total', where=where)
+
+
+def gauge(name: str, read: Callable[[], float]) -> None:
+    """Register a gauge, read whenever the metrics are exported.
+
+    Args:
+        name (str): The name of the gauge.
+        read (Callable[[], float]): Returns the current value.
+    """
+    _gauges[name] = read
+
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    """Increase a counter.
+
+    Args:
+        name (str): The name of the counter, ending in '_total'.
+        value (float, optional): The increment. Defaults to 1.
+    """
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def is_enabled() -> bool:
+    """Check whether metrics are being collected.
+
+    Returns:
+        bool: Whether `enable` was called.
+    """
+    return _enabled
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record the duration of a stage.
+
+    Args:
+        name (str): The name of the stage.
+        seconds (float): The duration.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        span = _spans.get(name)
+        if span is None:
+            span = _spans[name] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        span[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        span[1] += seconds
+        span[2] += 1
+
+
+def render() -> str:
+    """Export the metrics in the Prometheus text format.
+
+    Returns:
+        str: The metrics.
+    """
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        spans = {name: (list(b), s, c) for name, (b, s, c) in _spans.items()}
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {PREFIX}{name} counter')
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f'{PREFIX}{name}{_labels(labels)} {value:g}')
+    for name, read in sorted(_gauges.items()):
+        lines.append(f'# TYPE {PREFIX}{name} gauge')
+        lines.append(f'{PREFIX}{name} {read():g}')
+    if spans:
+        lines.append(f'# TYPE {PREFIX}span_seconds histogram')
+    for name, (buckets, total, count) in sorted(spans.items()):
+        cumulative = 0
+        for bound, hits in zip(BUCKETS + ('+Inf', ), buckets):
+            cumulative += hits
+            labels = _labels((('le', str(bound)), ('span', name)))
+            lines.append(f'{PREFIX}span_seconds_bucket{labels} {cumulative}')
+        labels = _labels((('span', name), ))
+        lines.append(f'{PREFIX}span_seconds_sum{labels} {total:g}')
+        lines.append(f'{PREFIX}span_seconds_count{labels} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve the metrics over HTTP on a background thread.
+
+    Args:
+        port (int): The port to listen on.
+        host (str, optional): The address to listen on. Defaults to
+            '127.0.0.1'.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self) -> None:
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def snapshot() -> Dict[str, Any]:
+    """Get the current metrics as plain data.
+
+    Returns:
+        Dict[str, Any]: Counters, gauges and spans with their count, total
+        and mean seconds.
+    """
+    with _lock:
+        counters = {
+            name + _labels(labels): value
+            for (name, labels), value in _counters.items()
+        }
+        spans = {
+            name: {
+                'count': count,
+                'seconds': total,
+                'mean': total / count
+            }
+            for name, (_, total, count) in _spans.items()
+        }
+    gauges = {name: read() for name, read in _gauges.items()}
+    return {
+        'time': time.time(),
+        'counters': counters,
+        'gauges': gauges,
+        'spans': spans
+    }
+
+
+def span(name: str) -> Any:
+    """Time a block of code.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        A context manager recording the duration of the block.
+    """
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Time every call of a function.
+
+    Args:
+        name (str): The name of the stage.
+
+    Returns:
+        Callable[[Callable], Callable]: The decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def write_json(file: str,
+               interval: float = 60,
+               max_bytes: int = 10 << 20) -> threading.Thread:
+    """Append a snapshot of the metrics to a JSON lines file periodically.
+    When the file exceeds `max_bytes` it is renamed with a '.1' suffix and a
+    new one is started.
+
+    Args:
+        file (str): The path of the file.
+        interval (float, optional): Seconds between snapshots. Defaults to 60.
+        max_bytes (int, optional): Size at which the file is rolled over.
+            Defaults to 10 MiB.
+
+    Returns:
+        threading.Thread: The writing thread.
+    """
+
+    def write() -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                if os.path.exists(file) and os.path.getsize(file) > max_bytes:
+                    os.replace(file, file + '.1')
+                with open(file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(snapshot()) + '\n')
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=write, daemon=True)
+    thread.start()
+    return thread
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
@@ -0,0 +1,263 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, Tuple, Union
+
+
+class Notifier:
+    """The interface of a notification backend.
+
+    `toast` takes the keyword arguments of `win11toast.toast` used by the
+    program: 'image' (path of an image), 'input' (id of a text box), 'inputs'
+    (ids of several text boxes), 'selection' (choices of a dropdown) and
+    'buttons' (labels or button dicts). It waits for the user and returns a
+    dict with the 'arguments' of the clicked button and the 'user_input' by
+    input id, or an empty dict if the notification was dismissed.
+    """
+
+    def notify(self, text: str) -> None:
+        """Show a notification without waiting for the user.
+
+        Args:
+            text (str): Main text of the notification.
+        """
+        raise NotImplementedError
+
+    def notify_progress(self, text: str) -> None:
+        """Show a notification with a progress bar without waiting.
+
+        Args:
+            text (str): Main text of the notification.
+        """
+        raise NotImplementedError
+
+    def toast(self, text: str, **kwargs) -> dict:
+        """Show a notification and wait for the user.
+
+        Args:
+            text (str): Main text of the notification.
+
+        Returns:
+            dict: The result of the notification.
+        """
+        raise NotImplementedError
+
+    def update_progress(self, value: Union[float, str], status: str) -> None:
+        """Update the progress bar shown by `notify_progress`.
+
+        Args:
+            value (Union[float, str]): The progress between 0 and 1, or
+                'indeterminate'.
+            status (str): The status text below the bar.
+        """
+        raise NotImplementedError
+
+
+class Win11Notifier(Notifier):
+    """Show notifications in the Windows 11 Action Center with win11toast.
+
+    win11toast is imported on first use. A toast whose result is not a dict
+    counts as dismissed.
+    """
+
+    def __init__(self, title: str = 'WeChat') -> None:
+        self.title = title
+
+    def notify(self, text: str) -> None:
+        import win11toast
+        win11toast.notify(self.title, text)
+
+    def notify_progress(self, text: str) -> None:
+        import win11toast
+        win11toast.notify(self.title,
+                          text,
+                          progress={
+                              'title': text,
+                              'status': 'Downloading...',
+                              'value': 'indeterminate',
+                              'valueStringOverride': ''
+                          })
+
+    def toast(self, text: str, **kwargs) -> dict:
+        import win11toast
+        res = win11toast.toast(self.title, text, duration='long', **kwargs)
+        return res if isinstance(res, dict) else {}
+
+    def update_progress(self, value: Union[float, str], status: str) -> None:
+        import win11toast
+        win11toast.update_progress({
+            'value': value,
+            'valueStringOverride': '' if isinstance(value, str) else f'{value:.0%}',
+            'status': status
+        })
+
+
+def response(button: str = '', user_input: Union[Dict[str, str],
+                                                  None] = None) -> dict:
+    """Build the result of a notification as win11toast returns it.
+
+    Args:
+        button (str, optional): The label of the clicked button, or '' for the
+            'Reply' and 'Send' buttons. Defaults to ''.
+        user_input (Union[Dict[str, str], None], optional): Text typed or
+            selected by input id. Defaults to None.
+
+    Returns:
+        dict: The result of the notification.
+    """
+    return {'arguments': 'http:' + button, 'user_input': user_input or {}}
+
+
+class HeadlessNotifier(Notifier):
+    """Answer notifications from a script without showing anything.
+
+    The answer to each toast comes from `responder`, called with the text and
+    keyword arguments of the toast, or from the next item of an iterable of
+    results. When neither is given or the script runs out, toasts are
+    dismissed. Every toast is recorded in `shown` with its start and end time,
+    for tests and benchmarks.
+    """
+
+    def __init__(self,
+                 responder: Union[Callable[[str, dict], dict], Iterable[dict],
+                                  None] = None,
+                 delay: float = 0.0,
+                 history: int = 10000) -> None:
+        """Create a headless notifier.
+
+        Args:
+            responder (Union[Callable[[str, dict], dict], Iterable[dict],
+                None], optional): The script answering toasts. Defaults to
+                None.
+            delay (float, optional): Seconds every toast blocks, as if the
+                user took that long to answer. Defaults to 0.0.
+            history (int, optional): Number of toasts kept in `shown`.
+                Defaults to 10000.
+        """
+        if responder is not None and not callable(responder):
+            responder = iter(responder)
+        self.responder = responder
+        self.delay = delay
+        self.progress: Tuple[Any, str] = (None, '')
+        self.shown: Deque[Tuple[float, float, str, dict]] = deque(
+            maxlen=history)
+        self._lock = threading.Lock()
+
+    def notify(self, text: str) -> None:
+        now = time.perf_counter()
+        self.shown.append((now, now, text, {}))
+
+    def notify_progress(self, text: str) -> None:
+        self.progress = ('indeterminate', text)
+
+    def toast(self, text: str, **kwargs) -> dict:
+        start = time.perf_counter()
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            if callable(self.responder):
+                result = self.responder(text, kwargs)
+            elif self.responder is not None:
+                result = next(self.responder, {})
+            else:
+                result = {}
+        self.shown.append((start, time.perf_counter(), text, kwargs))
+        return result
+
+    def update_progress(self, value: Union[float, str], status: str) -> None:
+        self.progress = (value, status)
+
+
+class RemoteNotifier(Notifier):
+    """Forward notifications over a connection to the process showing them,
+    such as the supervisor of `accounts`.
+
+    Requests are sent as ('notify', text), ('notify_progress', text),
+    ('update_progress', value, status) and ('toast', id, text, kwargs), and
+    the result of a toast comes back as ('result', id, result). Any other
+    message received is a command given to `on_command`. Once the connection
+    is closed, waiting toasts are dismissed and `on_close` is called.
+    """
+
+    def __init__(self,
+                 conn: Any,
+                 on_command: Union[Callable[[tuple], None], None] = None,
+                 on_close: Union[Callable[[], None], None] = None) -> None:
+        """Create a remote notifier and start receiving on the connection.
+
+        Args:
+            conn (multiprocessing.connection.Connection): The connection to
+                the process showing the notifications.
+            on_command (Union[Callable[[tuple], None], None], optional):
+                Handles the commands received. Defaults to None.
+            on_close (Union[Callable[[], None], None], optional): Called once
+                the connection is closed. Defaults to None.
+        """
+        self.conn = conn
+        self.on_command = on_command
+        self.on_close = on_close
+        self._ids = itertools.count()
+        self._waiting: Dict[int, list] = {}
+        self._closed = False
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def notify(self, text: str) -> None:
+        self._send(('notify', text))
+
+    def notify_progress(self, text: str) -> None:
+        self._send(('notify_progress', text))
+
+    def toast(self, text: str, **kwargs) -> dict:
+        if isinstance(kwargs.get('image'), str):
+            kwargs['image'] = os.path.abspath(kwargs['image'])
+        id = next(self._ids)
+        waiting = [threading.Event(), {}]
+        with self._lock:
+            if self._closed:
+                return {}
+            self._waiting[id] = waiting
+        if self._send(('toast', id, text, kwargs)):
+            waiting[0].wait()
+        with self._lock:
+            self._waiting.pop(id, None)
+        return waiting[1]
+
+    def update_progress(self, value: Union[float, str], status: str) -> None:
+        self._send(('update_progress', value, status))
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == 'result':
+                with self._lock:
+                    waiting = self._waiting.get(message[1])
+                if waiting is not None:
+                    waiting[1] = message[2]
+                    waiting[0].set()
+            elif self.on_command is not None:
+                self.on_command(message)
+        with self._lock:
+            self._closed = True
+            for waiting in self._waiting.values():
+                waiting[0].set()
+        if self.on_close is not None:
+            self.on_close()
+
+    def _send(self, message: tuple) -> bool:
+        with self._send_lock:
+            try:
+                self.conn.send(message)
+            except (OSError, ValueError):
+                return False
+        return True
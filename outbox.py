@@ -0,0 +1,261 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import queue
+import random
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Union
+
+import metrics
+
+# Kinds of content a send job can carry.
+KINDS = ('text', 'image', 'file', 'video')
+
+
+class SendJob:
+    """Something to send to a chat.
+
+    Only plain data is kept, so a job can be written to disk and sent after a
+    restart.
+    """
+
+    __slots__ = ('id', 'chat', 'kind', 'payload', 'attempts')
+
+    def __init__(self,
+                 chat: str,
+                 kind: str,
+                 payload: str,
+                 id: Union[str, None] = None) -> None:
+        """Create a job.
+
+        Args:
+            chat (str): The puid of the chat.
+            kind (str): One of `KINDS`.
+            payload (str): The text, or the path of the file to send.
+            id (Union[str, None], optional): A unique id. Defaults to a new
+                random one.
+        """
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind of send job: {kind}')
+        self.id = id or uuid.uuid4().hex
+        self.chat = chat
+        self.kind = kind
+        self.payload = payload
+        self.attempts = 0
+
+
+class TokenBucket:
+    """A token bucket limiting how often something happens.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """Create a full bucket.
+
+        Args:
+            rate (float): Tokens added per second.
+            burst (int): Capacity of the bucket.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, waiting until one is available.
+        """
+        while True:
+            with self._lock:
+                wait = self._take()
+                if not wait:
+                    return
+            time.sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available, without waiting.
+
+        Returns:
+            bool: Whether a token was taken.
+        """
+        with self._lock:
+            return not self._take()
+
+    def _take(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._time) * self.rate)
+        self._time = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class SendQueue:
+    """Send messages on worker threads with rate limiting and retries.
+
+    Jobs for the same chat go to the same worker and are sent in order. All
+    workers share one token bucket, so the account as a whole never sends
+    faster than `rate`. A failing job is retried after an exponential backoff
+    with jitter; later jobs of its chat wait for it.
+    """
+
+    def __init__(self,
+                 execute: Callable[[SendJob], Any],
+                 on_done: Union[Callable[[SendJob], None], None] = None,
+                 on_failed: Union[Callable[[SendJob, Exception], None],
+                                  None] = None,
+                 workers: int = 2,
+                 rate: float = 1.0,
+                 burst: int = 5,
+                 retries: int = 3,
+                 backoff: float = 2.0,
+                 max_backoff: float = 60.0,
+                 journal: Any = None) -> None:
+        """Create a send queue. Call `start` before submitting jobs.
+
+        Args:
+            execute (Callable[[SendJob], Any]): Sends a job, raising an
+                exception on failure.
+            on_done (Union[Callable[[SendJob], None], None], optional): Called
+                after a job is sent. Defaults to None.
+            on_failed (Union[Callable[[SendJob, Exception], None], None],
+                optional): Called when a job fails for the last time. Defaults
+                to None.
+            workers (int, optional): Number of worker threads. Defaults to 2.
+            rate (float, optional): Sends per second. Defaults to 1.0.
+            burst (int, optional): Sends allowed at once after a pause.
+                Defaults to 5.
+            retries (int, optional): Retries of a failing job. Defaults to 3.
+            backoff (float, optional): Seconds before the first retry, doubled
+                for each further one. Defaults to 2.0.
+            max_backoff (float, optional): Maximum seconds between retries.
+                Defaults to 60.0.
+            journal (journal.SendJournal, optional): Log keeping the jobs
+                until they are sent or have failed. Defaults to None.
+        """
+        self.execute = execute
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.journal = journal
+        self.bucket = TokenBucket(rate, burst)
+        self._callbacks: Dict[str, Callable[[SendJob, Union[Exception, None]],
+                                            None]] = {}
+        self._queues: List[queue.Queue] = [
+            queue.Queue() for _ in range(max(1, workers))
+        ]
+        self._threads: List[threading.Thread] = []
+
+    def depth(self) -> int:
+        """Get the number of jobs waiting in all queues.
+
+        Returns:
+            int: The total queue depth.
+        """
+        return sum(q.qsize() for q in self._queues)
+
+    def join(self) -> None:
+        """Wait until every submitted job is sent or has failed.
+        """
+        for q in self._queues:
+            q.join()
+
+    def replay(self) -> int:
+        """Queue the jobs the journal kept from the last run.
+
+        Returns:
+            int: The number of jobs queued.
+        """
+        if self.journal is None:
+            return 0
+        jobs = self.journal.pending()
+        for job in jobs:
+            self._queue(job)
+        return len(jobs)
+
+    def start(self) -> None:
+        """Start the worker threads.
+        """
+        for q in self._queues:
+            thread = threading.Thread(target=self._work, args=(q, ), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Let the workers finish the queued jobs and wait for them.
+        """
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def submit(self,
+               job: SendJob,
+               callback: Union[Callable[[SendJob, Union[Exception, None]],
+                                        None], None] = None) -> None:
+        """Queue a job without waiting for it to be sent.
+
+        Args:
+            job (SendJob): The job.
+            callback (Union[Callable[[SendJob, Union[Exception, None]], None],
+                None], optional): Called once the job is finished, with the
+                last error if it failed. Defaults to None.
+        """
+        if self.journal is not None and not self.journal.append(job):
+            return
+        if callback is not None:
+            self._callbacks[job.id] = callback
+        self._queue(job)
+
+    def _queue(self, job: SendJob) -> None:
+        metrics.inc('sends_queued_total', kind=job.kind)
+        self._queues[hash(job.chat) % len(self._queues)].put(job)
+
+    def _send(self, job: SendJob) -> None:
+        while True:
+            self.bucket.acquire()
+            job.attempts += 1
+            try:
+                with metrics.span('send_' + job.kind):
+                    self.execute(job)
+            except Exception as e:
+                metrics.error('send_queue')
+                if job.attempts > self.retries:
+                    self._ack(job, e)
+                    if self.on_failed is not None:
+                        self.on_failed(job, e)
+                    return
+                delay = min(self.max_backoff,
+                            self.backoff * 2**(job.attempts - 1))
+                time.sleep(delay * random.uniform(0.5, 1))
+                continue
+            self._ack(job, None)
+            if self.on_done is not None:
+                self.on_done(job)
+            return
+
+    def _ack(self, job: SendJob, error: Union[Exception, None]) -> None:
+        if self.journal is not None:
+            self.journal.ack(job.id)
+        callback = self._callbacks.pop(job.id, None)
+        if callback is not None:
+            callback(job, error)
+
+    def _work(self, q: queue.Queue) -> None:
+        while True:
+            job = q.get()
+            try:
+                if job is None:
+                    return
+                self._send(job)
+            except Exception:
+                metrics.error('send_queue')
+            finally:
+                q.task_done()
@@ -0,0 +1,71 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+from typing import Any, Dict, Union
+
+CHAT_RULES = ('always', 'never')
+
+
+def get_file_size(msg: Any) -> Union[int, None]:
+    """Get the size of a message's attachment as announced by WeChat.
+
+    Args:
+        msg (wxpy.Message): A message carrying a file.
+
+    Returns:
+        Union[int, None]: The size in bytes. None if it is unknown.
+    """
+    try:
+        return int(msg.file_size)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class DownloadPolicy:
+    """Decide which attachments are downloaded before their toast is shown.
+
+    A chat rule, matched by the puid or the name of the chat, takes
+    precedence. Otherwise an attachment is prefetched if its size is within
+    the limit of its message type. A limit of None prefetches every size, even
+    unknown ones; a limit of 0 never prefetches; attachments of unknown size
+    are not prefetched under any other limit.
+    """
+
+    def __init__(self,
+                 max_sizes: Dict[str, Union[int, None]],
+                 chat_rules: Union[Dict[str, str], None] = None) -> None:
+        """Create a policy.
+
+        Args:
+            max_sizes (Dict[str, Union[int, None]]): Size limit in bytes by
+                message type. Types not listed are never prefetched.
+            chat_rules (Union[Dict[str, str], None], optional): 'always' or
+                'never' by chat puid or name. Defaults to None.
+        """
+        for rule in (chat_rules or {}).values():
+            if rule not in CHAT_RULES:
+                raise ValueError(f'Unknown chat rule: {rule}')
+        self.max_sizes = max_sizes
+        self.chat_rules = chat_rules or {}
+
+    def prefetch(self, msg: Any) -> bool:
+        """Check whether a message's attachment should be downloaded now.
+
+        Args:
+            msg (wxpy.Message): A message carrying a file.
+
+        Returns:
+            bool: Whether to download the attachment before the toast.
+        """
+        rule = self.chat_rules.get(msg.chat.puid) or self.chat_rules.get(
+            msg.chat.name)
+        if rule is not None:
+            return rule == 'always'
+        if msg.type not in self.max_sizes:
+            return False
+        limit = self.max_sizes[msg.type]
+        if limit is None:
+            return True
+        size = get_file_size(msg)
+        return size is not None and size <= limit
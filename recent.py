@@ -0,0 +1,138 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Union
+
+
+class RecentChats:
+    """Remember the chats used recently, ranked by recency and frequency.
+
+    Only the puid, name, use count and last use time of each chat are kept,
+    so no `wxpy.Chat` object stays in memory; callers resolve puids through
+    the contact index. The entries are persisted to a JSON file, loaded on
+    first use and saved at most once every `save_interval` seconds.
+    """
+
+    def __init__(self,
+                 file: str,
+                 size: int = 10,
+                 half_life: float = 86400,
+                 save_interval: float = 5) -> None:
+        """Create the cache. Nothing is read from disk until first use.
+
+        Args:
+            file (str): The path of the JSON file.
+            size (int, optional): Maximum number of chats. Defaults to 10.
+            half_life (float, optional): Seconds after which a use counts half
+                as much in the ranking. Defaults to one day.
+            save_interval (float, optional): Minimum seconds between two
+                saves. Defaults to 5.
+        """
+        self.file = file
+        self.size = size
+        self.half_life = half_life
+        self.save_interval = save_interval
+        self._entries: 'Union[OrderedDict[str, dict], None]' = None
+        self._lock = threading.Lock()
+        self._saved = 0.0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+    def names(self) -> List[str]:
+        """Get the names of the cached chats, best ranked first.
+
+        Returns:
+            List[str]: The chat names.
+        """
+        return [entry['name'] for entry in self.ranked()]
+
+    def puid(self, name: str) -> Union[str, None]:
+        """Get the puid of a cached chat by its name.
+
+        Args:
+            name (str): The name of the chat.
+
+        Returns:
+            Union[str, None]: The puid. None if no cached chat has this name.
+        """
+        with self._lock:
+            for puid, entry in self._load().items():
+                if entry['name'] == name:
+                    return puid
+        return None
+
+    def ranked(self) -> List[dict]:
+        """Get the cached entries sorted by their score.
+
+        Returns:
+            List[dict]: Entries with the keys 'puid', 'name', 'count' and
+            'last'.
+        """
+        now = time.time()
+        with self._lock:
+            entries = [dict(entry, puid=puid)
+                       for puid, entry in self._load().items()]
+        return sorted(entries,
+                      key=lambda entry: entry['count'] * 0.5**(
+                          (now - entry['last']) / self.half_life),
+                      reverse=True)
+
+    def save(self) -> None:
+        """Write the entries to disk.
+        """
+        with self._lock:
+            if self._entries is None:
+                return
+            data = json.dumps(self._entries, ensure_ascii=False)
+            self._saved = time.monotonic()
+        temp = self.file + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(temp, self.file)
+
+    def touch(self, puid: str, name: str) -> None:
+        """Record a use of a chat. The least recently used chat is removed
+        when the cache is full.
+
+        Args:
+            puid (str): The puid of the chat.
+            name (str): The name of the chat.
+        """
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(puid)
+            if entry is None:
+                entry = entries[puid] = {'name': name, 'count': 0}
+                if len(entries) > self.size:
+                    entries.popitem(last=False)
+            entries.move_to_end(puid)
+            entry['name'] = name
+            entry['count'] += 1
+            entry['last'] = time.time()
+            due = time.monotonic() - self._saved >= self.save_interval
+        if due:
+            try:
+                self.save()
+            except OSError:
+                pass
+
+    def _load(self) -> 'OrderedDict[str, dict]':
+        if self._entries is None:
+            self._entries = OrderedDict()
+            try:
+                with open(self.file, encoding='utf-8') as f:
+                    data = json.load(f)
+                self._entries.update(
+                    sorted(data.items(),
+                           key=lambda item: item[1]['last'])[-self.size:])
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        return self._entries
@@ -0,0 +1,227 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import json
+from collections import deque
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+ACTIONS = ('allow', 'deny')
+
+# Conditions a rule can put on a message.
+FIELDS = ('chats', 'senders', 'types', 'keywords')
+
+
+class Automaton:
+    """An Aho-Corasick automaton finding many keywords in one pass.
+
+    Each keyword carries a bit mask. `match` returns the union of the masks of
+    all keywords found in a text, case-insensitively.
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, int]]) -> None:
+        """Build the automaton.
+
+        Args:
+            keywords (Iterable[Tuple[str, int]]): Pairs of a keyword and its
+                mask.
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[int] = [0]
+        for keyword, mask in keywords:
+            state = 0
+            for char in keyword.lower():
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._out.append(0)
+                state = nxt
+            self._out[state] |= mask
+        self._fail = [0] * len(self._goto)
+        todo = deque(self._goto[0].values())
+        while todo:
+            state = todo.popleft()
+            for char, nxt in self._goto[state].items():
+                todo.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def match(self, text: str) -> int:
+        """Find the keywords in a text.
+
+        Args:
+            text (str): The text to scan.
+
+        Returns:
+            int: The union of the masks of the keywords found.
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        state = mask = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            mask |= out[state]
+        return mask
+
+
+def message_fields(msg: Any) -> Tuple[str, str, Tuple[Union[str, None], ...],
+                                      str, Union[str, None]]:
+    """Get the attributes of a message that rules look at.
+
+    Args:
+        msg (wxpy.Message): The message received.
+
+    Returns:
+        Tuple[str, str, Tuple[Union[str, None], ...], str, Union[str, None]]:
+        The puid and name of the chat, the puid and names of the sender, the
+        type and the text of the message.
+    """
+    chat = msg.chat
+    sender = msg.member if msg.member is not None else msg.sender
+    return chat.puid, chat.name, (sender.puid, sender.name), msg.type, msg.text
+
+
+class Matcher:
+    """A list of rules compiled into bit masks.
+
+    A rule is a dict with any of the conditions in `FIELDS`, each a list of
+    values. A message matches a rule if it meets every condition the rule
+    has: its chat puid or name is in 'chats', its sender puid or name is in
+    'senders', its type is in 'types' and its text contains one of
+    'keywords'. Other keys of a rule are left to the user of the matcher.
+
+    Rule `i` owns bit `i` of every mask. For each condition, a table maps each
+    value to the rules accepting it, and rules without that condition accept
+    everything, so a message is checked against all rules with a handful of
+    dict lookups, one keyword scan and a few integer ANDs.
+    """
+
+    def __init__(self, rules: List[dict]) -> None:
+        """Compile the rules.
+
+        Args:
+            rules (List[dict]): The rules, in order of precedence.
+        """
+        self.rules = rules
+        self._any = dict.fromkeys(FIELDS, 0)
+        self._tables: Dict[str, Dict[str, int]] = {
+            field: {}
+            for field in FIELDS
+        }
+        for i, rule in enumerate(rules):
+            for field in FIELDS:
+                if field not in rule:
+                    self._any[field] |= 1 << i
+                    continue
+                table = self._tables[field]
+                for value in rule[field]:
+                    table[value] = table.get(value, 0) | 1 << i
+        self._automaton = Automaton(self._tables['keywords'].items())
+
+    def match(self, puid: str, name: str, senders: Tuple[Union[str, None],
+                                                         ...], type: str,
+              text: Union[str, None]) -> int:
+        """Find the rules a message matches, given by its attributes.
+
+        Args:
+            puid (str): The puid of the chat.
+            name (str): The name of the chat.
+            senders (Tuple[Union[str, None], ...]): The puid and names of the
+                sender.
+            type (str): The message type.
+            text (Union[str, None]): The text of the message.
+
+        Returns:
+            int: The mask of the matching rules. The lowest bit set is the
+            first matching rule.
+        """
+        tables, any_ = self._tables, self._any
+        chats = tables['chats']
+        mask = any_['chats'] | chats.get(puid, 0) | chats.get(name, 0)
+        sender_mask = any_['senders']
+        for sender in senders:
+            sender_mask |= tables['senders'].get(sender, 0)
+        mask &= sender_mask
+        mask &= any_['types'] | tables['types'].get(type, 0)
+        if mask & ~any_['keywords']:
+            keywords = self._automaton.match(text) if text else 0
+            mask &= any_['keywords'] | keywords
+        return mask
+
+
+class RuleSet:
+    """An ordered list of allow and deny rules.
+
+    A rule is a dict with an 'action' and the conditions of a `Matcher`. The
+    first matching rule decides; messages matching no rule are allowed.
+    """
+
+    def __init__(self, rules: List[dict]) -> None:
+        """Compile the rules.
+
+        Args:
+            rules (List[dict]): The rules, in order of precedence.
+        """
+        self.rules = rules
+        self._allow = 0
+        for i, rule in enumerate(rules):
+            if rule.get('action') not in ACTIONS:
+                raise ValueError(f'Unknown action in rule {i}: {rule}')
+            if rule['action'] == 'allow':
+                self._allow |= 1 << i
+        self._matcher = Matcher(rules)
+
+    @classmethod
+    def load(cls, file: str) -> 'RuleSet':
+        """Load the rules from a JSON file holding a list of rules.
+
+        Args:
+            file (str): The path of the file. A missing file means no rules.
+
+        Returns:
+            RuleSet: The compiled rules.
+        """
+        try:
+            with open(file, encoding='utf-8') as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls([])
+
+    def allows(self, msg: Any) -> bool:
+        """Check whether a message should be handled.
+
+        Args:
+            msg (wxpy.Message): The message received.
+
+        Returns:
+            bool: False if the first matching rule denies the message.
+        """
+        return self.check(*message_fields(msg))
+
+    def check(self, puid: str, name: str, senders: Tuple[Union[str, None],
+                                                         ...], type: str,
+              text: Union[str, None]) -> bool:
+        """Check a message given by its attributes.
+
+        Args:
+            puid (str): The puid of the chat.
+            name (str): The name of the chat.
+            senders (Tuple[Union[str, None], ...]): The puid and names of the
+                sender.
+            type (str): The message type.
+            text (Union[str, None]): The text of the message.
+
+        Returns:
+            bool: False if the first matching rule denies the message.
+        """
+        if not self.rules:
+            return True
+        mask = self._matcher.match(puid, name, senders, type, text)
+        if not mask:
+            return True
+        return bool(mask & -mask & self._allow)
@@ -15,19 +15,324 @@
 
 # Contact the author of this program via email <guanweilong2022@163.com>.
 
+from collections import OrderedDict
 from typing import List
+import atexit
+import re
 import threading
+import time
 
-import keyboard
-import pyperclip
 import wxpy
 
+from api import ApiServer
+from attachments import AttachmentStore
+from autoreply import AutoReplier
+from broadcast import Broadcast, SavedLists
+from coalesce import Coalescer
+from config import *
+from contacts import ContactIndex, SavedChat
+from dedup import Deduplicator
+from dialog import Dialog
+from dispatcher import Dispatcher
+from downloads import Downloader
+from history import History
+from journal import SendJournal
+import metrics
+from outbox import SendJob, SendQueue
+from policy import DownloadPolicy
+from recent import RecentChats
+from rules import RuleSet
+from uploads import MediaCache
 from utils import *
 
-bot = wxpy.Bot(cache_path=True)
-cache = []
+bot: Union[wxpy.Bot, None] = None
+history = History(HISTORY_FILE,
+                  batch_size=HISTORY_BATCH_SIZE,
+                  flush_interval=HISTORY_FLUSH_INTERVAL)
+attachments = AttachmentStore(FILES_DIR,
+                              max_bytes=FILES_MAX_BYTES,
+                              on_download=history.attach,
+                              thumbnail_size=THUMBNAIL_SIZE,
+                              max_age=FILES_MAX_AGE,
+                              min_age=FILES_MIN_AGE,
+                              downloader=Downloader(
+                                  DOWNLOAD_WORKERS,
+                                  chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                  retries=DOWNLOAD_RETRIES,
+                                  backoff=DOWNLOAD_BACKOFF,
+                                  timeout=DOWNLOAD_TIMEOUT))
+contacts = ContactIndex()
+dedup = Deduplicator(DEDUP_WINDOW, DEDUP_FILE)
+policy = DownloadPolicy(DOWNLOAD_MAX_SIZES, DOWNLOAD_CHAT_RULES)
+rules = RuleSet.load(RULES_FILE)
+recent = RecentChats(RECENT_CHATS_FILE, size=RECENT_CHATS_SIZE)
+media = MediaCache(lambda file: bot.upload_file(file), ttl=MEDIA_ID_TTL)
+lists = SavedLists(BROADCAST_LISTS_FILE)
+autoreplies = AutoReplier.load(
+    AUTOREPLY_FILE,
+    send=lambda puid, text: outbox.submit(SendJob(puid, 'text', text)),
+    cooldown=AUTOREPLY_COOLDOWN,
+    rate=AUTOREPLY_RATE,
+    burst=AUTOREPLY_BURST)
+api: Union[ApiServer, None] = None
+api_jobs: 'OrderedDict[str, str]' = OrderedDict()
 
 
+def api_chats(keyword: str, limit: int = 10) -> List[dict]:
+    """Find chats for the local API.
+
+    Args:
+        keyword (str): A puid, name, remark name, nickname or pinyin.
+        limit (int, optional): Maximum number of chats. Defaults to 10.
+
+    Returns:
+        List[dict]: The puid and name of each chat found.
+    """
+    return [{
+        'puid': chat.puid,
+        'name': chat.name
+    } for chat in contacts.search(keyword, limit, fuzzy=True)]
+
+
+def api_done(job: SendJob, error: Union[Exception, None]) -> None:
+    """Record the outcome of a job sent through the local API.
+
+    Args:
+        job (SendJob): The job.
+        error (Union[Exception, None]): The last error, or None if the job
+            was sent.
+    """
+    api_jobs[job.id] = 'sent' if error is None else f'failed: {error}'
+
+
+def api_messages(chat: Union[str, None] = None,
+                 text: Union[str, None] = None,
+                 limit: int = 20) -> List[dict]:
+    """Get the last messages received in a chat, or search the messages
+    received for the local API.
+
+    Args:
+        chat (Union[str, None], optional): The puid or name of the chat.
+            Defaults to None, searching every chat.
+        text (Union[str, None], optional): The text to search. Defaults to
+            None, giving the last messages of the chat.
+        limit (int, optional): Maximum number of messages. Defaults to 20.
+
+    Returns:
+        List[dict]: The messages.
+    """
+    puid = None
+    if chat is not None:
+        found = get_chat(chat)
+        if found is None:
+            raise ValueError(f'No single chat matches {chat}')
+        puid = found.puid
+    if text:
+        return history.search(text, puid, limit)
+    if puid is None:
+        raise ValueError('Give a chat or a text to search')
+    return history.last(puid, limit)
+
+
+def api_pin(file: str, pinned: bool = True) -> dict:
+    """Keep a downloaded file for the local API, however old it is and
+    however full the download folder is, or stop keeping it.
+
+    Args:
+        file (str): The path of the file, as given by 'messages'.
+        pinned (bool, optional): Whether to keep the file. Defaults to True.
+
+    Returns:
+        dict: The absolute path of the file and whether it is kept.
+    """
+    if pinned and not os.path.isfile(file):
+        raise ValueError(f'File not found: {file}')
+    attachments.pin(file, pinned)
+    return {'file': os.path.abspath(file), 'pinned': pinned}
+
+
+def api_send(chat: str, payload: str, kind: str = 'text') -> dict:
+    """Queue something to send for the local API.
+
+    Args:
+        chat (str): The puid or name of the chat.
+        payload (str): The text, or the path of the file.
+        kind (str, optional): 'text', 'image', 'file' or 'video'. Defaults
+            to 'text'.
+
+    Returns:
+        dict: The id of the job, to ask its status, and the puid and name of
+        the chat.
+    """
+    found = get_chat(chat)
+    if found is None:
+        raise ValueError(f'No single chat matches {chat}')
+    if kind != 'text' and not os.path.isfile(payload):
+        raise ValueError(f'File not found: {payload}')
+    contacts.update(found)
+    job = SendJob(found.puid, kind, payload)
+    api_jobs[job.id] = 'queued'
+    while len(api_jobs) > API_JOBS_KEPT:
+        api_jobs.popitem(last=False)
+    outbox.submit(job, callback=api_done)
+    return {'job': job.id, 'chat': found.puid, 'name': found.name}
+
+
+def api_status(job: str) -> str:
+    """Get the status of a job queued through the local API.
+
+    Args:
+        job (str): The id of the job.
+
+    Returns:
+        str: 'queued', 'sent' or 'failed: ' followed by the error.
+    """
+    status = api_jobs.get(job)
+    if status is None:
+        raise ValueError(f'Unknown job: {job}')
+    return status
+
+
+def ask_chat(dialog: Dialog, text: str, input: str, buttons: list) -> dict:
+    """Ask for something to send with a toast notification, and for the chat
+    unless the dialog knows it already.
+
+    Args:
+        dialog (Dialog): The dialog.
+        text (str): What is sent, such as 'Send an image'.
+        input (str): The id of the text box of the content.
+        buttons (list): The buttons after the "Send" button.
+
+    Returns:
+        dict: The result of the notification. An empty dict if it is not a
+        dict, as for a dismissed notification.
+    """
+    buttons = [{
+        'activationType': 'protocol',
+        'arguments': 'http:',
+        'content': 'Send',
+        'hint-inputId': input
+    }] + buttons
+    if dialog.chat is not None:
+        res = toast(f'{text} to {dialog.chat.name}:',
+                    input=input,
+                    buttons=buttons)
+        return res if isinstance(res, dict) else {}
+    if not len(recent):
+        res = toast(f'{text}:',
+                    inputs=['Nickname, remark, etc.', input],
+                    buttons=buttons)
+    else:
+        res = toast(
+            f'{text}. You can leave the nickname field blank by selecting a cached chat below.',
+            inputs=['Nickname, remark, etc.', input],
+            selection=get_cache(),
+            buttons=buttons)
+    if not isinstance(res, dict):
+        return {}
+    user_input = res.get('user_input') or {}
+    dialog.chat = get_chat(user_input.get('Nickname, remark, etc.'))
+    if dialog.chat is None and user_input.get('selection'):
+        dialog.chat = get_cached_chat(user_input['selection'])
+    return res
+
+
+def ask_reply(dialog: Dialog, input: str, buttons: list,
+              file_buttons: list) -> Union[dict, None]:
+    """Show the message being replied with a toast notification.
+
+    Args:
+        dialog (Dialog): The dialog.
+        input (str): The id of the text box of the reply.
+        buttons (list): The buttons after the "Reply" button.
+        file_buttons (list): The buttons after the "Open file" button, used
+            instead of `buttons` for a message carrying a file.
+
+    Returns:
+        Union[dict, None]: The result of the notification. None if the type
+        of the message is not supported.
+    """
+    msg = dialog.msg
+    sender = msg.member.name if msg.member is not None else msg.sender.name
+    reply = {
+        'activationType': 'protocol',
+        'arguments': 'http:',
+        'content': 'Reply',
+        'hint-inputId': input
+    }
+    if msg.type == wxpy.TEXT:
+        return toast(f'{msg.chat.name}({sender}): {msg.text}',
+                     input=input,
+                     buttons=[reply] + buttons)
+    elif msg.type == wxpy.PICTURE and policy.prefetch(msg):
+        return toast(f'{msg.chat.name}({sender}):',
+                     image=get_preview(dialog),
+                     input=input,
+                     buttons=[reply] + buttons)
+    elif msg.type in [
+            wxpy.PICTURE, wxpy.RECORDING, wxpy.ATTACHMENT, wxpy.VIDEO
+    ]:
+        return toast(
+            f'{msg.chat.name}({sender}) sends you a file:\n{msg.file_name}',
+            input=input,
+            buttons=[reply, get_open_button(dialog)] + file_buttons)
+    return None
+
+
+def broadcast(chats: List[wxpy.Chat],
+              kind: str,
+              payload: str,
+              missing: Union[List[str], None] = None) -> None:
+    """Queue the same thing to many chats and report the outcome in a single
+    notification once every send is finished. A file is uploaded only once,
+    as the media cache shares the upload between the jobs.
+
+    Args:
+        chats (List[wxpy.Chat]): The chat objects.
+        kind (str): 'text', 'image', 'file' or 'video'.
+        payload (str): The text, or the path of the file.
+        missing (Union[List[str], None], optional): Names that matched no
+            chat. Defaults to None.
+    """
+    if kind != 'text' and not os.path.isfile(payload):
+        notify(f'Cannot broadcast {payload}: file not found.')
+        return
+    jobs = []
+    for chat in chats:
+        contacts.update(chat)
+        jobs.append(SendJob(chat.puid, kind, payload))
+
+    def name(puid: str) -> str:
+        chat = contacts.get(puid)
+        return chat.name if chat is not None else puid
+
+    tracker = Broadcast(jobs,
+                        on_finished=lambda b: notify(b.summary(name)),
+                        missing=missing)
+    for job in jobs:
+        outbox.submit(job, callback=tracker.done)
+
+
+def compact_files() -> None:
+    """Account for the files of the download folder, then clean it up
+    periodically.
+    """
+    try:
+        attachments.scan()
+    except Exception:
+        metrics.error('compact_files')
+    while True:
+        time.sleep(FILES_COMPACT_INTERVAL)
+        try:
+            with metrics.span('compact_files'):
+                removed = attachments.compact()
+            for kind, count in removed.items():
+                metrics.inc('files_removed_total', count, kind=kind)
+        except Exception:
+            metrics.error('compact_files')
+
+
+@metrics.timed('confirm_img')
 def confirm_img(chat: wxpy.Chat, file: str) -> None:
     """Confirm the image with a toast notification.
 
@@ -39,13 +344,13 @@ def confirm_img(chat: wxpy.Chat, file: str) -> None:
                 image=file,
                 buttons=['Yes', 'No'])
     try:
-        if res['arguments'] == 'http:Yes':
-            chat.send_image(file)
-            update_cache(chat)
+        if res.get('arguments') == 'http:Yes':
+            queue_send(chat, 'image', file)
     except Exception:
-        pass
+        metrics.error('confirm_img')
 
 
+@metrics.timed('confirm_file')
 def confirm_file(chat: wxpy.Chat, file: str) -> None:
     """Confirm the file with a toast notification.
 
@@ -56,13 +361,13 @@ def confirm_file(chat: wxpy.Chat, file: str) -> None:
     res = toast(f'Sending the following file to {chat.name}:\n' + file,
                 buttons=['Yes', 'No'])
     try:
-        if res['arguments'] == 'http:Yes':
-            chat.send_file(file)
-            update_cache(chat)
+        if res.get('arguments') == 'http:Yes':
+            queue_send(chat, 'file', file)
     except Exception:
-        pass
+        metrics.error('confirm_file')
 
 
+@metrics.timed('confirm_video')
 def confirm_video(chat: wxpy.Chat, file: str) -> None:
     """Confirm the video with a toast notification.
 
@@ -73,24 +378,38 @@ def confirm_video(chat: wxpy.Chat, file: str) -> None:
     res = toast(f'Sending the following video to {chat.name}:\n' + file,
                 buttons=['Yes', 'No'])
     try:
-        if res['arguments'] == 'http:Yes':
-            chat.send_video(file)
-            update_cache(chat)
+        if res.get('arguments') == 'http:Yes':
+            queue_send(chat, 'video', file)
     except Exception:
-        pass
+        metrics.error('confirm_video')
 
 
 def get_cache() -> List[str]:
-    """Get a list of chat names from cached chats.
+    """Get a list of chat names from cached chats, best ranked first.
 
     Returns:
         List[str]: The list of chats.
     """
-    return [chat.name for chat in cache]
+    return recent.names()
+
+
+def get_cached_chat(name: str) -> Union[wxpy.Chat, None]:
+    """Get the chat object of a cached chat by its name.
+
+    Args:
+        name (str): The name selected from the cached chats.
+
+    Returns:
+        wxpy.Chat: The chat object.
+    """
+    puid = recent.puid(name)
+    chat = contacts.get(puid) if puid is not None else None
+    return chat if chat is not None else get_chat(name)
 
 
 def get_chat(keyword: str) -> Union[wxpy.Chat, None]:
-    """Get the chat object by the keyword.
+    """Get the chat object by the keyword: a puid, an exact name or a
+    unique name prefix, or else the single chat `bot.search` finds.
 
     Args:
         keyword (str): The keyword to search.
@@ -98,482 +417,670 @@ def get_chat(keyword: str) -> Union[wxpy.Chat, None]:
     Returns:
         wxpy.Chat: The chat object.
     """
-    chat = bot.search(keyword)
+    if not keyword:
+        return None
+    with metrics.span('contact_search'):
+        chats = contacts.search(keyword)
+    if not chats and bot is not None:
+        with metrics.span('bot_search'):
+            chats = bot.search(keyword)
+        for chat in chats:
+            contacts.update(chat)
     try:
-        chat = wxpy.ensure_one(chat)
+        chat = wxpy.ensure_one(chats)
         return chat
     except ValueError:
         return None
 
 
-def reply_file(msg: wxpy.Message) -> None:
+def get_attachment(dialog: Dialog) -> str:
+    """Get the local path of the attachment of the message being replied,
+    downloading it the first time.
+
+    Args:
+        dialog (Dialog): The dialog.
+
+    Returns:
+        str: The path of the attachment.
+    """
+    if dialog.file is None:
+        dialog.file = attachments.get(dialog.msg)
+    return dialog.file
+
+
+def get_open_button(dialog: Dialog) -> dict:
+    """Get the "Open file" button of a message carrying a file. The file is
+    downloaded now if the download policy prefetches it.
+
+    Args:
+        dialog (Dialog): The dialog replying the message carrying the file.
+
+    Returns:
+        dict: The button of the toast notification.
+    """
+    if policy.prefetch(dialog.msg):
+        arguments = get_attachment(dialog)
+    else:
+        arguments = 'http:Open file'
+    return {
+        'activationType': 'protocol',
+        'arguments': arguments,
+        'content': 'Open file'
+    }
+
+
+def get_preview(dialog: Dialog) -> str:
+    """Get the preview of the image being replied, making it the first time.
+
+    Args:
+        dialog (Dialog): The dialog.
+
+    Returns:
+        str: The path of the preview.
+    """
+    if dialog.preview is None:
+        dialog.preview = attachments.thumbnail(dialog.msg)
+    return dialog.preview
+
+
+def handle_msgs(msgs: List[wxpy.Message]) -> None:
+    """Handle inbound messages from one chat on a dispatcher worker.
+
+    Args:
+        msgs (List[wxpy.Message]): The messages received. Several messages
+            are shown as a digest.
+    """
+    msg = msgs[-1]
+    contacts.update(msg.chat)
+    if len(msgs) > 1:
+        run_dialog('reply_digest', msg=msg, msgs=msgs)
+    else:
+        run_dialog('reply_msg', msg=msg)
+    update_cache(msg.chat)
+
+
+def login() -> wxpy.Bot:
+    """Log in and start receiving messages. They are taken in order on the
+    thread receiving them, which hands them over to the dispatcher, so that
+    the messages of a chat keep their order. The contact index is restored
+    from the last snapshot while logging in.
+
+    Returns:
+        wxpy.Bot: The bot of the account.
+    """
+    global bot
+    restore = threading.Thread(target=contacts.restore,
+                               args=(CONTACTS_SNAPSHOT_FILE, ),
+                               daemon=True)
+    restore.start()
+    bot = wxpy.Bot(cache_path=True)
+    bot.register(except_self=False, run_async=False)(get_msg)
+    restore.join()
+    return bot
+
+
+def open_file(msg: wxpy.Message) -> None:
+    """Download the file of a message in the background with a progress
+    notification, then open it.
+
+    Args:
+        msg (wxpy.Message): The message carrying the file.
+    """
+
+    def download() -> None:
+        notify_progress(f'Downloading {msg.file_name}')
+        try:
+            file = attachments.get(msg)
+        except Exception:
+            metrics.error('open_file')
+            update_progress(0, 'Download failed')
+            return
+        update_progress(1, 'Done')
+        os.startfile(file)
+
+    threading.Thread(target=download, daemon=True).start()
+
+
+def queue_send(chat: wxpy.Chat, kind: str, payload: str) -> None:
+    """Queue something to send to a chat without waiting for it.
+
+    Args:
+        chat (wxpy.Chat): The chat object.
+        kind (str): 'text', 'image', 'file' or 'video'.
+        payload (str): The text, or the path of the file.
+    """
+    if kind != 'text' and not os.path.isfile(payload):
+        notify(f'Cannot send {payload} to {chat.name}: file not found.')
+        return
+    contacts.update(chat)
+    outbox.submit(SendJob(chat.puid, kind, payload))
+
+
+def refresh_contacts() -> None:
+    """Rebuild the contact index from the contact list now and periodically,
+    and save a snapshot of it for the next startup.
+    """
+    update = False
+    while True:
+        try:
+            contacts.build(bot.chats(update=update))
+            contacts.save(CONTACTS_SNAPSHOT_FILE)
+        except Exception:
+            metrics.error('refresh_contacts')
+        update = True
+        time.sleep(CONTACTS_REFRESH_INTERVAL)
+
+
+def resolve_chat(puid: str) -> wxpy.Chat:
+    """Get the chat object by its puid.
+
+    Args:
+        puid (str): The puid of the chat.
+
+    Returns:
+        wxpy.Chat: The chat object.
+    """
+    chat = contacts.get(puid)
+    if chat is None or isinstance(chat, SavedChat):
+        chat = wxpy.ensure_one(bot.search(puid=puid))
+        contacts.update(chat)
+    return chat
+
+
+@metrics.timed('reply_digest')
+def reply_digest(dialog: Dialog) -> Union[str, None]:
+    """Reply a burst of text messages with a single toast notification.
+
+    Args:
+        dialog (Dialog): The dialog replying the messages, from one chat.
+
+    Returns:
+        Union[str, None]: The next step.
+    """
+    msg = dialog.msg
+    lines = [
+        f'{item.member.name if item.member is not None else item.sender.name}: {item.text}'
+        for item in dialog.msgs[-DIGEST_MAX_LINES:]
+    ]
+    display = f'{msg.chat.name} ({len(dialog.msgs)} new messages):\n' + '\n'.join(lines)
+    res = toast(display,
+                input='Enter the message here...',
+                buttons=[{
+                    'activationType': 'protocol',
+                    'arguments': 'http:',
+                    'content': 'Reply',
+                    'hint-inputId': 'Enter the message here...'
+                }, 'Send image', 'Send file', 'Send video'])
+    try:
+        if res.get('arguments') == 'http:':
+            queue_send(dialog.chat, 'text',
+                       res['user_input']['Enter the message here...'])
+        elif res.get('arguments') == 'http:Send image':
+            return 'reply_img'
+        elif res.get('arguments') == 'http:Send file':
+            return 'reply_file'
+        elif res.get('arguments') == 'http:Send video':
+            return 'reply_video'
+    except Exception:
+        metrics.error('reply_digest')
+    return None
+
+
+@metrics.timed('reply_file')
+def reply_file(dialog: Dialog) -> Union[str, None]:
     """Reply the file with a toast notification.
 
     Args:
-        msg (wxpy.Message): The message to be replied.
+        dialog (Dialog): The dialog replying a message.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if msg.type == wxpy.TEXT:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}): {msg.text}'
-        res = toast(display,
-                    input='Enter the path of the file...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the file...'
-                    }, 'Send the file from the clipboard', 'Back'])
-    elif msg.type == wxpy.PICTURE:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}):'
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        res = toast(display,
-                    image=file,
-                    input='Enter the path of the file...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the file...'
-                    }, 'Send the file from the clipboard', 'Back'])
-    elif msg.type in [wxpy.RECORDING, wxpy.ATTACHMENT, wxpy.VIDEO]:
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}) sends you a file:\n{msg.file_name}'
-        res = toast(display,
-                    input='Enter the path of the file...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the file...'
-                    }, {
-                        'activationType': 'protocol',
-                        'arguments': file,
-                        'content': 'Open file'
-                    }, {
+    res = ask_reply(dialog, 'Enter the path of the file...',
+                    ['Send the file from the clipboard', 'Back'], [{
                         'activationType': 'protocol',
                         'arguments': 'http:Send the file from the clipboard',
                         'content': 'From clipboard'
                     }, 'Back'])
     try:
-        if res['arguments'] == 'http:':
-            confirm_file(msg.chat,
+        if res.get('arguments') == 'http:':
+            confirm_file(dialog.chat,
                          res['user_input']['Enter the path of the file...'])
-        elif res['arguments'] == 'http:Send the file from the clipboard':
+        elif res.get('arguments') == 'http:Open file':
+            open_file(dialog.msg)
+        elif res.get('arguments') == 'http:Send the file from the clipboard':
             file = get_file_from_clipboard()
-            if file is not None:
-                confirm_file(msg.chat, file)
-            else:
-                confirm_file(msg.chat, pyperclip.paste())
-        elif res['arguments'] == 'http:Back':
-            reply_msg(msg)
+            confirm_file(dialog.chat, file or get_text_from_clipboard())
+        elif res.get('arguments') == 'http:Back':
+            return 'reply_digest' if len(dialog.msgs) > 1 else 'reply_msg'
     except Exception:
-        pass
+        metrics.error('reply_file')
+    return None
 
 
-def reply_img(msg: wxpy.Message) -> None:
+@metrics.timed('reply_img')
+def reply_img(dialog: Dialog) -> Union[str, None]:
     """Reply the image with a toast notification.
 
     Args:
-        msg (wxpy.Message): The message to be replied.
+        dialog (Dialog): The dialog replying a message.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if msg.type == wxpy.TEXT:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}): {msg.text}'
-        res = toast(display,
-                    input='Enter the path of the image...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the image...'
-                    }, 'Send the image from the clipboard', 'Back'])
-    elif msg.type == wxpy.PICTURE:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}):'
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        res = toast(display,
-                    image=file,
-                    input='Enter the path of the image...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the image...'
-                    }, 'Send the image from the clipboard', 'Back'])
-    elif msg.type in [wxpy.RECORDING, wxpy.ATTACHMENT, wxpy.VIDEO]:
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}) sends you a file:\n{msg.file_name}'
-        res = toast(display,
-                    input='Enter the path of the image...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the image...'
-                    }, {
-                        'activationType': 'protocol',
-                        'arguments': file,
-                        'content': 'Open file'
-                    }, {
+    res = ask_reply(dialog, 'Enter the path of the image...',
+                    ['Send the image from the clipboard', 'Back'], [{
                         'activationType': 'protocol',
                         'arguments': 'http:Send the image from the clipboard',
                         'content': 'From clipboard'
                     }, 'Back'])
     try:
-        if res['arguments'] == 'http:':
-            confirm_img(msg.chat,
+        if res.get('arguments') == 'http:':
+            confirm_img(dialog.chat,
                         res['user_input']['Enter the path of the image...'])
-        elif res['arguments'] == 'http:Send the image from the clipboard':
-            file = get_img_from_clipboard()
-            if file is not None:
-                confirm_img(msg.chat, file)
-                return
-            file = get_file_from_clipboard()
-            if file is not None:
-                confirm_img(msg.chat, file)
-            else:
-                confirm_img(msg.chat, pyperclip.paste())
-        elif res['arguments'] == 'http:Back':
-            reply_msg(msg)
+        elif res.get('arguments') == 'http:Open file':
+            open_file(dialog.msg)
+        elif res.get('arguments') == 'http:Send the image from the clipboard':
+            file = get_img_from_clipboard() or get_file_from_clipboard()
+            confirm_img(dialog.chat, file or get_text_from_clipboard())
+        elif res.get('arguments') == 'http:Back':
+            return 'reply_digest' if len(dialog.msgs) > 1 else 'reply_msg'
     except Exception:
-        pass
+        metrics.error('reply_img')
+    return None
 
 
-def reply_msg(msg: wxpy.Message) -> None:
+@metrics.timed('reply_msg')
+def reply_msg(dialog: Dialog) -> Union[str, None]:
     """Reply the message with a toast notification.
 
     Args:
-        msg (wxpy.Message): The message to be replied.
+        dialog (Dialog): The dialog replying a message.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if msg.type == wxpy.TEXT:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}): {msg.text}'
-        res = toast(display,
-                    input='Enter the message here...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the message here...'
-                    }, 'Send image', 'Send file', 'Send video'])
-    elif msg.type == wxpy.PICTURE:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}):'
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        res = toast(display,
-                    image=file,
-                    input='Enter the message here...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the message here...'
-                    }, 'Send image', 'Send file', 'Send video'])
-    elif msg.type in [wxpy.RECORDING, wxpy.ATTACHMENT, wxpy.VIDEO]:
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}) sends you a file:\n{msg.file_name}'
-        res = toast(display,
-                    input='Enter the message here...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the message here...'
-                    }, {
-                        'activationType': 'protocol',
-                        'arguments': file,
-                        'content': 'Open file'
-                    }, 'Send image', 'Send file'])
-    else:
+    res = ask_reply(dialog, 'Enter the message here...',
+                    ['Send image', 'Send file', 'Send video'],
+                    ['Send image', 'Send file'])
+    if res is None:
+        msg = dialog.msg
         display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}) sends you a message that is currently not supported.'
         toast(display)
-        return
+        return None
     try:
-        if res['arguments'] == 'http:':
-            msg.reply(res['user_input']['Enter the message here...'])
-        elif res['arguments'] == 'http:Send image':
-            reply_img(msg)
-        elif res['arguments'] == 'http:Send file':
-            reply_file(msg)
-        elif res['arguments'] == 'http:Send video':
-            reply_video(msg)
+        if res.get('arguments') == 'http:':
+            queue_send(dialog.chat, 'text',
+                       res['user_input']['Enter the message here...'])
+        elif res.get('arguments') == 'http:Open file':
+            open_file(dialog.msg)
+        elif res.get('arguments') == 'http:Send image':
+            return 'reply_img'
+        elif res.get('arguments') == 'http:Send file':
+            return 'reply_file'
+        elif res.get('arguments') == 'http:Send video':
+            return 'reply_video'
     except Exception:
-        pass
+        metrics.error('reply_msg')
+    return None
 
 
-def reply_video(msg: wxpy.Message) -> None:
+@metrics.timed('reply_video')
+def reply_video(dialog: Dialog) -> Union[str, None]:
     """Reply the video with a toast notification.
 
     Args:
-        msg (wxpy.Message): The message to be replied.
+        dialog (Dialog): The dialog replying a message.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if msg.type == wxpy.TEXT:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}): {msg.text}'
-        res = toast(display,
-                    input='Enter the path of the video...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the video...'
-                    }, 'Send the video from the clipboard', 'Back'])
-    elif msg.type == wxpy.PICTURE:
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}):'
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        res = toast(display,
-                    image=file,
-                    input='Enter the path of the video...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the video...'
-                    }, 'Send the video from the clipboard', 'Back'])
-    elif msg.type in [wxpy.RECORDING, wxpy.ATTACHMENT, wxpy.VIDEO]:
-        file = os.path.abspath(os.path.join('Files', msg.file_name))
-        msg.get_file(file)
-        display = f'{msg.chat.name}({msg.member.name if msg.member is not None else msg.sender.name}) sends you a file:\n{msg.file_name}'
-        res = toast(display,
-                    input='Enter the path of the video...',
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Reply',
-                        'hint-inputId': 'Enter the path of the video...'
-                    }, {
-                        'activationType': 'protocol',
-                        'arguments': file,
-                        'content': 'Open file'
-                    }, {
+    res = ask_reply(dialog, 'Enter the path of the video...',
+                    ['Send the video from the clipboard', 'Back'], [{
                         'activationType': 'protocol',
                         'arguments': 'http:Send the video from the clipboard',
                         'content': 'From clipboard'
                     }, 'Back'])
     try:
-        if res['arguments'] == 'http:':
-            confirm_video(msg.chat,
+        if res.get('arguments') == 'http:':
+            confirm_video(dialog.chat,
                           res['user_input']['Enter the path of the video...'])
-        elif res['arguments'] == 'http:Send the video from the clipboard':
+        elif res.get('arguments') == 'http:Open file':
+            open_file(dialog.msg)
+        elif res.get('arguments') == 'http:Send the video from the clipboard':
             file = get_file_from_clipboard()
-            if file:
-                confirm_video(msg.chat, file)
-            else:
-                confirm_video(msg.chat, pyperclip.paste())
-        elif res['arguments'] == 'http:Back':
-            reply_msg(msg)
+            confirm_video(dialog.chat, file or get_text_from_clipboard())
+        elif res.get('arguments') == 'http:Back':
+            return 'reply_digest' if len(dialog.msgs) > 1 else 'reply_msg'
+    except Exception:
+        metrics.error('reply_video')
+    return None
+
+
+def run_dialog(step: str, **state) -> None:
+    """Start a dialog with the user and run it until it is over.
+
+    Args:
+        step (str): The name of the first step, one of `DIALOG_STEPS`.
+        **state: The initial state of the `Dialog`.
+    """
+    Dialog(DIALOG_STEPS, **state).run(step)
+
+
+@metrics.timed('send_broadcast')
+def send_broadcast(dialog: Dialog) -> Union[str, None]:
+    """Send the same message or file to many chats.
+
+    Args:
+        dialog (Dialog): The dialog.
+
+    Returns:
+        Union[str, None]: The next step.
+    """
+    kwargs = {}
+    if lists.names():
+        kwargs['selection'] = lists.names()
+    res = toast(
+        'Broadcast to the chats listed, or to a saved list selected below. Name the chats to save them as a list.',
+        inputs=[
+            'Chats, separated by commas',
+            'Enter the message or the path of the file...',
+            'Save these chats as...'
+        ],
+        buttons=['Send text', 'Send image', 'Send file', 'Send video', 'Back'],
+        **kwargs)
+    try:
+        button = res.get('arguments') or ''
+        if button == 'http:Back':
+            return 'send_msg'
+        kind = button[len('http:Send '):]
+        if kind not in ('text', 'image', 'file', 'video'):
+            return None
+        user_input = res['user_input']
+        names = [
+            name.strip() for name in re.split('[,，]', user_input[
+                'Chats, separated by commas']) if name.strip()
+        ]
+        chats, missing = [], []
+        if names:
+            for name in names:
+                chat = get_chat(name)
+                if chat is None:
+                    missing.append(name)
+                else:
+                    chats.append(chat)
+        elif user_input.get('selection'):
+            for puid in lists.get(user_input['selection']):
+                try:
+                    chats.append(resolve_chat(puid))
+                except ValueError:
+                    missing.append(puid)
+        if names and user_input.get('Save these chats as...'):
+            lists.save(user_input['Save these chats as...'],
+                       [chat.puid for chat in chats])
+        broadcast(chats, kind,
+                  user_input['Enter the message or the path of the file...'],
+                  missing)
     except Exception:
-        pass
+        metrics.error('send_broadcast')
+    return None
+
+
+def send_done(job: SendJob) -> None:
+    """Record the chat of a sent job in the recent chats cache.
+
+    Args:
+        job (SendJob): The job sent.
+    """
+    update_cache(resolve_chat(job.chat))
+
+
+def send_failed(job: SendJob, e: Exception) -> None:
+    """Tell the user that a job could not be sent.
 
+    Args:
+        job (SendJob): The job that failed.
+        e (Exception): The last error.
+    """
+    chat = contacts.get(job.chat)
+    name = chat.name if chat is not None else job.chat
+    notify(f'Failed to send the {job.kind} to {name}: {e}')
 
-def send_file() -> None:
+
+@metrics.timed('send_file')
+def send_file(dialog: Dialog) -> Union[str, None]:
     """Send a file to a specific user.
+
+    Args:
+        dialog (Dialog): The dialog.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if not len(cache):
-        res = toast(
-            'Send a file:',
-            inputs=['Nickname, remark, etc.', 'Enter the path of the file...'],
-            buttons=[{
-                'activationType': 'protocol',
-                'arguments': 'http:',
-                'content': 'Send',
-                'hint-inputId': 'Enter the path of the file...'
-            }, 'Send the file from the clipboard', 'Back'])
-    else:
-        res = toast(
-            'Send a file. You can leave the nickname field blank by selecting a cached chat below.',
-            inputs=['Nickname, remark, etc.', 'Enter the path of the file...'],
-            selection=get_cache(),
-            buttons=[{
-                'activationType': 'protocol',
-                'arguments': 'http:',
-                'content': 'Send',
-                'hint-inputId': 'Enter the path of the file...'
-            }, 'Send the file from the clipboard', 'Back'])
+    res = ask_chat(dialog, 'Send a file', 'Enter the path of the file...',
+                   ['Send the file from the clipboard', 'Back'])
     try:
-        chat = get_chat(res['user_input']['Nickname, remark, etc.'])
-        if chat is None:
-            chat = get_chat(res['user_input']['selection'])
-        if res['arguments'] == 'http:':
-            confirm_file(chat,
+        if res.get('arguments') == 'http:':
+            confirm_file(dialog.chat,
                          res['user_input']['Enter the path of the file...'])
-        elif res['arguments'] == 'http:Send the file from the clipboard':
+        elif res.get('arguments') == 'http:Send the file from the clipboard':
             file = get_file_from_clipboard()
-            if file is not None:
-                confirm_file(chat, file)
-            else:
-                confirm_file(chat, pyperclip.paste())
+            confirm_file(dialog.chat, file or get_text_from_clipboard())
         else:
-            send_msg()
+            dialog.chat = None
+            return 'send_msg'
     except Exception:
-        pass
+        metrics.error('send_file')
+    return None
 
 
-def send_img() -> None:
+@metrics.timed('send_img')
+def send_img(dialog: Dialog) -> Union[str, None]:
     """Send an image to a specific user.
+
+    Args:
+        dialog (Dialog): The dialog.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if not len(cache):
-        res = toast('Send an image:',
-                    inputs=[
-                        'Nickname, remark, etc.',
-                        'Enter the path of the image...'
-                    ],
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Send',
-                        'hint-inputId': 'Enter the path of the image...'
-                    }, 'Send the image from the clipboard', 'Back'])
-    else:
-        res = toast(
-            'Send an image. You can leave the nickname field blank by selecting a cached chat below.',
-            inputs=[
-                'Nickname, remark, etc.', 'Enter the path of the image...'
-            ],
-            selection=get_cache(),
-            buttons=[{
-                'activationType': 'protocol',
-                'arguments': 'http:',
-                'content': 'Send',
-                'hint-inputId': 'Enter the path of the image...'
-            }, 'Send the image from the clipboard', 'Back'])
+    res = ask_chat(dialog, 'Send an image', 'Enter the path of the image...',
+                   ['Send the image from the clipboard', 'Back'])
     try:
-        chat = get_chat(res['user_input']['Nickname, remark, etc.'])
-        if chat is None:
-            chat = get_chat(res['user_input']['selection'])
-        if res['arguments'] == 'http:':
-            confirm_img(chat,
+        if res.get('arguments') == 'http:':
+            confirm_img(dialog.chat,
                         res['user_input']['Enter the path of the image...'])
-        elif res['arguments'] == 'http:Send the image from the clipboard':
-            file = get_img_from_clipboard()
-            if file is not None:
-                confirm_img(chat, file)
-                return
-            file = get_file_from_clipboard()
-            if file is not None:
-                confirm_img(chat, file)
-            else:
-                confirm_img(chat, pyperclip.paste())
+        elif res.get('arguments') == 'http:Send the image from the clipboard':
+            file = get_img_from_clipboard() or get_file_from_clipboard()
+            confirm_img(dialog.chat, file or get_text_from_clipboard())
         else:
-            send_msg()
+            dialog.chat = None
+            return 'send_msg'
     except Exception:
-        pass
+        metrics.error('send_img')
+    return None
 
 
-def send_msg() -> None:
+@metrics.timed('send_msg')
+def send_msg(dialog: Dialog) -> Union[str, None]:
     """Send a message to a specific user.
+
+    Args:
+        dialog (Dialog): The dialog.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if not len(cache):
-        res = toast(
-            'Send a message:',
-            inputs=['Nickname, remark, etc.', 'Enter the message here...'],
-            buttons=[{
-                'activationType': 'protocol',
-                'arguments': 'http:',
-                'content': 'Send',
-                'hint-inputId': 'Enter the message here...'
-            }, 'Send image', 'Send file', 'Send video'])
-    else:
-        res = toast(
-            'Send a message. You can leave the nickname field blank by selecting a cached chat below.',
-            inputs=['Nickname, remark, etc.', 'Enter the message here...'],
-            selection=get_cache(),
-            buttons=[{
-                'activationType': 'protocol',
-                'arguments': 'http:',
-                'content': 'Send',
-                'hint-inputId': 'Enter the message here...'
-            }, 'Send image', 'Send file', 'Send video'])
+    res = ask_chat(dialog, 'Send a message', 'Enter the message here...',
+                   ['Send image', 'Send file', 'Send video', 'Broadcast'])
     try:
-        if res['arguments'] == 'http:':
-            chat = get_chat(res['user_input']['Nickname, remark, etc.'])
-            if chat is None:
-                chat = get_chat(res['user_input']['selection'])
-            chat.send(res['user_input']['Enter the message here...'])
-            update_cache(chat)
-        elif res['arguments'] == 'http:Send image':
-            send_img()
-        elif res['arguments'] == 'http:Send file':
-            send_file()
-        elif res['arguments'] == 'http:Send video':
-            send_video()
+        if res.get('arguments') == 'http:':
+            queue_send(dialog.chat, 'text',
+                       res['user_input']['Enter the message here...'])
+        elif res.get('arguments') == 'http:Send image':
+            return 'send_img'
+        elif res.get('arguments') == 'http:Send file':
+            return 'send_file'
+        elif res.get('arguments') == 'http:Send video':
+            return 'send_video'
+        elif res.get('arguments') == 'http:Broadcast':
+            return 'send_broadcast'
     except Exception:
-        pass
+        metrics.error('send_msg')
+    return None
 
 
-def send_video() -> None:
+def send_job(job: SendJob) -> None:
+    """Send a queued job. Called on a send queue worker.
+
+    Args:
+        job (SendJob): The job to send.
+    """
+    chat = resolve_chat(job.chat)
+    if job.kind == 'text':
+        chat.send(job.payload)
+    elif job.kind == 'image':
+        media.send(chat.send_image, job.payload)
+    elif job.kind == 'file':
+        media.send(chat.send_file, job.payload)
+    elif job.kind == 'video':
+        media.send(chat.send_video, job.payload)
+
+
+@metrics.timed('send_video')
+def send_video(dialog: Dialog) -> Union[str, None]:
     """Send a video to a specific user.
+
+    Args:
+        dialog (Dialog): The dialog.
+
+    Returns:
+        Union[str, None]: The next step.
     """
-    if not len(cache):
-        res = toast('Send a video:',
-                    inputs=[
-                        'Nickname, remark, etc.',
-                        'Enter the path of the video...'
-                    ],
-                    buttons=[{
-                        'activationType': 'protocol',
-                        'arguments': 'http:',
-                        'content': 'Send',
-                        'hint-inputId': 'Enter the path of the video...'
-                    }, 'Send the video from the clipboard', 'Back'])
-    else:
-        res = toast(
-            'Send a video. You can leave the nickname field blank by selecting a cached chat below.',
-            inputs=[
-                'Nickname, remark, etc.', 'Enter the path of the video...'
-            ],
-            selection=get_cache(),
-            buttons=[{
-                'activationType': 'protocol',
-                'arguments': 'http:',
-                'content': 'Send',
-                'hint-inputId': 'Enter the path of the video...'
-            }, 'Send the video from the clipboard', 'Back'])
+    res = ask_chat(dialog, 'Send a video', 'Enter the path of the video...',
+                   ['Send the video from the clipboard', 'Back'])
     try:
-        chat = get_chat(res['user_input']['Nickname, remark, etc.'])
-        if chat is None:
-            chat = get_chat(res['user_input']['selection'])
-        if res['arguments'] == 'http:':
-            confirm_video(chat,
+        if res.get('arguments') == 'http:':
+            confirm_video(dialog.chat,
                           res['user_input']['Enter the path of the video...'])
-        elif res['arguments'] == 'http:Send the video from the clipboard':
+        elif res.get('arguments') == 'http:Send the video from the clipboard':
             file = get_file_from_clipboard()
-            if file is not None:
-                confirm_video(chat, file)
-            else:
-                confirm_video(chat, pyperclip.paste())
+            confirm_video(dialog.chat, file or get_text_from_clipboard())
         else:
-            send_msg()
+            dialog.chat = None
+            return 'send_msg'
     except Exception:
-        pass
+        metrics.error('send_video')
+    return None
+
+
+def start() -> None:
+    """Start the background services once the bot has logged in. The
+    history is opened, and the contact index is rebuilt from the contact list
+    in the background.
+    """
+    global api
+    if METRICS_ENABLED:
+        metrics.enable()
+        metrics.gauge('queue_depth', dispatcher.depth)
+        metrics.gauge('send_queue_depth', outbox.depth)
+        metrics.gauge('dropped_messages', lambda: dispatcher.dropped)
+        metrics.gauge('files_bytes', lambda: attachments.usage)
+        if METRICS_PORT is not None:
+            metrics.serve(METRICS_PORT)
+        if METRICS_JSON_FILE is not None:
+            metrics.write_json(METRICS_JSON_FILE, METRICS_JSON_INTERVAL)
+    history.start()
+    bot.enable_puid()
+    threading.Thread(target=refresh_contacts, daemon=True).start()
+    threading.Thread(target=compact_files, daemon=True).start()
+    if API_PORT is not None:
+        api = ApiServer(
+            {
+                'chats': api_chats,
+                'files': attachments.report,
+                'messages': api_messages,
+                'pin': api_pin,
+                'send': api_send,
+                'status': api_status
+            },
+            API_PORT,
+            host=API_HOST,
+            token=API_TOKEN)
+        api.start()
+    atexit.register(recent.save)
+    atexit.register(history.stop)
+    outbox.start()
+    outbox.replay()
+    dispatcher.start()
+    coalescer.start()
 
 
 def update_cache(chat: wxpy.Chat) -> None:
-    """Put a new chat into the cache. LRU strategy is used.
+    """Record a use of the chat in the recent chats cache.
 
     Args:
-        chat (wxpy.Chat): The new chat to put into the cache.
+        chat (wxpy.Chat): The chat used.
     """
-    global cache
-    for i, item in enumerate(cache):
-        if chat.puid == item.puid:
-            cache.pop(i)
-            cache.append(chat)
-            return
-    if len(cache) >= 5:
-        cache.pop(0)
-    cache.append(chat)
+    recent.touch(chat.puid, chat.name)
+
+
+dispatcher = Dispatcher(handle_msgs,
+                        key=lambda msgs: msgs[0].chat.puid,
+                        workers=DISPATCH_WORKERS,
+                        queue_size=DISPATCH_QUEUE_SIZE,
+                        backpressure=DISPATCH_BACKPRESSURE,
+                        timeout=DISPATCH_TIMEOUT,
+                        size=len)
+outbox = SendQueue(send_job,
+                   on_done=send_done,
+                   on_failed=send_failed,
+                   workers=SEND_WORKERS,
+                   rate=SEND_RATE,
+                   burst=SEND_BURST,
+                   retries=SEND_RETRIES,
+                   backoff=SEND_BACKOFF,
+                   max_backoff=SEND_MAX_BACKOFF,
+                   journal=SendJournal(SEND_JOURNAL_FILE,
+                                       compact_every=SEND_JOURNAL_COMPACT))
+DIALOG_STEPS = {
+    'reply_digest': reply_digest,
+    'reply_file': reply_file,
+    'reply_img': reply_img,
+    'reply_msg': reply_msg,
+    'reply_video': reply_video,
+    'send_broadcast': send_broadcast,
+    'send_file': send_file,
+    'send_img': send_img,
+    'send_msg': send_msg,
+    'send_video': send_video
+}
+coalescer = Coalescer(dispatcher.submit,
+                      key=lambda msg: msg.chat.puid,
+                      window=COALESCE_WINDOW,
+                      max_window=COALESCE_MAX_WINDOW,
+                      mergeable=lambda msg: msg.type == wxpy.TEXT)
 
 
-@bot.register(except_self=False)
+@metrics.timed('get_msg')
 def get_msg(msg: wxpy.Message):
-    reply_msg(msg)
-    update_cache(msg.chat)
+    if dedup.seen(msg.id):
+        metrics.inc('duplicates_total')
+        return
+    history.record(msg)
+    if metrics.is_enabled():
+        metrics.observe('sync', time.time() - msg.create_time.timestamp())
+        metrics.inc('messages_total')
+    if rules.allows(msg):
+        if msg.sender != bot.self:
+            autoreplies.handle(msg)
+        coalescer.submit(msg)
 
 
 if __name__ == '__main__':
-    bot.enable_puid()
+    import keyboard
+    login()
+    start()
     thread = threading.Thread(target=bot.join)
     thread.start()
-    keyboard.add_hotkey('ctrl+alt+w', send_msg)
\ No newline at end of file
+    keyboard.add_hotkey('ctrl+alt+w', run_dialog, args=('send_msg', ))
\ No newline at end of file
@@ -0,0 +1,46 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import os
+import time
+
+from attachments import AttachmentStore
+
+
+def make_store(tmp_path, count: int) -> tuple:
+    root = tmp_path / 'Files'
+    files = []
+    for i in range(count):
+        shard = root / f'{i:02x}'
+        shard.mkdir(parents=True)
+        file = shard / f'{i:02x}{"0" * 14}_{i}.txt'
+        file.write_text(f'file {i}')
+        os.utime(file, (time.time() - 3600, time.time() - 3600 + i))
+        files.append(str(file))
+    store = AttachmentStore(str(root), max_bytes=0, max_age=60, min_age=0)
+    store.scan()
+    return store, files
+
+
+def test_scan_accounts_for_the_files_oldest_first(tmp_path):
+    store, files = make_store(tmp_path, 3)
+    assert list(store._files) == files
+    assert store.usage == sum(os.path.getsize(file) for file in files)
+
+
+def test_pinned_file_survives_compact(tmp_path):
+    store, files = make_store(tmp_path, 3)
+    store.pin(files[1])
+    removed = store.compact()
+    assert removed['files'] == 2
+    assert [os.path.exists(file) for file in files] == [False, True, False]
+    assert store.report()['pinned_files'] == 1
+
+    # The pin is kept across restarts until it is lifted.
+    store = AttachmentStore(store.root, max_bytes=0, max_age=60, min_age=0)
+    store.scan()
+    assert store.compact()['files'] == 0
+    store.pin(files[1], False)
+    assert store.compact()['files'] == 1
+    assert not os.path.exists(files[1])
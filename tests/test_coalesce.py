@@ -0,0 +1,78 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import threading
+import time
+from typing import Tuple
+
+from coalesce import Coalescer
+
+
+class Recorder:
+
+    def __init__(self) -> None:
+        self.emitted = []
+        self.event = threading.Event()
+
+    def __call__(self, msgs: list) -> None:
+        self.emitted.append((time.monotonic(), [msg for _, msg in msgs]))
+        self.event.set()
+
+
+def make_coalescer(window: float = 5.0) -> Tuple[Coalescer, Recorder]:
+    recorder = Recorder()
+    coalescer = Coalescer(recorder,
+                          key=lambda msg: msg[0],
+                          window=window,
+                          max_window=4 * window,
+                          mergeable=lambda msg: msg[1].startswith('text'))
+    coalescer.start()
+    return coalescer, recorder
+
+
+def test_unmergeable_message_is_emitted_at_once_after_the_buffer():
+    coalescer, recorder = make_coalescer()
+    for msg in ('text1', 'text2', 'text3'):
+        coalescer.submit(('chat', msg))
+    recorder.event.clear()
+    start = time.monotonic()
+    coalescer.submit(('chat', 'picture'))
+    assert recorder.event.wait(1.0)
+    while len(recorder.emitted) < 3:
+        time.sleep(0.001)
+    assert recorder.emitted[-1][0] - start < 0.5
+    coalescer.submit(('chat', 'text4'))
+    coalescer.submit(('chat', 'text5'))
+    coalescer.stop()
+    assert [msgs for _, msgs in recorder.emitted] == [
+        ['text1'],
+        ['text2', 'text3'],
+        ['picture'],
+        ['text4', 'text5'],
+    ]
+
+
+def test_texts_wait_for_the_window():
+    coalescer, recorder = make_coalescer(window=0.2)
+    start = time.monotonic()
+    for msg in ('text1', 'text2', 'text3'):
+        coalescer.submit(('chat', msg))
+    while len(recorder.emitted) < 2:
+        time.sleep(0.001)
+    assert recorder.emitted[1][0] - start >= 0.2
+    assert recorder.emitted[1][1] == ['text2', 'text3']
+    coalescer.stop()
+
+
+def test_chats_are_independent():
+    coalescer, recorder = make_coalescer()
+    coalescer.submit(('a', 'text1'))
+    coalescer.submit(('a', 'text2'))
+    coalescer.submit(('b', 'text1'))
+    coalescer.submit(('b', 'file'))
+    time.sleep(0.05)
+    assert [msgs for _, msgs in recorder.emitted] == [['text1'], ['text1'],
+                                                      ['file']]
+    coalescer.stop()
+    assert recorder.emitted[-1][1] == ['text2']
@@ -0,0 +1,40 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+from contacts import ContactIndex, SavedChat
+
+
+def make_index() -> ContactIndex:
+    index = ContactIndex()
+    index.build([
+        SavedChat({
+            'puid': puid,
+            'name': name
+        }) for puid, name in (('p1', 'Bob'), ('p2', 'Alice Wang'),
+                              ('p3', 'Project Team'))
+    ])
+    return index
+
+
+def names(chats) -> list:
+    return sorted(chat.name for chat in chats)
+
+
+def test_exact_puid_and_prefix_lookups():
+    index = make_index()
+    assert names(index.search('p2')) == ['Alice Wang']
+    assert names(index.search('bob')) == ['Bob']
+    assert names(index.search('Proj')) == ['Project Team']
+
+
+def test_typo_finds_nothing_unless_fuzzy():
+    index = make_index()
+    assert index.search('Rob') == []
+    assert names(index.search('Rob', fuzzy=True)) == ['Bob']
+
+
+def test_ambiguous_prefix_finds_every_chat():
+    index = make_index()
+    index.update(SavedChat({'puid': 'p4', 'name': 'Bobby'}))
+    assert names(index.search('bo')) == ['Bob', 'Bobby']
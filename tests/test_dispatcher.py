@@ -0,0 +1,102 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import threading
+import time
+
+from bench import fakes
+from dispatcher import Dispatcher
+from notifier import HeadlessNotifier
+
+TOAST_SECONDS = 0.02
+
+
+def make_dispatcher(handler, **kwargs) -> Dispatcher:
+    dispatcher = Dispatcher(handler,
+                            key=lambda msg: msg.chat.puid,
+                            workers=4,
+                            queue_size=16,
+                            **kwargs)
+    dispatcher.start()
+    return dispatcher
+
+
+def test_submit_latency_stays_flat_under_burst():
+    bot = fakes.Bot()
+    notifier = HeadlessNotifier(delay=TOAST_SECONDS)
+    dispatcher = make_dispatcher(lambda msg: notifier.toast(msg.text))
+    latencies = []
+    for _ in range(2000):
+        msg = bot.message(fakes.TEXT)
+        start = time.perf_counter()
+        assert dispatcher.submit(msg)
+        latencies.append(time.perf_counter() - start)
+    dispatcher.stop()
+
+    # Every toast blocks, so the queues overflowed and the oldest messages
+    # were dropped instead of holding up the receiving thread.
+    assert dispatcher.dropped > 0
+    assert len(notifier.shown) + dispatcher.dropped == 2000
+    first = sorted(latencies[:500])
+    last = sorted(latencies[-500:])
+    assert last[int(len(last) * 0.99)] < 0.002
+    assert last[len(last) // 2] < 10 * first[len(first) // 2] + 1e-4
+
+
+def test_block_policy_waits_at_most_the_timeout():
+    release = threading.Event()
+    dispatcher = make_dispatcher(lambda msg: release.wait(),
+                                 backpressure='block',
+                                 timeout=0.05)
+    chat = fakes.Bot().friends[0]
+    results = []
+    start = time.perf_counter()
+    for _ in range(20):
+        results.append(dispatcher.submit(fakes.Message(chat.bot, 0, chat,
+                                                       fakes.TEXT)))
+    elapsed = time.perf_counter() - start
+    release.set()
+    dispatcher.stop()
+
+    # One message is being handled and 16 wait in the queue of the chat.
+    assert results.count(True) == 17
+    assert dispatcher.dropped == 3
+    assert elapsed < 3 * 0.05 + 0.1
+
+
+def test_messages_of_a_chat_keep_their_order():
+    bot = fakes.Bot()
+    handled = {}
+    dispatcher = make_dispatcher(
+        lambda msg: handled.setdefault(msg.chat.puid, []).append(msg.id),
+        backpressure='block',
+        timeout=10)
+    sent = {}
+    for i in range(1000):
+        msg = bot.message(fakes.TEXT, bot.friends[i % 8])
+        sent.setdefault(msg.chat.puid, []).append(msg.id)
+        dispatcher.submit(msg)
+    dispatcher.stop()
+    assert handled == sent
+
+
+def test_dropped_counts_the_messages_of_a_burst():
+    release = threading.Event()
+    dispatcher = Dispatcher(lambda msgs: release.wait(),
+                            key=lambda msgs: msgs[0].chat.puid,
+                            workers=1,
+                            queue_size=1,
+                            size=len)
+    dispatcher.start()
+    bot = fakes.Bot()
+    chat = bot.friends[0]
+    for count in (1, 2, 3, 4):
+        dispatcher.submit([bot.message(fakes.TEXT, chat)] * count)
+        time.sleep(0.05)
+    release.set()
+    dispatcher.stop()
+
+    # The first burst is being handled, the second and third are dropped for
+    # the next ones and the last one waits in the queue.
+    assert dispatcher.dropped == 2 + 3
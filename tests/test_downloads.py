@@ -0,0 +1,177 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from downloads import Downloader
+
+DATA = os.urandom(3 << 20)
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class StandIn:
+    """A local server for one file, which can drop connections, ignore
+    ranges and corrupt the bytes it sends.
+    """
+
+    def __init__(self) -> None:
+        self.drops = 0
+        self.ranges = True
+        self.corrupt = 0
+        self.requests = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                with stand_in.lock:
+                    stand_in.active += 1
+                    stand_in.peak = max(stand_in.peak, stand_in.active)
+                try:
+                    stand_in.serve(self)
+                finally:
+                    with stand_in.lock:
+                        stand_in.active -= 1
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/file'
+        threading.Thread(target=self.server.serve_forever,
+                         args=(0.05, ),
+                         daemon=True).start()
+
+    def serve(self, handler: BaseHTTPRequestHandler) -> None:
+        range = handler.headers.get('Range')
+        self.requests.append(range)
+        start = 0
+        if range and self.ranges:
+            start = int(re.match(r'bytes=(\d+)-', range).group(1))
+            if start >= len(DATA):
+                handler.send_response(416)
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+            handler.send_response(206)
+            handler.send_header('Content-Range',
+                                f'bytes {start}-{len(DATA) - 1}/{len(DATA)}')
+        else:
+            handler.send_response(200)
+        body = DATA[start:]
+        if self.corrupt:
+            self.corrupt -= 1
+            body = bytes([body[0] ^ 1]) + body[1:]
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if self.drops:
+            self.drops -= 1
+            handler.wfile.write(body[:len(body) // 3])
+            handler.wfile.flush()
+            handler.connection.shutdown(2)
+            return
+        handler.wfile.write(body)
+
+
+@pytest.fixture
+def stand_in():
+    stand_in = StandIn()
+    yield stand_in
+    stand_in.server.shutdown()
+    stand_in.server.server_close()
+
+
+@pytest.fixture
+def downloader():
+    return Downloader(workers=2, backoff=0.01, timeout=5)
+
+
+def read(file) -> bytes:
+    with open(file, 'rb') as f:
+        return f.read()
+
+
+def test_dropped_download_resumes_with_a_range(stand_in, downloader,
+                                                tmp_path):
+    stand_in.drops = 1
+    file = tmp_path / 'file'
+    downloader.fetch(stand_in.url, str(file), len(DATA), MD5)
+    assert read(file) == DATA
+    assert stand_in.requests == [None, f'bytes={len(DATA) // 3}-']
+
+
+def test_download_restarts_when_the_range_is_ignored(stand_in, downloader,
+                                                     tmp_path):
+    stand_in.drops = 1
+    stand_in.ranges = False
+    file = tmp_path / 'file'
+    downloader.fetch(stand_in.url, str(file), md5=MD5)
+    assert read(file) == DATA
+    assert stand_in.requests == [None, f'bytes={len(DATA) // 3}-']
+
+
+def test_oversized_partial_file_is_downloaded_again(stand_in, downloader,
+                                                    tmp_path):
+    file = tmp_path / 'file'
+    file.write_bytes(DATA + b'extra')
+    downloader.fetch(stand_in.url, str(file), md5=MD5)
+    assert read(file) == DATA
+    assert stand_in.requests == [f'bytes={len(DATA) + 5}-', None]
+
+
+def test_short_download_is_never_complete(stand_in, downloader, tmp_path):
+    stand_in.drops = 10
+    file = tmp_path / 'file'
+    with pytest.raises(OSError, match='stopped at'):
+        downloader.fetch(stand_in.url, str(file), len(DATA))
+    assert 0 < os.path.getsize(file) < len(DATA)
+
+
+def test_size_mismatch_removes_the_file(stand_in, downloader, tmp_path):
+    file = tmp_path / 'file'
+    with pytest.raises(OSError, match='instead of'):
+        downloader.fetch(stand_in.url, str(file), len(DATA) - 1)
+    assert not file.exists()
+
+
+def test_md5_mismatch_is_downloaded_again(stand_in, downloader, tmp_path):
+    stand_in.corrupt = 1
+    file = tmp_path / 'file'
+    downloader.fetch(stand_in.url, str(file), len(DATA), MD5)
+    assert read(file) == DATA
+    assert stand_in.requests == [None, None]
+
+
+def test_persistent_md5_mismatch_fails_and_removes_the_file(
+        stand_in, downloader, tmp_path):
+    stand_in.corrupt = 10
+    file = tmp_path / 'file'
+    with pytest.raises(OSError, match='MD5 mismatch'):
+        downloader.fetch(stand_in.url, str(file), len(DATA), MD5)
+    assert not file.exists()
+
+
+def test_concurrent_downloads_are_bounded(stand_in, downloader, tmp_path):
+    files = [str(tmp_path / f'file{i}') for i in range(6)]
+    threads = [
+        threading.Thread(target=downloader.fetch,
+                         args=(stand_in.url, file, len(DATA), MD5))
+        for file in files
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert stand_in.peak <= 2
+    assert all(read(file) == DATA for file in files)
@@ -0,0 +1,72 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import sqlite3
+import time
+
+import pytest
+
+from history import History
+
+TEXTS = ('明天开会吧', 'Hello World', '会', 'a', 'xx 开 会')
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = History(str(tmp_path / 'history.db'), flush_interval=0.01)
+    history.start()
+    for i, text in enumerate(TEXTS):
+        history.add((str(i), i, f'chat{i % 2}', 'Chat', 'sender', 'Text', text,
+                     None))
+    history.flush()
+    yield history
+    history.stop()
+
+
+def texts(rows) -> list:
+    return sorted(row['text'] for row in rows)
+
+
+@pytest.mark.parametrize('query, found', [
+    ('开会', ['明天开会吧']),
+    ('会', ['xx 开 会', '会', '明天开会吧']),
+    ('hE', ['Hello World']),
+    ('o w', ['Hello World']),
+    ('a', ['a']),
+    ('稀有', []),
+])
+def test_search(history, query, found):
+    assert texts(history.search(query)) == sorted(found)
+
+
+def test_short_search_in_chat(history):
+    assert texts(history.search('会', 'chat0')) == ['xx 开 会', '会', '明天开会吧']
+    assert texts(history.search('开会', 'chat1')) == []
+
+
+def test_short_index_is_built_for_an_old_database(history):
+    if not history.trigram:
+        pytest.skip('SQLite has no trigram tokenizer')
+    history.stop()
+    db = sqlite3.connect(history.file)
+    db.execute('DROP TRIGGER messages_short_insert')
+    db.execute('DROP TABLE messages_short')
+    db.commit()
+    db.close()
+    history = History(history.file, batch_size=2, flush_interval=0.01)
+    history._open()
+    assert history._backfill == len(TEXTS)
+    assert texts(history.search('开会')) == ['明天开会吧']
+    assert texts(history.search('%')) == []
+    history.start()
+    deadline = time.monotonic() + 5
+    while history._backfill is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert history._backfill is None
+    assert texts(history.search('开会')) == ['明天开会吧']
+    assert texts(history.search('会', 'chat0')) == ['xx 开 会', '会', '明天开会吧']
+    history.stop()
+    history = History(history.file)
+    history._open()
+    assert history._backfill is None
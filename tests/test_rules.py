@@ -0,0 +1,24 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+from bench import fakes
+from rules import RuleSet, message_fields
+
+
+def test_senders_of_a_friend_chat():
+    bot = fakes.Bot()
+    friend = bot.friends[0]
+    msg = bot.message(fakes.TEXT, friend)
+    assert message_fields(msg)[2] == (friend.puid, friend.name)
+    msg.sender = bot.self
+    assert message_fields(msg)[2] == (bot.self.puid, bot.self.name)
+
+
+def test_senders_of_a_group_chat():
+    bot = fakes.Bot()
+    msg = bot.message(fakes.TEXT, bot.groups[0])
+    assert message_fields(msg)[2] == (msg.member.puid, msg.member.name)
+    rules = RuleSet([{'senders': [msg.member.puid], 'action': 'deny'}])
+    assert not rules.allows(msg)
+    assert rules.allows(bot.message(fakes.TEXT, bot.friends[0]))
@@ -0,0 +1,83 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import atexit
+import sqlite3
+import sys
+
+import pytest
+
+from bench import fakes
+from dialog import Dialog
+from notifier import HeadlessNotifier
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path_factory.mktemp('server'))
+        patch.setitem(sys.modules, 'wxpy', fakes)
+        patch.setitem(sys.modules, 'keyboard', None)
+        import config
+        patch.setattr(config, 'NOTIFIER', 'headless')
+        patch.setattr(config, 'COALESCE_WINDOW', 0)
+        patch.setattr(config, 'DISPATCH_WORKERS', 1)
+        patch.setattr(config, 'DISPATCH_QUEUE_SIZE', 2)
+        patch.setattr(config, 'DISPATCH_BACKPRESSURE', 'drop_oldest')
+        import utils
+        from clipboard import MemoryClipboard
+        backends = utils.notifier, utils.clipboard
+        utils.use_backends(HeadlessNotifier(delay=0.01), MemoryClipboard())
+        import server
+        server.login()
+        server.start()
+        yield server
+        server.coalescer.stop()
+        server.dispatcher.stop()
+        server.outbox.stop()
+        server.history.stop()
+        server.bot.logout()
+        atexit.unregister(server.recent.save)
+        atexit.unregister(server.history.stop)
+        utils.use_backends(*backends)
+        del sys.modules['server']
+
+
+def test_dropped_messages_are_recorded(server):
+    bot = server.bot
+    chat = bot.friends[0]
+    msgs = [bot.message(fakes.TEXT, chat) for _ in range(50)]
+    for msg in msgs:
+        bot.deliver(msg)
+    server.history.flush()
+    assert server.dispatcher.dropped > 0
+    db = sqlite3.connect(server.history.file)
+    ids = {row[0] for row in db.execute('SELECT msg_id FROM messages')}
+    db.close()
+    assert ids >= {str(msg.id) for msg in msgs}
+
+
+def test_ask_chat_takes_a_result_that_is_not_a_dict(server):
+    import utils
+    notifier = utils.notifier
+    utils.use_backends(HeadlessNotifier(lambda text, kwargs: None))
+    try:
+        dialog = Dialog(server.DIALOG_STEPS)
+        assert server.ask_chat(dialog, 'Send a message',
+                               'Enter the message here...', []) == {}
+        assert dialog.chat is None
+        assert server.run_dialog('send_msg') is None
+    finally:
+        utils.use_backends(notifier)
+
+
+def test_api_pins_a_file(server, tmp_path):
+    file = tmp_path / 'kept.txt'
+    file.write_text('kept')
+    with pytest.raises(ValueError):
+        server.api_pin(str(tmp_path / 'missing.txt'))
+    assert server.api_pin(str(file)) == {'file': str(file), 'pinned': True}
+    assert str(file) in server.attachments._pinned
+    server.api_pin(str(file), False)
+    assert str(file) not in server.attachments._pinned
@@ -0,0 +1,68 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import threading
+import time
+
+from uploads import MediaCache
+
+
+def make_files(tmp_path, count: int) -> list:
+    files = []
+    for i in range(count):
+        file = tmp_path / f'{i}.txt'
+        file.write_text(f'file {i}')
+        files.append(str(file))
+    return files
+
+
+def test_copies_share_one_upload(tmp_path):
+    uploads = []
+    cache = MediaCache(
+        lambda file: uploads.append(file) or f'id{len(uploads)}')
+    first, copy = tmp_path / 'a.txt', tmp_path / 'b.txt'
+    first.write_text('same')
+    copy.write_text('same')
+    assert cache.get(str(first)) == cache.get(str(copy)) == 'id1'
+    assert len(uploads) == 1
+
+
+def test_concurrent_gets_upload_once_and_release_the_lock(tmp_path):
+    uploads = []
+
+    def upload(file: str) -> str:
+        time.sleep(0.05)
+        uploads.append(file)
+        return 'id'
+
+    cache = MediaCache(upload)
+    file = make_files(tmp_path, 1)[0]
+    threads = [
+        threading.Thread(target=cache.get, args=(file, )) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(uploads) == 1
+    assert cache._uploading == {}
+
+
+def test_expired_ids_are_dropped(tmp_path):
+    cache = MediaCache(lambda file: 'id', ttl=0.05)
+    files = make_files(tmp_path, 20)
+    for file in files:
+        cache.get(file)
+    assert len(cache._ids) == 20
+    time.sleep(0.06)
+    cache.get(files[0])
+    assert len(cache._ids) == 1
+
+
+def test_digests_are_bounded(tmp_path):
+    cache = MediaCache(lambda file: 'id', max_files=5)
+    files = make_files(tmp_path, 20)
+    for file in files:
+        cache.get(file)
+    assert list(cache._digests) == files[-5:]
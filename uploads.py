@@ -0,0 +1,155 @@
+# Copyright (C) 2023. Weilong Guan.
+
+# See <server.py> for a full notice of the GPL-3 License.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+from attachments import hash_file
+import metrics
+
+
+class MediaCache:
+    """Upload each file once and reuse its WeChat media_id.
+
+    Media ids are keyed by the SHA-256 digest and size of the file, so a copy
+    of a file at another path reuses the same upload. The digest of a path is
+    remembered together with its size and modification time, so a large file
+    is hashed again only when it changes, for the last `max_files` paths
+    used. Entries expire after `ttl` seconds because WeChat forgets uploaded
+    media after a while, and are dropped once expired. Uploads of the same
+    file wait for each other, through a lock kept only while an upload is
+    running or waited for.
+    """
+
+    def __init__(self,
+                 upload: Callable[[str], str],
+                 ttl: float = 21600,
+                 max_files: int = 1024) -> None:
+        """Create an empty cache.
+
+        Args:
+            upload (Callable[[str], str]): Uploads a file and returns its
+                media_id, usually `wxpy.Bot.upload_file`.
+            ttl (float, optional): Seconds a media_id is trusted. Defaults to
+                6 hours.
+            max_files (int, optional): Number of paths whose digest is
+                remembered. Defaults to 1024.
+        """
+        self.upload = upload
+        self.ttl = ttl
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._digests: 'OrderedDict[str, Tuple[int, int, Tuple[str, int]]]' = \
+            OrderedDict()
+        self._ids: 'OrderedDict[Tuple[str, int], Tuple[str, float]]' = \
+            OrderedDict()
+        self._uploading: Dict[Tuple[str, int], List] = {}
+
+    def get(self, file: str) -> str:
+        """Get a valid media_id for a file, uploading it if needed.
+
+        Args:
+            file (str): The path of the file.
+
+        Returns:
+            str: The media_id.
+        """
+        key = self.key(file)
+        with self._lock:
+            uploading = self._uploading.get(key)
+            if uploading is None:
+                uploading = self._uploading[key] = [threading.Lock(), 0]
+            uploading[1] += 1
+        try:
+            with uploading[0]:
+                with self._lock:
+                    self._expire(time.monotonic())
+                    entry = self._ids.get(key)
+                    if entry is not None:
+                        return entry[0]
+                with metrics.span('upload'):
+                    media_id = self.upload(file)
+                metrics.inc('uploads_total')
+                metrics.inc('upload_bytes_total', key[1])
+                with self._lock:
+                    self._ids[key] = (media_id, time.monotonic() + self.ttl)
+                    self._ids.move_to_end(key)
+                return media_id
+        finally:
+            with self._lock:
+                uploading[1] -= 1
+                if not uploading[1]:
+                    del self._uploading[key]
+
+    def invalidate(self, file: str) -> None:
+        """Forget the media_id of a file.
+
+        Args:
+            file (str): The path of the file.
+        """
+        key = self.key(file)
+        with self._lock:
+            self._ids.pop(key, None)
+
+    def key(self, file: str) -> Tuple[str, int]:
+        """Get the cache key of a file.
+
+        Args:
+            file (str): The path of the file.
+
+        Returns:
+            Tuple[str, int]: The digest and size of the file.
+        """
+        file = os.path.abspath(file)
+        stat = os.stat(file)
+        with self._lock:
+            entry = self._digests.get(file)
+            if entry is not None and entry[:2] == (stat.st_size,
+                                                   stat.st_mtime_ns):
+                self._digests.move_to_end(file)
+                return entry[2]
+        key = (hash_file(file), stat.st_size)
+        with self._lock:
+            self._digests[file] = (stat.st_size, stat.st_mtime_ns, key)
+            self._digests.move_to_end(file)
+            while len(self._digests) > self.max_files:
+                self._digests.popitem(last=False)
+        return key
+
+    def send(self, send: Callable[..., Any], file: str) -> Any:
+        """Send a file by its media_id. If WeChat rejects a cached media_id,
+        the file is uploaded again and sent once more.
+
+        Args:
+            send (Callable[..., Any]): A bound sending method such as
+                `wxpy.Chat.send_image`.
+            file (str): The path of the file.
+
+        Returns:
+            Any: What `send` returns.
+        """
+        key = self.key(file)
+        with self._lock:
+            self._expire(time.monotonic())
+            cached = key in self._ids
+        media_id = self.get(file)
+        try:
+            with metrics.span('send'):
+                return send(file, media_id=media_id)
+        except Exception:
+            if not cached:
+                raise
+            metrics.error('media_id')
+        self.invalidate(file)
+        return send(file, media_id=self.get(file))
+
+    def _expire(self, now: float) -> None:
+        while self._ids:
+            key, (_, expires) = next(iter(self._ids.items()))
+            if now < expires:
+                break
+            del self._ids[key]
@@ -5,53 +5,79 @@
 import os
 from typing import Union
 
-import win11toast
-import win32clipboard
-from PIL.Image import Image
-from PIL.ImageGrab import grabclipboard
-    
+from clipboard import Clipboard, ClipboardImages, MemoryClipboard, WinClipboard
+from config import (CLIPBOARD_DIR, CLIPBOARD_FORMAT, CLIPBOARD_MAX_SIZE,
+                    CLIPBOARD_QUALITY, CLIPBOARD_TTL, NOTIFIER)
+import metrics
+from notifier import HeadlessNotifier, Notifier, Win11Notifier
+
+if NOTIFIER == 'headless':
+    notifier: Notifier = HeadlessNotifier()
+    clipboard: Clipboard = MemoryClipboard()
+else:
+    notifier = Win11Notifier()
+    clipboard = WinClipboard()
+images = ClipboardImages(CLIPBOARD_DIR,
+                         format=CLIPBOARD_FORMAT,
+                         quality=CLIPBOARD_QUALITY,
+                         max_size=CLIPBOARD_MAX_SIZE,
+                         ttl=CLIPBOARD_TTL)
+
 
 def get_file_from_clipboard() -> Union[str, None]:
     """Get the path to the file copied into the clipboard.
 
     Returns:
         Union[str, None]: The file path. None if the file is invalid.
-    """    
-    win32clipboard.OpenClipboard()
-    formats = []
-    format = win32clipboard.EnumClipboardFormats(0)
-    while format:
-        formats.append(format)
-        format = win32clipboard.EnumClipboardFormats(format)
-    if win32clipboard.CF_HDROP in formats:
-        file = win32clipboard.GetClipboardData(
-            win32clipboard.CF_HDROP)[0]
-        win32clipboard.CloseClipboard()
-        return file
-    else:
-        win32clipboard.CloseClipboard()
-        return None
-    
+    """
+    return clipboard.get_file()
+
 
 def get_img_from_clipboard() -> Union[str, None]:
     """Save the image copied inside the clipboard into a temporary file and
-    return its path.
+    return its path. The same image copied again gives the same file.
 
     Returns:
         Union[str, None]: The path to the generated image file. None if the
         image is invalid.
-    """    
-    img = grabclipboard()
-    if isinstance(img, Image):
-        file = os.path.abspath(os.path.join('Files', 'temp.png'))
-        img.save(file)
-        return file
+    """
+    img = clipboard.get_image()
+    if img is not None:
+        return images.save(img)
     else:
         return None
 
 
+def get_text_from_clipboard() -> str:
+    """Get the text copied into the clipboard.
+
+    Returns:
+        str: The text.
+    """
+    return clipboard.get_text()
+
+
+def notify(text: str) -> None:
+    """Show a toast notification without waiting for it to be dismissed.
+
+    Args:
+        text (str): Main text of the notification.
+    """
+    notifier.notify(text)
+
+
+def notify_progress(text: str) -> None:
+    """Show a toast notification with an indeterminate progress bar without
+    waiting for it to be dismissed.
+
+    Args:
+        text (str): Main text of the notification.
+    """
+    notifier.notify_progress(text)
+
+
 def toast(text: str, **kwargs) -> dict:
-    """Send a toast notification to the Windows 11 Action Center.
+    """Send a toast notification through the notification backend.
 
     Args:
         text (str): Main text of the notification.
@@ -59,4 +85,32 @@ def toast(text: str, **kwargs) -> dict:
     Returns:
         dict: A dictionary containing the result of the notification.
     """
-    return win11toast.toast('WeChat', text, duration='long', **kwargs)
\ No newline at end of file
+    with metrics.span('toast'):
+        return notifier.toast(text, **kwargs)
+
+
+def update_progress(value: float, status: str) -> None:
+    """Update the progress bar shown by `notify_progress`.
+
+    Args:
+        value (float): The progress between 0 and 1.
+        status (str): The status text below the bar.
+    """
+    notifier.update_progress(value, status)
+
+
+def use_backends(new_notifier: Union[Notifier, None] = None,
+                 new_clipboard: Union[Clipboard, None] = None) -> None:
+    """Replace the notification or clipboard backend.
+
+    Args:
+        new_notifier (Union[Notifier, None], optional): The new notification
+            backend. Defaults to None, keeping the current one.
+        new_clipboard (Union[Clipboard, None], optional): The new clipboard
+            backend. Defaults to None, keeping the current one.
+    """
+    global notifier, clipboard
+    if new_notifier is not None:
+        notifier = new_notifier
+    if new_clipboard is not None:
+        clipboard = new_clipboard